@@ -0,0 +1,287 @@
+"""
+Created on Oct 18, 2026
+@author: Souvik
+@Program Function: Benchmarks for the data pipeline
+
+
+"""
+
+import os
+import time
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import dates
+import pandas as pd
+from datadbhandler import DataDB
+
+
+def timed(func, *args, repeat=3, **kwargs):
+    """
+    Run func repeat times
+    :return: (best elapsed seconds, result of last run)
+    """
+
+    best, result = None, None
+    for i in range(repeat):
+        start_time = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
+
+
+def bench_date_conversion(rows=200000, distinct=20):
+    """
+    Compare scalar Series.apply date conversion with the distinct value Series conversion
+    :param rows: number of rows in the sample column, a full bhavcopy history has a few million
+    :param distinct: number of distinct dates in the column
+    """
+
+    sample_dates = dates.dates('2017-01-01', '2017-12-31')[:distinct]
+    conversions = [('ddMMMyyyy_to_yyyy_mm_dd', [dates.ddMMMyyyy(d) for d in sample_dates],
+                    dates.ddMMMyyyy_to_yyyy_mm_dd, dates.ddMMMyyyy_to_yyyy_mm_dd_series),
+                   ('dd_MMM_yyyy_to_yyyy_mm_dd', ['{} {} {}'.format(d[8:10], dates.MMM(d), d[0:4]) for d in sample_dates],
+                    dates.dd_MMM_yyyy_to_yyyy_mm_dd, dates.dd_MMM_yyyy_to_yyyy_mm_dd_series),
+                   ('mm_dd_yyyy_to_yyyy_mm_dd', ['{}/{}/{}'.format(d[5:7], d[8:10], d[0:4]) for d in sample_dates],
+                    dates.mm_dd_yyyy_to_yyyy_mm_dd, dates.mm_dd_yyyy_to_yyyy_mm_dd_series),
+                   ('yyyy_mm_dd_to_yyyymmdd', sample_dates,
+                    dates.yyyy_mm_dd_to_yyyymmdd, dates.yyyy_mm_dd_to_yyyymmdd_series)]
+
+    print('Date conversion of {} rows with {} distinct values'.format(rows, distinct))
+
+    for name, values, scalar, series in conversions:
+        column = pd.Series([random.choice(values) for i in range(rows)])
+
+        scalar_time, scalar_result = timed(column.apply, scalar)
+        series_time, series_result = timed(series, column)
+
+        assert scalar_result.equals(series_result)
+        print('{:28} apply {:8.4f}s  series {:8.4f}s  speedup {:6.1f}x'.format(
+            name, scalar_time, series_time, scalar_time / series_time))
+
+
+def bench_date_range(start='1980-01-01', end='2020-12-31'):
+    """
+    Time multi decade date range and missing date generation
+    """
+
+    all_time, all_dates = timed(dates.dates, start, end)
+    weekday_time, weekday_dates = timed(dates.dates, start, end, dates.WEEKDAYS)
+    missing_time, missing = timed(dates.missing_dates, weekday_dates[::2], dates.WEEKDAYS)
+
+    print('dates {} - {}: all days {} in {:.4f}s, weekdays {} in {:.4f}s, missing weekdays {} in {:.4f}s'.format(
+        start, end, len(all_dates), all_time, len(weekday_dates), weekday_time, len(missing), missing_time))
+
+
+def run_stages(db):
+    """
+    Time the contract building stages on db, tables written by the stages are rebuilt from scratch
+    :return: {stage: elapsed seconds}
+    """
+
+    def truncate_and_run(table_name, func, *args):
+        db.conn.execute('DELETE FROM {}'.format(table_name))
+        db.conn.commit()
+        func(*args)
+
+    stages = [('trading days', db.set_trading_day_idx, []),
+              ('write expiries', db.write_expiries, []),
+              ('continuous contracts', truncate_and_run, ['tblFutures', db.create_continuous_contracts]),
+              ('missed records', db.manage_missed_records, []),
+              ('update continuous contract', db.update_continuous_contract, []),
+              ('expiry sanity check', db.expiry_sanity_check, []),
+              ('historical multipliers', db.calculate_historical_multipliers, ['refresh']),
+              ('adjusted contract', truncate_and_run, ['tblContract', db.create_adjusted_contract])]
+
+    timings = dict()
+    for stage, func, args in stages:
+        timings[stage] = timed(func, *args, repeat=1)[0]
+
+    return timings
+
+
+def bench_schema(db_path):
+    """
+    Compare each stage on a copy of db_path without the managed indexes and pragmas (before)
+    and on a copy with the managed schema and pragmas (after)
+    :param db_path: populated Bhavcopy DB, left unchanged
+    """
+
+    work_path = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    timings = dict()
+
+    try:
+        os.chdir(work_path)  # stages write their csv files in the working directory
+        for run in ['before', 'after']:
+            run_db_path = '{}/{}.db'.format(work_path, run)
+            shutil.copyfile(db_path, run_db_path)
+
+            if run == 'before':
+                conn = sqlite3.connect(run_db_path)
+                indexes = [row[0] for row in conn.execute(
+                    '''SELECT name FROM sqlite_master WHERE type = "index" AND sql IS NOT NULL''')]
+                for index in indexes:
+                    conn.execute('DROP INDEX `{}`'.format(index))
+                conn.execute('CREATE INDEX `idxDump` ON `tblDump` ( `Symbol`, `Date`, `ExpiryDate`, `InstrumentName` )')
+                conn.execute('PRAGMA user_version = 0')
+                conn.execute('PRAGMA journal_mode = DELETE')
+                conn.commit()
+                conn.close()
+                db = DataDB(run_db_path, manage_schema=False)
+            else:
+                db = DataDB(run_db_path)
+
+            timings[run] = run_stages(db)
+            del db
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_path, ignore_errors=True)
+
+    print('{:28} {:>10} {:>10} {:>8}'.format('stage', 'before', 'after', 'speedup'))
+    for stage in timings['before']:
+        before, after = timings['before'][stage], timings['after'][stage]
+        print('{:28} {:9.3f}s {:9.3f}s {:7.1f}x'.format(stage, before, after, before / after if after > 0 else 0))
+
+
+def bench_sweep(db_path, deltas=[0, 1, 2, 3, 5, 7, 10]):
+    """
+    Compare one continuous contract build per delta with a single sweep over all deltas
+    :param db_path: populated Bhavcopy DB, tblFutures is left unchanged
+    """
+
+    db = DataDB(db_path)
+    db.set_trading_day_idx()
+    symbols = db.unique_symbols()
+    sweep_file = tempfile.mktemp(suffix='.pkl')
+
+    def separate_builds():
+        return [db.continuous_contract_records(symbols, delta) for delta in deltas]
+
+    separate_time = timed(separate_builds, repeat=1)[0]
+    sweep_time = timed(db.sweep_continuous_contracts, deltas, symbols, file=sweep_file, repeat=1)[0]
+    os.remove(sweep_file)
+
+    print('{} deltas: separate builds {:.3f}s, sweep {:.3f}s, speedup {:.1f}x'.format(
+        len(deltas), separate_time, sweep_time, separate_time / sweep_time))
+
+
+def checkout_source(path, ref=None):
+    """
+    Write the source folder of a git ref of this repo to path, to run an earlier implementation side by side
+    :param path: folder to write the source files in
+    :param ref: git ref, the first commit of the repo if None
+    :return: path
+    """
+
+    repo = os.path.dirname(os.path.abspath(__file__))
+    if ref is None:
+        ref = subprocess.check_output(['git', 'rev-list', '--max-parents=0', 'HEAD'], cwd=repo,
+                                      text=True).split()[0]
+
+    files = subprocess.check_output(['git', 'ls-tree', '--full-tree', '--name-only', ref, 'source/'], cwd=repo,
+                                    text=True).split()
+    for file in files:
+        with open(os.path.join(path, os.path.basename(file)), 'wb') as f:
+            f.write(subprocess.check_output(['git', 'show', '{}:{}'.format(ref, file)], cwd=repo))
+
+    return path
+
+
+# Run in a separate process with the earlier source first on sys.path, prints the elapsed seconds on an
+# 'elapsed' line as DataDB prints its own progress
+MISSED_RECORDS_SCRIPT = """
+import sys, time
+sys.path.insert(0, sys.argv[1])
+from datadbhandler import DataDB
+db = DataDB('db.db')
+start_time = time.perf_counter()
+db.manage_missed_records()
+print('elapsed', time.perf_counter() - start_time)
+"""
+
+
+def bench_missed_records(db_path, ref=None):
+    """
+    Compare the in memory manage_missed_records with the per date SQL implementation of an earlier git ref on
+    copies of db_path and check both select the same records
+    :param db_path: populated Bhavcopy DB, left unchanged
+    :param ref: git ref of the earlier implementation, the first commit of the repo if None
+    """
+
+    work_path = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    outputs = dict()
+
+    try:
+        for run in ['before', 'after']:
+            os.mkdir(os.path.join(work_path, run))
+            shutil.copyfile(db_path, os.path.join(work_path, run, 'db.db'))
+
+        source_path = checkout_source(tempfile.mkdtemp(dir=work_path), ref)
+        output = subprocess.check_output([sys.executable, '-c', MISSED_RECORDS_SCRIPT, source_path],
+                                         cwd=os.path.join(work_path, 'before'), text=True)
+        before = float([line for line in output.splitlines() if line.startswith('elapsed')][0].split()[1])
+
+        os.chdir(os.path.join(work_path, 'after'))  # stages write their csv files in the working directory
+        db = DataDB('db.db')
+        db.set_trading_day_idx()
+        after = timed(db.manage_missed_records, repeat=1)[0]
+        del db
+
+        for run in ['before', 'after']:
+            outputs[run] = [open(os.path.join(work_path, run, file)).read()
+                            for file in [DataDB.SELECTED_RECORDS_FILE, DataDB.ELIGIBLE_RECORDS_FILE]]
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_path, ignore_errors=True)
+
+    print('manage missed records: sql {:.3f}s, in memory {:.3f}s, speedup {:.1f}x, same records {}'.format(
+        before, after, before / after, outputs['before'] == outputs['after']))
+
+
+def bench_workers(db_path, workers=os.cpu_count()):
+    """
+    Compare the contract building stages in this process and spread over worker processes on copies of db_path
+    and check both write the same tables
+    :param db_path: populated Bhavcopy DB, left unchanged
+    """
+
+    work_path = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    timings, tables = dict(), dict()
+
+    try:
+        os.chdir(work_path)  # stages write their csv files in the working directory
+        for run in [1, workers]:
+            run_db_path = '{}/{}.db'.format(work_path, run)
+            shutil.copyfile(db_path, run_db_path)
+            db = DataDB(run_db_path, workers=run)
+
+            timings[run] = run_stages(db)
+            tables[run] = [pd.read_sql_query('SELECT * FROM {} ORDER BY rowid'.format(table), db.conn)
+                           for table in ['tblFutures', 'tblMultipliers', 'tblContract']]
+            del db
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_path, ignore_errors=True)
+
+    print('{:28} {:>10} {:>10} {:>8}'.format('stage', '1 worker', '{} workers'.format(workers), 'speedup'))
+    for stage in timings[1]:
+        before, after = timings[1][stage], timings[workers][stage]
+        print('{:28} {:9.3f}s {:9.3f}s {:7.1f}x'.format(stage, before, after, before / after if after > 0 else 0))
+    print('same tables', all(a.equals(b) for a, b in zip(tables[1], tables[workers])))
+
+
+if __name__ == '__main__':
+    bench_date_conversion()
+    bench_date_range()
+    #bench_schema('D:/Trading/mcxdata/db/db.db')
+    #bench_sweep('D:/Trading/mcxdata/db/db.db')
+    #bench_missed_records('D:/Trading/mcxdata/db/db.db')
+    #bench_workers('D:/Trading/mcxdata/db/db.db')
@@ -5,7 +5,7 @@ Created on Mar 11, 2017
 
 """
 
-import time, os
+import time, os, io
 import dates, utils
 import pandas as pd
 import pickle as pkl
@@ -14,15 +14,18 @@ import selenium
 from selenium import webdriver
 from selenium.webdriver.support.ui import Select
 import traceback, logging
+from concurrent.futures import ProcessPoolExecutor
 
 RENAMED = 'renamed/'
 NODATA = 'nodata/'
 FORMATTED = 'formatted/'
+DATE_FORMAT_CHANGE_DATE = '2017-03-03'  # Bhavcopy files till this date have dates in MM/DD/YYYY format
 
 #LOCATION = 'D:/Trading/mcxdata/delta'
 URL = 'https://www.mcxindia.com/market-data/bhavcopy'
 CHROMEDRIVER = 'C:/Program Files (x86)/chromedriver_win32/chromedriver.exe'
 LOGFILE = 'log.txt'
+FORMAT_ERRORS_FILE = 'format_errors.csv'
 
 
 def download_bhavcopy(csvpath, start_date):
@@ -115,7 +118,7 @@ def ren_csv_files(path, csv_files_path, raw_bkp_path):
         try:
             df = pd.read_csv(csv_path + file)
             if len(df.index) > 0:
-                new_name = '{}{}.csv'.format(csv_path + RENAMED, dates.ddmmyyyy_to_yyyy_mm_dd(file[-12:][:8]))
+                new_name = '{}{}.csv'.format(csv_path + RENAMED, raw_file_date(file))
                 os.rename(csv_path + file, new_name)
                 print(new_name, 'file renamed')
                 success += 1
@@ -131,7 +134,59 @@ def ren_csv_files(path, csv_files_path, raw_bkp_path):
     print('{} files renamed, {} files with no data, {} errors'.format(success, nodata, error))
 
 
-def format_csv_files(path, csv_files_path):
+def raw_file_date(file):
+    """Return date in YYYY-MM-DD format from raw bhavcopy file name ending with DDMMYYYY.csv"""
+
+    return dates.ddmmyyyy_to_yyyy_mm_dd(file[-12:][:8])
+
+
+def format_records(df, date):
+    """
+    Update date, expiry date and symbol formats of bhavcopy records
+    :param df: bhavcopy records as read from a raw or renamed file
+    :param date: file date in YYYY-MM-DD format
+    :return: formatted records
+    """
+
+    df['Expiry Date'] = dates.ddMMMyyyy_to_yyyy_mm_dd_series(df['Expiry Date'])  # Update Expiry Date Format
+    if date <= DATE_FORMAT_CHANGE_DATE:
+        df['Date'] = dates.mm_dd_yyyy_to_yyyy_mm_dd_series(df['Date'])  # Update Date Format
+    else:
+        df['Date'] = dates.dd_MMM_yyyy_to_yyyy_mm_dd_series(df['Date']) # Update Date Format
+    df['Symbol'] = df['Symbol'].str.strip()
+
+    return df
+
+
+def format_csv_file(csv_path, file):
+    """
+    Format one renamed bhavcopy file into the formatted folder, runs in a worker process in parallel mode
+    :param csv_path: folder containing renamed and formatted folders
+    :param file: renamed file name (YYYY-MM-DD.csv)
+    :return: None if formatted, error description otherwise
+    """
+
+    try:
+        date = file[0:10]  # Extract date from filename
+        df = format_records(pd.read_csv(csv_path + RENAMED + file), date)
+
+        df.to_csv(csv_path + FORMATTED + file, sep=',', index=False)
+    except Exception as e:
+        return '{}: {}'.format(type(e).__name__, e)
+
+    return None
+
+
+def format_csv_files(path, csv_files_path, workers=1):
+    """
+    Format renamed bhavcopy files into the formatted folder
+    Errors are written per file to FORMAT_ERRORS_FILE in file order
+    :param path: base path
+    :param csv_files_path: folder with renamed folder under path
+    :param workers: number of worker processes, 1 formats files in this process
+                    (scripts using more than 1 worker need an if __name__ == '__main__' guard on Windows)
+    :return: date of first file, None if no files
+    """
 
     csv_path = path + csv_files_path
 
@@ -144,34 +199,128 @@ def format_csv_files(path, csv_files_path):
         print('No files to format, exiting')
         return None
 
-    print('Initiating formatting of {} files'.format(len(csv_files)))
+    print('Initiating formatting of {} files with {} worker(s)'.format(len(csv_files), workers))
     print('Files range: {} - {}'.format(csv_files[0][0:10], csv_files[-1][0:10]))
 
-    success, error = 0, 0
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(format_csv_file, [csv_path] * len(csv_files), csv_files,
+                                        chunksize=max(1, len(csv_files) // (workers * 4))))
+    else:
+        results = map(format_csv_file, [csv_path] * len(csv_files), csv_files)
 
-    for file in csv_files:
-        try:
-            date = file[0:10]  # Extract date from filename
-            df = pd.read_csv(csv_path + RENAMED + file)
-            df['Expiry Date'] = df['Expiry Date'].apply(dates.ddMMMyyyy_to_yyyy_mm_dd)  # Update Expiry Date Format
-            if date <= '2017-03-03':
-                df['Date'] = df['Date'].apply(dates.mm_dd_yyyy_to_yyyy_mm_dd)  # Update Date Format
-            else:
-                df['Date'] = df['Date'].apply(dates.dd_MMM_yyyy_to_yyyy_mm_dd) # Update Date Format
-            df['Symbol'] = df['Symbol'].apply(str.strip)
+    success, errors = 0, []
 
-            df.to_csv(csv_path + FORMATTED + file, sep=',', index=False)
+    for file, result in zip(csv_files, results):
+        date = file[0:10]
+        if result is None:
             print(date, ',File formatted', file)
             success += 1
-        except:
+        else:
             print(date, ',Error in formatting', file)
-            error += 1
+            errors.append((file, result))
 
-    print('{} files formatted, {} errors'.format(success, error))
+    try:
+        os.remove(csv_path + FORMAT_ERRORS_FILE)
+    except OSError:
+        pass
+    if len(errors) > 0:
+        pd.DataFrame(errors, columns=['File', 'Error']).to_csv(csv_path + FORMAT_ERRORS_FILE, sep=',', index=False)
+
+    print('{} files formatted, {} errors'.format(success, len(errors)))
 
     return csv_files[0][0:10]
 
 
+def stream_csv_files(path, csv_files_path, raw_bkp_path, write_renamed=True, write_formatted=False, consumed=None):
+    """
+    Single pass alternative to ren_csv_files and format_csv_files: each raw bhavcopy is opened once,
+    backed up from memory, checked for data and formatted in memory
+    Feed the result to DataDB.load_table_from_frames to load the staging table without intermediate files
+    :param path: base path
+    :param csv_files_path: folder with raw bhavcopy files under path
+    :param raw_bkp_path: backup folder for raw files
+    :param write_renamed: move the raw file to the renamed folder (same as ren_csv_files), else remove it once
+                          backed up, so it is not ingested again
+    :param write_formatted: write the formatted file to the formatted folder (same as format_csv_files)
+    :param consumed: list to append the paths of ingested raw files to instead of removing them when write_renamed
+                     is False, for a caller removing them only once the load is committed
+    :return: generator of formatted DataFrames in date order, one per file with data, a raw file is moved or
+             removed when the next DataFrame is asked for
+    """
+
+    csv_path = path + csv_files_path
+
+    utils.mkdir(csv_path + NODATA)
+    if write_renamed:
+        utils.mkdir(csv_path + RENAMED)
+    if write_formatted:
+        utils.mkdir(csv_path + FORMATTED)
+
+    # Files are ingested in date order, a stray file without a DDMMYYYY date is left in place and counted as an error
+    csv_files, error = [], 0
+    for file in [f for f in os.listdir(csv_path) if f.endswith('.csv')]:
+        try:
+            time.strptime(file[-12:-4], '%d%m%Y')
+            csv_files.append(file)
+        except ValueError:
+            print(file, ',Error in ingesting, file name does not end with DDMMYYYY.csv')
+            error += 1
+    csv_files.sort(key=raw_file_date)
+
+    if len(csv_files) == 0:
+        print('No files to ingest, {} errors'.format(error))
+        return
+
+    print('Initiating streaming ingest of {} files'.format(len(csv_files)))
+
+    if raw_bkp_path[-1:] != '/':
+        raw_bkp_path = raw_bkp_path + '/'
+
+    success, nodata = 0, 0
+
+    for file in csv_files:
+        date = raw_file_date(file)
+        try:
+            with open(csv_path + file, 'rb') as f_raw:
+                content = f_raw.read()
+
+            if os.path.exists(raw_bkp_path + file):
+                os.unlink(raw_bkp_path + file)
+            with open(raw_bkp_path + file, 'wb') as f_bkp:
+                f_bkp.write(content)
+
+            df = pd.read_csv(io.BytesIO(content))
+            if len(df.index) == 0:
+                os.rename(csv_path + file, csv_path + NODATA + file)
+                print(file, 'has no data')
+                nodata += 1
+                continue
+
+            df = format_records(df, date)
+        except:
+            print(date, ',Error in ingesting', file)
+            error += 1
+            continue
+
+        if write_formatted:
+            df.to_csv('{}{}.csv'.format(csv_path + FORMATTED, date), sep=',', index=False)
+
+        print(date, ',File ingested', file)
+        success += 1
+
+        yield df
+
+        if write_renamed:
+            os.rename(csv_path + file, '{}{}.csv'.format(csv_path + RENAMED, date))
+        elif consumed is not None:
+            consumed.append(csv_path + file)
+        else:  # the backup written above has the same content
+            os.unlink(csv_path + file)
+
+    print('{} files ingested, {} files with no data, {} errors'.format(success, nodata, error))
+
+
 
 
 
@@ -0,0 +1,762 @@
+"""
+Created on Oct 18, 2026
+@author: Souvik
+@Program Function: Parameterized queries and bulk lookups on the Bhavcopy DB
+
+
+"""
+
+import pandas as pd
+
+
+class DataAccess:
+    """ Queries with bound parameters on a sqlite connection, the SQL text of each query is constant so
+    sqlite3 reuses its prepared statement (see cached_statements of sqlite3.connect)"""
+
+    # constants
+
+    CHUNK_SIZE = 400  # keys per bulk lookup statement, stays below the 999 bound parameter limit of older sqlite
+    FUTURES_COLUMNS = ['Symbol', 'Date', 'Open', 'High', 'Low', 'Close', 'VolumeLots', 'OpenInterestLots',
+                       'ExpiryDate']
+
+    TRADING_DAYS_QRY = '''SELECT DISTINCT Date FROM tblDump WHERE InstrumentName = ? ORDER BY Date'''
+
+    DUMP_RECORD_COUNT_QRY = '''SELECT COUNT(*) FROM tblDump WHERE InstrumentName = ?'''
+
+    UNIQUE_SYMBOLS_QRY = '''SELECT DISTINCT Symbol FROM "{}" WHERE InstrumentName = ?'''
+
+    RANGE_SYMBOLS_QRY = '''SELECT DISTINCT Symbol FROM tblDump
+                             WHERE InstrumentName = ?
+                               AND Date BETWEEN ? AND ?
+                             ORDER BY Symbol ASC'''
+
+    WRITE_EXPIRIES_QRY = '''INSERT INTO tblExpiries
+                            SELECT DISTINCT Symbol, ExpiryDate FROM tblDump
+                             WHERE InstrumentName = ?'''
+
+    WRITE_RANGE_EXPIRIES_QRY = '''INSERT OR IGNORE INTO tblExpiries
+                                  SELECT DISTINCT Symbol, ExpiryDate FROM tblDump
+                                   WHERE InstrumentName = ?
+                                     AND Date BETWEEN ? AND ?'''
+
+    EXPIRIES_QRY = '''SELECT Symbol, ExpiryDate FROM tblExpiries
+                       WHERE Symbol IN ({})
+                       ORDER BY Symbol ASC, ExpiryDate ASC'''
+
+    PENDING_EXPIRIES_QRY = '''SELECT E.Symbol, E.ExpiryDate
+                                FROM tblExpiries E LEFT OUTER JOIN tblFuturesWatermarks W
+                                  ON E.Symbol = W.Symbol
+                               WHERE E.Symbol IN ({})
+                                 AND E.ExpiryDate >= IFNULL(W.LastExpiry, '1900-01-01')
+                               ORDER BY E.Symbol ASC, E.ExpiryDate ASC'''
+
+    SYMBOL_WATERMARKS_QRY = '''SELECT Symbol, MAX(Date), COUNT(*) FROM tblDump
+                                WHERE InstrumentName = ? GROUP BY Symbol'''
+
+    SYMBOL_RECORDS_QRY = '''SELECT Symbol, Date, Open, High, Low, Close, VolumeLots, OpenInterestLots, ExpiryDate
+                              FROM tblDump
+                             WHERE Symbol = ?
+                               AND InstrumentName = ?
+                               AND Date BETWEEN ? AND ?
+                             ORDER BY Symbol ASC, Date ASC, ExpiryDate ASC'''
+
+    SYMBOLS_RECORDS_QRY = '''SELECT Symbol, Date, Open, High, Low, Close, VolumeLots, OpenInterestLots, ExpiryDate
+                               FROM tblDump
+                              WHERE Symbol IN ({})
+                                AND InstrumentName = ?
+                                AND Date BETWEEN ? AND ?
+                              ORDER BY Symbol ASC, Date ASC, ExpiryDate ASC'''
+
+    EXPIRIES_RECORDS_QRY = '''SELECT D.Symbol, D.Date, D.Open, D.High, D.Low, D.Close, D.VolumeLots,
+                                     D.OpenInterestLots, D.ExpiryDate
+                                FROM tblDump D
+                                JOIN (VALUES {}) K
+                                  ON D.Symbol = K.column1
+                                 AND D.ExpiryDate = K.column2
+                               ORDER BY D.Symbol ASC, D.ExpiryDate ASC, D.Date ASC, D.InstrumentName ASC'''
+
+    SYMBOLS_FUTURES_QRY = '''SELECT * FROM tblFutures WHERE Symbol IN ({}) ORDER BY Symbol ASC, Date ASC'''
+
+    INSERT_FRAME_QRY = '''INSERT INTO "{}" ({}) VALUES ({})'''
+
+    DELETE_SYMBOL_QRY = '''DELETE FROM "{}" WHERE Symbol = ?'''
+
+    DELETE_SWEEP_QRY = '''DELETE FROM tblFuturesSweep WHERE Variant = ? AND Symbol = ?'''
+
+    STAGE_FUTURES_TABLE_QRY = '''CREATE TEMP TABLE IF NOT EXISTS tmpFutures ( Seq INTEGER PRIMARY KEY, Symbol TEXT,
+                                   Date TEXT, Open REAL, High REAL, Low REAL, Close REAL, VolumeLots INTEGER,
+                                   OpenInterestLots INTEGER, ExpiryDate TEXT )'''
+
+    STAGE_FUTURES_INDEX_QRY = '''CREATE INDEX IF NOT EXISTS temp.idxTmpFutures ON tmpFutures ( Symbol, Date, Seq )'''
+
+    STAGE_FUTURES_QRY = '''INSERT INTO tmpFutures VALUES (?,?,?,?,?,?,?,?,?,?)'''
+
+    STAGE_KEYS_TABLE_QRY = '''CREATE TEMP TABLE IF NOT EXISTS tmpFuturesKeys ( Seq INTEGER PRIMARY KEY, Symbol TEXT,
+                                Date TEXT )'''
+
+    STAGE_KEYS_QRY = '''INSERT INTO tmpFuturesKeys VALUES (?,?,?)'''
+
+    STAGE_SYMBOLS_TABLE_QRY = '''CREATE TEMP TABLE IF NOT EXISTS tmpSymbols ( Symbol TEXT PRIMARY KEY )'''
+
+    STAGE_SYMBOLS_QRY = '''INSERT OR IGNORE INTO tmpSymbols VALUES (?)'''
+
+    FILTER_STAGED_KEYS_QRY = '''DELETE FROM tmpFuturesKeys WHERE Symbol NOT IN (SELECT Symbol FROM tmpSymbols)'''
+
+    FILTER_STAGED_FUTURES_QRY = '''DELETE FROM tmpFutures WHERE Symbol NOT IN (SELECT Symbol FROM tmpSymbols)'''
+
+    STAGED_KEY_SYMBOLS_QRY = '''SELECT Symbol FROM tmpFuturesKeys GROUP BY Symbol ORDER BY MIN(Seq)'''
+
+    STAGED_SYMBOLS_QRY = '''SELECT Symbol FROM tmpFuturesKeys UNION SELECT Symbol FROM tmpFutures'''
+
+    DELETE_STAGED_KEYS_QRY = '''DELETE FROM tblFutures WHERE (Symbol, Date) IN (SELECT Symbol, Date FROM tmpFuturesKeys)'''
+
+    # Staged records clashing with tblFutures, or with the first staged record of the same key
+    STAGED_FUTURES_CONFLICTS_QRY = '''SELECT T.Seq, F.*
+                                        FROM tmpFutures T JOIN tblFutures F
+                                          ON F.Symbol = T.Symbol
+                                         AND F.Date = T.Date
+                                       UNION ALL
+                                      SELECT T.Seq, E.Symbol, E.Date, E.Open, E.High, E.Low, E.Close, E.VolumeLots,
+                                             E.OpenInterestLots, E.ExpiryDate
+                                        FROM tmpFutures T JOIN tmpFutures E
+                                          ON E.Symbol = T.Symbol
+                                         AND E.Date = T.Date
+                                         AND E.Seq = (SELECT MIN(Seq) FROM tmpFutures M
+                                                       WHERE M.Symbol = T.Symbol AND M.Date = T.Date)
+                                       WHERE T.Seq > E.Seq
+                                         AND NOT EXISTS (SELECT 1 FROM tblFutures F
+                                                          WHERE F.Symbol = T.Symbol AND F.Date = T.Date)
+                                       ORDER BY 1'''
+
+    INSERT_STAGED_FUTURES_QRY = '''INSERT INTO tblFutures
+                                   SELECT Symbol, Date, Open, High, Low, Close, VolumeLots, OpenInterestLots, ExpiryDate
+                                     FROM tmpFutures T
+                                    WHERE T.Seq IN (SELECT MIN(Seq) FROM tmpFutures GROUP BY Symbol, Date)
+                                      AND NOT EXISTS (SELECT 1 FROM tblFutures F
+                                                       WHERE F.Symbol = T.Symbol AND F.Date = T.Date)
+                                    ORDER BY T.Seq'''
+
+    FUTURES_WATERMARKS_QRY = '''SELECT Symbol, LastDate, LastExpiry FROM tblFuturesWatermarks WHERE Symbol IN ({})'''
+
+    DELETE_FUTURES_WATERMARK_QRY = '''DELETE FROM tblFuturesWatermarks WHERE Symbol = ?'''
+
+    REFRESH_FUTURES_WATERMARK_QRY = '''INSERT INTO tblFuturesWatermarks
+                                       SELECT Symbol, Date, ExpiryDate FROM tblFutures
+                                        WHERE Symbol = ?
+                                        ORDER BY Date DESC LIMIT 1'''
+
+    MISSED_SYMBOL_RECORDS_QRY = '''SELECT tblDump.Symbol, tblDump.Date, tblDump.ExpiryDate, tblDump.VolumeLots
+                                     FROM tblDump LEFT OUTER JOIN tblFutures
+                                       ON tblDump.Symbol = tblFutures.Symbol
+                                      AND tblDump.Date = tblFutures.Date
+                                    WHERE tblDump.Symbol IN ({})
+                                      AND tblFutures.Date is NULL
+                                      AND tblDump.InstrumentName = ?
+                                      AND tblDump.Date BETWEEN ? AND ?
+                                    ORDER BY tblDump.Symbol ASC, tblDump.ExpiryDate ASC, tblDump.Date ASC'''
+
+    # tblFutures records whose expiry is before the expiry of the previous date of the symbol
+    # LAG only needs the record before start, K holds the date of that record per symbol
+    EXPIRY_REGRESSIONS_QRY = '''SELECT Symbol, Date, ExpiryDate, PrevDate, PrevExpiry
+                                  FROM (SELECT F.Symbol, F.Date, F.ExpiryDate,
+                                               LAG(F.Date) OVER (PARTITION BY F.Symbol ORDER BY F.Date) PrevDate,
+                                               LAG(F.ExpiryDate) OVER (PARTITION BY F.Symbol ORDER BY F.Date) PrevExpiry
+                                          FROM (SELECT V.column1 Symbol,
+                                                       IFNULL((SELECT MAX(P.Date) FROM tblFutures P
+                                                                WHERE P.Symbol = V.column1
+                                                                  AND P.Date < ?), '1900-01-01') FromDate
+                                                  FROM (VALUES {}) V) K
+                                          JOIN tblFutures F
+                                            ON F.Symbol = K.Symbol
+                                           AND F.Date >= K.FromDate)
+                                 WHERE ExpiryDate < PrevExpiry
+                                   AND Date >= ?
+                                 ORDER BY Symbol ASC, Date ASC'''
+
+    DELETE_EXPIRY_VIOLATIONS_QRY = '''DELETE FROM tblExpiryViolations WHERE Symbol = ? AND Date >= ?'''
+
+    LAST_MULTIPLIERS_QRY = '''SELECT M.Symbol, M.NextExpiry PrevExpiry, M.RolloverDate PrevDate, M.ResultantMultiplier
+                                FROM tblMultipliers M
+                                JOIN (SELECT Symbol, MAX(RolloverDate) RolloverDate FROM tblMultipliers
+                                       WHERE Symbol IN ({}) GROUP BY Symbol) L
+                                  ON M.Symbol = L.Symbol
+                                 AND M.RolloverDate = L.RolloverDate'''
+
+    # Rollovers of each symbol after a start date, with the closes of both expiries on the last day before the
+    # rollover with records for both. K holds (Symbol, start date, expiry at start date) per symbol
+    ROLLOVERS_QRY = '''WITH R AS (SELECT Symbol, RolloverDate, PreviousExpiry, NextExpiry
+                                    FROM (SELECT F.Symbol, MIN(F.Date) RolloverDate, F.ExpiryDate NextExpiry,
+                                                 LAG(F.ExpiryDate, 1, K.column3)
+                                                     OVER (PARTITION BY F.Symbol ORDER BY F.ExpiryDate) PreviousExpiry
+                                            FROM tblFutures F
+                                            JOIN (VALUES {}) K
+                                              ON F.Symbol = K.column1
+                                             AND F.Date > K.column2
+                                           GROUP BY F.Symbol, F.ExpiryDate)
+                                   WHERE PreviousExpiry <> '1900-01-01'
+                                     AND PreviousExpiry <> NextExpiry)
+                       SELECT R.Symbol, R.RolloverDate, R.PreviousExpiry, R.NextExpiry,
+                              D.Close DumpClose, F.Close FuturesClose, F.Date MultiplierCalcDate
+                         FROM R LEFT OUTER JOIN tblDump F
+                           ON F.Symbol = R.Symbol
+                          AND F.ExpiryDate = R.NextExpiry
+                          AND F.InstrumentName = ?
+                          AND F.Date = (SELECT MAX(F2.Date)
+                                          FROM tblDump F2 JOIN tblDump D2
+                                            ON F2.Symbol = D2.Symbol
+                                           AND F2.Date = D2.Date
+                                         WHERE F2.Symbol = R.Symbol
+                                           AND F2.Date < R.RolloverDate
+                                           AND F2.InstrumentName = ?
+                                           AND D2.InstrumentName = ?
+                                           AND F2.ExpiryDate = R.NextExpiry
+                                           AND D2.ExpiryDate = R.PreviousExpiry)
+                         LEFT OUTER JOIN tblDump D
+                           ON D.Symbol = F.Symbol
+                          AND D.Date = F.Date
+                          AND D.ExpiryDate = R.PreviousExpiry
+                          AND D.InstrumentName = ?
+                        ORDER BY R.Symbol ASC, R.NextExpiry ASC'''
+
+    MISSING_CONTRACT_QRY = '''SELECT F.*
+                                FROM tblFutures F LEFT OUTER JOIN tblContract C
+                                  ON F.Symbol = C.Symbol
+                                 AND F.Date = C.Date
+                               WHERE F.Symbol IN ({})
+                                 AND C.Date is NULL
+                               ORDER BY F.Symbol ASC, F.Date ASC'''
+
+    # tblFutures records after the last tblContract date of each symbol, K holds the symbols
+    NEW_CONTRACT_QRY = '''SELECT F.*
+                            FROM (VALUES {}) K CROSS JOIN tblFutures F
+                              ON F.Symbol = K.column1
+                             AND F.Date > IFNULL((SELECT MAX(C.Date) FROM tblContract C WHERE C.Symbol = K.column1),
+                                                 '1900-01-01')
+                           ORDER BY F.Symbol ASC, F.Date ASC'''
+
+    FUTURES_RECORD_COUNT_QRY = '''SELECT COUNT(*) Records FROM tblFutures WHERE Symbol IN ({})'''
+
+    MULTIPLIERS_QRY = '''SELECT * FROM tblMultipliers WHERE Symbol IN ({}) ORDER BY Symbol ASC, RolloverDate ASC'''
+
+    ALL_MULTIPLIERS_QRY = '''SELECT * FROM tblMultipliers ORDER BY rowid ASC'''
+
+    CONTRACT_FROM_QRY = '''SELECT * FROM "{}" WHERE Date >= ? ORDER BY Symbol ASC, Date ASC'''
+
+    CONTRACT_LAST_DATE_QRY = '''SELECT MAX(Date) FROM "{}" WHERE Date >= ?'''
+
+    CONTRACT_RECORDS_QRY = '''SELECT * FROM "{}"
+                               WHERE Symbol IN ({{}})
+                                 AND Date BETWEEN ? AND ?
+                               ORDER BY Symbol ASC, Date ASC'''
+
+    DELETE_FACTORS_QRY = '''DELETE FROM tblAdjustmentFactors WHERE Symbol = ?'''
+
+    # One factor per rollover, the first one also applies before the first rollover
+    REFRESH_FACTORS_QRY = '''INSERT INTO tblAdjustmentFactors
+                             SELECT Symbol,
+                                    CASE WHEN ROW_NUMBER() OVER (ORDER BY RolloverDate) = 1 THEN '1900-01-01'
+                                         ELSE RolloverDate END,
+                                    ResultantMultiplier
+                               FROM tblMultipliers
+                              WHERE Symbol = ?'''
+
+    LAST_FACTORS_QRY = '''SELECT A.Symbol, A.Multiplier
+                            FROM tblAdjustmentFactors A
+                            JOIN (SELECT Symbol, MAX(FromDate) FromDate FROM tblAdjustmentFactors
+                                   WHERE Symbol IN ({}) GROUP BY Symbol) L
+                              ON A.Symbol = L.Symbol
+                             AND A.FromDate = L.FromDate'''
+
+    PIPELINE_STEP_QRY = '''SELECT Status, InputHash, Result, StartTime FROM tblPipelineSteps WHERE Pipeline = ? AND Step = ?'''
+
+    PIPELINE_STATUS_QRY = '''SELECT Step, Status FROM tblPipelineSteps WHERE Pipeline = ?'''
+
+    SAVE_PIPELINE_STEP_QRY = '''INSERT OR REPLACE INTO tblPipelineSteps VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+    TABLE_EXISTS_QRY = '''SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?'''
+
+    TABLE_STATE_QRY = '''SELECT COUNT(*), MAX(rowid) FROM "{}"'''
+
+    def __init__(self, conn):
+        """
+        :param conn: sqlite3 connection
+        """
+
+        self.conn = conn
+
+    @staticmethod
+    def chunks(keys, size):
+
+        keys = list(keys)
+        for i in range(0, len(keys), size):
+            yield keys[i:i + size]
+
+    def query(self, qry, params=()):
+        """
+        Return result of qry with bound params as DataFrame
+        """
+
+        return pd.read_sql_query(qry, self.conn, params=params)
+
+    def fetchone(self, qry, params=()):
+
+        c = self.conn.cursor()
+        c.execute(qry, params)
+        row = c.fetchone()
+        c.close()
+
+        return row
+
+    def fetchall(self, qry, params=()):
+
+        c = self.conn.cursor()
+        c.execute(qry, params)
+        rows = c.fetchall()
+        c.close()
+
+        return rows
+
+    def execute(self, qry, params=()):
+        """
+        Execute a statement, commit is left to the caller
+        :return: number of rows changed
+        """
+
+        c = self.conn.cursor()
+        c.execute(qry, params)
+        count = c.rowcount
+        c.close()
+
+        return count
+
+    def executemany(self, qry, rows):
+        """
+        Execute a statement once per row with a single prepared statement, commit is left to the caller
+        :return: number of rows changed
+        """
+
+        c = self.conn.cursor()
+        c.executemany(qry, rows)
+        count = c.rowcount
+        c.close()
+
+        return count
+
+    def query_in(self, qry, keys, params=()):
+        """
+        Run qry with an IN ({}) placeholder over keys, CHUNK_SIZE keys per statement
+        :param qry: query with one {} placeholder inside IN ()
+        :param keys: values for the IN list
+        :param params: values for placeholders after the IN list
+        :return: DataFrame with the results of all chunks
+        """
+
+        frames = [self.query(qry.format(','.join(['?'] * len(chunk))), chunk + list(params))
+                  for chunk in self.chunks(keys, self.CHUNK_SIZE)]
+
+        if len(frames) == 0:
+            return self.query(qry.format('NULL'), params)
+
+        return pd.concat(frames, axis=0, ignore_index=True)
+
+    def trading_days(self, instrument):
+
+        return [row[0] for row in self.fetchall(self.TRADING_DAYS_QRY, (instrument,))]
+
+    def dump_record_count(self, instrument):
+
+        return self.fetchone(self.DUMP_RECORD_COUNT_QRY, (instrument,))[0]
+
+    def unique_symbols(self, instrument, table='tblDump'):
+
+        return [row[0] for row in self.fetchall(self.UNIQUE_SYMBOLS_QRY.format(table), (instrument,))]
+
+    def range_symbols(self, instrument, start, end):
+        """
+        Return symbols with tblDump records between start and end, ordered by Symbol
+        """
+
+        return [row[0] for row in self.fetchall(self.RANGE_SYMBOLS_QRY, (instrument, start, end))]
+
+    def write_expiries(self, instrument):
+        """
+        Populate tblExpiries from tblDump, commit is left to the caller
+        """
+
+        return self.execute(self.WRITE_EXPIRIES_QRY, (instrument,))
+
+    def write_range_expiries(self, instrument, start, end):
+        """
+        Add expiries of tblDump records between start and end missing in tblExpiries, commit is left to the caller
+        """
+
+        return self.execute(self.WRITE_RANGE_EXPIRIES_QRY, (instrument, start, end))
+
+    def expiries_frame(self, symbols):
+        """
+        Return expiry dates of many symbols in one lookup
+        :param symbols: [symbol1, symbol2,...]
+        :return: DataFrame of Symbol, ExpiryDate ordered by ExpiryDate within each symbol
+        """
+
+        return self.query_in(self.EXPIRIES_QRY, symbols)
+
+    def expiries(self, symbols):
+        """
+        Return expiry dates of many symbols in one lookup
+        :param symbols: [symbol1, symbol2,...]
+        :return: {symbol: [expiry_date1, expiry_date2,...]} in ascending order, symbols without expiries are left out
+        """
+
+        df = self.expiries_frame(symbols)
+
+        return {symbol: group['ExpiryDate'].tolist() for symbol, group in df.groupby('Symbol', sort=False)}
+
+    def symbol_watermarks(self, instrument):
+
+        return {row[0]: (row[1], row[2]) for row in self.fetchall(self.SYMBOL_WATERMARKS_QRY, (instrument,))}
+
+    def symbol_records(self, symbol, instrument, start, end):
+
+        return self.query(self.SYMBOL_RECORDS_QRY, (symbol, instrument, start, end))
+
+    def symbols_records(self, symbols, instrument, start, end):
+        """
+        Return tblDump records of many symbols between start and end in one lookup,
+        ordered by Date, ExpiryDate within each symbol
+        """
+
+        return self.query_in(self.SYMBOLS_RECORDS_QRY, symbols, (instrument, start, end))
+
+    def expiries_records(self, keys):
+        """
+        Return tblDump records of many (Symbol, ExpiryDate) pairs in one lookup
+        :param keys: iterable of (symbol, expiry_date)
+        :return: DataFrame ordered by Symbol, ExpiryDate, Date
+        """
+
+        frames = []
+        for chunk in self.chunks(dict.fromkeys(keys), self.CHUNK_SIZE):
+            params = [value for key in chunk for value in key]
+            frames.append(self.query(self.EXPIRIES_RECORDS_QRY.format(','.join(['(?,?)'] * len(chunk))), params))
+
+        if len(frames) == 0:
+            return pd.DataFrame(columns=self.FUTURES_COLUMNS)
+
+        return pd.concat(frames, axis=0, ignore_index=True).sort_values(
+            ['Symbol', 'ExpiryDate', 'Date'], kind='mergesort').reset_index(drop=True)
+
+    def symbols_futures(self, symbols):
+        """
+        Return tblFutures records of many symbols in one lookup, ordered by Date within each symbol
+        """
+
+        return self.query_in(self.SYMBOLS_FUTURES_QRY, symbols)
+
+    def insert_frame(self, table, df):
+        """
+        Insert all records of df in table by column name with a single prepared statement, commit is left to the caller
+        :return: number of records inserted
+        """
+
+        qry = self.INSERT_FRAME_QRY.format(table, ', '.join(['`{}`'.format(column) for column in df.columns]),
+                                           ','.join(['?'] * len(df.columns)))
+        self.executemany(qry, df.itertuples(index=False, name=None))
+
+        return len(df.index)
+
+    def delete_symbols(self, table, symbols):
+        """
+        Delete all records of symbols from table, commit is left to the caller
+        :return: number of records deleted
+        """
+
+        return self.executemany(self.DELETE_SYMBOL_QRY.format(table), [(symbol,) for symbol in symbols])
+
+    def delete_sweep(self, variants, symbols):
+        """
+        Delete tblFuturesSweep records of symbols for variants, commit is left to the caller
+        :return: number of records deleted
+        """
+
+        return self.executemany(self.DELETE_SWEEP_QRY, [(variant, symbol) for variant in variants for symbol in symbols])
+
+    def stage_futures(self, df):
+        """
+        Replace the temporary tmpFutures table contents with df, Seq is the position of each record in df,
+        commit is left to the caller
+        :param df: DataFrame with FUTURES_COLUMNS
+        """
+
+        self.execute(self.STAGE_FUTURES_TABLE_QRY)
+        self.execute(self.STAGE_FUTURES_INDEX_QRY)
+        self.execute('''DELETE FROM tmpFutures''')
+        self.executemany(self.STAGE_FUTURES_QRY,
+                         ((seq,) + row for seq, row in
+                          enumerate(df[self.FUTURES_COLUMNS].itertuples(index=False, name=None))))
+
+    def stage_futures_keys(self, keys):
+        """
+        Replace the temporary tmpFuturesKeys table contents with keys, commit is left to the caller
+        :param keys: iterable of (symbol, date)
+        """
+
+        self.execute(self.STAGE_KEYS_TABLE_QRY)
+        self.execute('''DELETE FROM tmpFuturesKeys''')
+        self.executemany(self.STAGE_KEYS_QRY, ((seq,) + tuple(key) for seq, key in enumerate(keys)))
+
+    def filter_staged_symbols(self, symbols):
+        """
+        Keep only staged keys and records of symbols, commit is left to the caller
+        """
+
+        self.execute(self.STAGE_SYMBOLS_TABLE_QRY)
+        self.execute('''DELETE FROM tmpSymbols''')
+        self.executemany(self.STAGE_SYMBOLS_QRY, [(symbol,) for symbol in symbols])
+        self.execute(self.FILTER_STAGED_KEYS_QRY)
+        self.execute(self.FILTER_STAGED_FUTURES_QRY)
+
+    def staged_key_symbols(self):
+        """
+        Return symbols of the staged keys in staging order
+        """
+
+        return [row[0] for row in self.fetchall(self.STAGED_KEY_SYMBOLS_QRY)]
+
+    def staged_symbols(self):
+        """
+        Return symbols of the staged keys and records
+        """
+
+        return [row[0] for row in self.fetchall(self.STAGED_SYMBOLS_QRY)]
+
+    def delete_staged_futures_keys(self):
+        """
+        Delete tblFutures records of the staged keys, commit is left to the caller
+        :return: number of records deleted
+        """
+
+        return self.execute(self.DELETE_STAGED_KEYS_QRY)
+
+    def staged_futures_conflicts(self):
+        """
+        Return staged records that clash on (Symbol, Date) with tblFutures or an earlier staged record
+        :return: DataFrame of Seq of the staged record and the tblFutures columns of the record it clashes with
+        """
+
+        return self.query(self.STAGED_FUTURES_CONFLICTS_QRY)
+
+    def insert_staged_futures(self):
+        """
+        Insert the first staged record of each (Symbol, Date) not already in tblFutures, commit is left to the caller
+        :return: number of records inserted
+        """
+
+        return self.execute(self.INSERT_STAGED_FUTURES_QRY)
+
+    def futures_watermarks(self, symbols):
+        """
+        Return watermark of many symbols in tblFutures in one lookup
+        :param symbols: [symbol1, symbol2,...]
+        :return: {symbol: (last date, last expiry)}, symbols not in tblFutures are left out
+        """
+
+        df = self.query_in(self.FUTURES_WATERMARKS_QRY, symbols)
+
+        return {row[0]: (row[1], row[2]) for row in df.itertuples(index=False, name=None)}
+
+    def refresh_futures_watermarks(self, symbols):
+        """
+        Recompute watermark of symbols from their last tblFutures record, commit is left to the caller
+        """
+
+        symbols = [(symbol,) for symbol in symbols]
+        self.executemany(self.DELETE_FUTURES_WATERMARK_QRY, symbols)
+        self.executemany(self.REFRESH_FUTURES_WATERMARK_QRY, symbols)
+
+    def pending_expiries_frame(self, symbols):
+        """
+        Return expiry dates of many symbols from the last expiry in tblFutures onwards, all expiries for
+        symbols not in tblFutures
+        :return: DataFrame of Symbol, ExpiryDate ordered by ExpiryDate within each symbol
+        """
+
+        return self.query_in(self.PENDING_EXPIRIES_QRY, symbols)
+
+    def symbols_missed_records(self, symbols, instrument, start='1900-01-01', end='2100-12-31'):
+        """
+        Return tblDump records of many symbols between start and end whose symbol and date are not in tblFutures
+        """
+
+        return self.query_in(self.MISSED_SYMBOL_RECORDS_QRY, symbols, (instrument, start, end))
+
+    def expiry_regressions(self, symbols, start):
+        """
+        Return tblFutures records of symbols from start whose expiry is before the expiry of the previous record
+        :return: DataFrame of Symbol, Date, ExpiryDate, PrevDate, PrevExpiry
+        """
+
+        frames = [self.query(self.EXPIRY_REGRESSIONS_QRY.format(','.join(['(?)'] * len(chunk))),
+                             [start] + chunk + [start])
+                  for chunk in self.chunks(symbols, self.CHUNK_SIZE)]
+
+        if len(frames) == 0:
+            return self.query(self.EXPIRY_REGRESSIONS_QRY.format('(NULL)'), (start, start))
+
+        return pd.concat(frames, axis=0, ignore_index=True)
+
+    def replace_expiry_violations(self, symbols, start, df):
+        """
+        Replace tblExpiryViolations records of symbols from start with df, commit is left to the caller
+        """
+
+        self.executemany(self.DELETE_EXPIRY_VIOLATIONS_QRY, [(symbol, start) for symbol in symbols])
+        self.insert_frame('tblExpiryViolations', df)
+
+    def last_multipliers(self, symbols):
+        """
+        Return the last tblMultipliers record of many symbols in one lookup
+        :param symbols: [symbol1, symbol2,...]
+        :return: {symbol: (previous expiry, previous rollover date, resultant multiplier)}
+        """
+
+        df = self.query_in(self.LAST_MULTIPLIERS_QRY, symbols)
+
+        return {row[0]: (row[1], row[2], row[3]) for row in df.itertuples(index=False, name=None)}
+
+    def rollovers(self, starts, instrument):
+        """
+        Return rollovers of many symbols in one lookup per CHUNK_SIZE symbols
+        :param starts: iterable of (symbol, start date, expiry at start date), rollovers after start date are
+                       returned, '1900-01-01' as expiry if there is no expiry before the first rollover
+        :return: DataFrame of Symbol, RolloverDate, PreviousExpiry, NextExpiry, DumpClose, FuturesClose,
+                 MultiplierCalcDate ordered by Symbol, NextExpiry, closes are NULL if not found
+        """
+
+        frames = []
+        for chunk in self.chunks(starts, self.CHUNK_SIZE):
+            params = [value for start in chunk for value in start] + [instrument] * 4
+            frames.append(self.query(self.ROLLOVERS_QRY.format(','.join(['(?,?,?)'] * len(chunk))), params))
+
+        if len(frames) == 0:
+            return self.query(self.ROLLOVERS_QRY.format("(NULL, NULL, NULL)"), [instrument] * 4)
+
+        return pd.concat(frames, axis=0, ignore_index=True)
+
+    def missing_contract_records(self, symbols):
+        """
+        Return tblFutures records not yet in tblContract for many symbols in one lookup, ordered by Symbol, Date
+        """
+
+        return self.query_in(self.MISSING_CONTRACT_QRY, symbols)
+
+    def new_contract_records(self, symbols):
+        """
+        Return tblFutures records after the last tblContract date of many symbols, one lookup per CHUNK_SIZE
+        symbols, ordered by Symbol, Date
+        """
+
+        frames = [self.query(self.NEW_CONTRACT_QRY.format(','.join(['(?)'] * len(chunk))), chunk)
+                  for chunk in self.chunks(symbols, self.CHUNK_SIZE)]
+
+        if len(frames) == 0:
+            return self.query(self.NEW_CONTRACT_QRY.format('(NULL)'))
+
+        return pd.concat(frames, axis=0, ignore_index=True)
+
+    def multipliers(self, symbols):
+        """
+        Return tblMultipliers records for many symbols in one lookup, ordered by Symbol, RolloverDate
+        """
+
+        return self.query_in(self.MULTIPLIERS_QRY, symbols)
+
+    def all_multipliers(self):
+        """
+        Return all tblMultipliers records in the order they were inserted
+        """
+
+        return self.query(self.ALL_MULTIPLIERS_QRY)
+
+    def contract_chunks(self, start_date, table='tblContract', chunksize=100000):
+        """
+        Return an iterator of DataFrames of chunksize adjusted contract records from start_date, ordered by
+        Symbol, Date, read through one cursor
+        """
+
+        return pd.read_sql_query(self.CONTRACT_FROM_QRY.format(table), self.conn, params=(start_date,),
+                                 chunksize=chunksize)
+
+    def contract_last_date(self, start_date, table='tblContract'):
+        """
+        Return last date of adjusted contract records from start_date, None if there are none
+        """
+
+        return self.fetchone(self.CONTRACT_LAST_DATE_QRY.format(table), (start_date,))[0]
+
+    def contract_records(self, symbols, start, end, table='tblContract'):
+        """
+        Return adjusted contract records of many symbols between start and end, ordered by Symbol, Date
+        """
+
+        return self.query_in(self.CONTRACT_RECORDS_QRY.format(table), symbols, (start, end))
+
+    def futures_record_count(self, symbols):
+        """
+        Return the number of tblFutures records of many symbols
+        """
+
+        return int(self.query_in(self.FUTURES_RECORD_COUNT_QRY, symbols)['Records'].sum())
+
+    def refresh_adjustment_factors(self, symbols):
+        """
+        Recompute tblAdjustmentFactors records of symbols from tblMultipliers, commit is left to the caller
+        """
+
+        symbols = [(symbol,) for symbol in symbols]
+        self.executemany(self.DELETE_FACTORS_QRY, symbols)
+        self.executemany(self.REFRESH_FACTORS_QRY, symbols)
+
+    def last_factors(self, symbols):
+        """
+        Return the factor of the last rollover of many symbols in one lookup
+        :return: {symbol: multiplier}, symbols without rollovers are left out
+        """
+
+        df = self.query_in(self.LAST_FACTORS_QRY, symbols)
+
+        return dict(zip(df['Symbol'], df['Multiplier']))
+
+    def pipeline_step(self, pipeline, step):
+        """
+        Return (Status, InputHash, Result, StartTime) checkpoint of a pipeline step, None if the step never ran
+        """
+
+        return self.fetchone(self.PIPELINE_STEP_QRY, (pipeline, step))
+
+    def pipeline_statuses(self, pipeline):
+        """
+        Return {step: Status} of the checkpoints of a pipeline
+        """
+
+        return dict(self.fetchall(self.PIPELINE_STATUS_QRY, (pipeline,)))
+
+    def save_pipeline_step(self, pipeline, step, status, input_hash, result, start_time, seconds, rows,
+                           peak_rss=None, peak_traced=None, peak_worker_rss=None):
+        """
+        Write checkpoint of a pipeline step and commit, so the checkpoint survives a failure of a later step
+        """
+
+        self.conn.execute(self.SAVE_PIPELINE_STEP_QRY, (pipeline, step, status, input_hash, result, start_time,
+                                                        seconds, rows, peak_rss, peak_traced, peak_worker_rss))
+        self.conn.commit()
+
+    def table_state(self, table):
+        """
+        Return (record count, last rowid) of table, None if the table does not exist
+        """
+
+        if self.fetchone(self.TABLE_EXISTS_QRY, (table,))[0] == 0:
+            return None
+
+        return tuple(self.fetchone(self.TABLE_STATE_QRY.format(table)))
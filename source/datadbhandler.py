@@ -7,15 +7,26 @@ Created on Apr 08, 2018
 """
 
 import os
+import gzip
+import queue
+import bisect
+import pathlib
+import threading
 import dates, utils
+from symbolcache import SymbolCache
+from dataaccess import DataAccess
+from tradingcalendar import TradingCalendar
+import numpy as np
 import pandas as pd
 import pickle as pkl
 import csv
 import sqlite3
 from sqlalchemy import create_engine
-from collections import OrderedDict
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 #from pympler.tracker import SummaryTracker, ObjectTracker
 import gc
+import time
 
 
 class DataDB:
@@ -32,6 +43,135 @@ class DataDB:
     AMIBROKER_FILE = 'ami_data.csv'
     AMIBROKER_ADJUSTED_FILE = 'ami_data_adjusted.csv'
     FORMATTED = 'formatted/'
+    LAYOUT_CHANGE_DATE = '2017-05-12'  # Bhavcopy files till this date have no instrument and option columns
+
+    STAGING_COLUMNS = ['Date', 'InstrumentName', 'Symbol', 'ExpiryDate', 'OptionType', 'StrikePrice', 'Open', 'High',
+                       'Low', 'Close', 'PreviousClose', 'VolumeLots', 'VolumeThousands', 'Value', 'OpenInterestLots']
+    OLD_LAYOUT_COLUMNS = {'Date': 'Date', 'Symbol': 'Symbol', 'Expiry Date': 'ExpiryDate', 'Open': 'Open',
+                          'High': 'High', 'Low': 'Low', 'Close': 'Close', 'Previous Close': 'PreviousClose',
+                          'Volume': 'VolumeLots', "Volume(In 000's)": 'VolumeThousands', 'Value': 'Value',
+                          'Open Interest': 'OpenInterestLots'}
+    NEW_LAYOUT_COLUMNS = {'Date': 'Date', 'Instrument Name': 'InstrumentName', 'Symbol': 'Symbol',
+                          'Expiry Date': 'ExpiryDate', 'Option Type': 'OptionType', 'Strike Price': 'StrikePrice',
+                          'Open': 'Open', 'High': 'High', 'Low': 'Low', 'Close': 'Close',
+                          'Previous Close': 'PreviousClose', 'Volume(Lots)': 'VolumeLots',
+                          "Volume(In 000's)": 'VolumeThousands', 'Value(Lacs)': 'Value',
+                          'Open Interest(Lots)': 'OpenInterestLots'}
+    AMIBROKER_COLUMNS = ['Symbol', 'Date', 'Open', 'High', 'Low', 'Close', 'VolumeLots', 'OpenInterestLots',
+                         'ExpiryDate']
+    AMIBROKER_ADJUSTED_COLUMNS = ['AdjustedSymbol', 'Date', 'AdjustedOpen', 'AdjustedHigh', 'AdjustedLow',
+                                  'AdjustedClose']
+    AMIBROKER_CHUNK_SIZE = 100000  # contract records formatted at a time by the Amibroker export
+    AMIBROKER_QUEUE_SIZE = 8  # formatted chunks waiting for the writer thread
+    VOL_OI_TABLE = 'tblFuturesVolOI'  # continuous contracts rolling on volume or open interest
+    VOL_OI_FIELDS = ['VolumeLots', 'OpenInterestLots']
+    SWEEP_TABLE = 'tblFuturesSweep'  # continuous contracts of many roll rule variants, keyed by Variant
+    ON_CONFLICT = ['ignore', 'replace']  # process_staging_data modes
+    DUMP_KEY = ['Date', 'InstrumentName', 'Symbol', 'ExpiryDate', 'OptionType', 'StrikePrice']  # tblDump natural key
+    BATCHES_PER_WORKER = 4  # symbol batches per worker process, evens out symbols with longer histories
+    PENDING_PER_WORKER = 2  # batch results of worker processes held before the writer takes them
+
+    # Schema migrations, applied in order on top of PRAGMA user_version
+    SCHEMA_MIGRATIONS = [
+        # 1: base tables
+        ['''CREATE TABLE IF NOT EXISTS "tblDump" ( `Date` TEXT, `InstrumentName` TEXT, `Symbol` TEXT,
+            `ExpiryDate` TEXT, `OptionType` TEXT, `StrikePrice` INTEGER, `Open` REAL, `High` REAL, `Low` REAL,
+            `Close` REAL, `PreviousClose` REAL, `VolumeLots` INTEGER, `VolumeThousands` TEXT, `Value` REAL,
+            `OpenInterestLots` INTEGER )''',
+         '''CREATE TABLE IF NOT EXISTS "tblDumpStaging" ( `Date` TEXT, `InstrumentName` TEXT, `Symbol` TEXT,
+            `ExpiryDate` TEXT, `OptionType` TEXT, `StrikePrice` INTEGER, `Open` REAL, `High` REAL, `Low` REAL,
+            `Close` REAL, `PreviousClose` REAL, `VolumeLots` INTEGER, `VolumeThousands` TEXT, `Value` REAL,
+            `OpenInterestLots` INTEGER )''',
+         '''CREATE TABLE IF NOT EXISTS "tblExpiries" ( `Symbol` TEXT, `ExpiryDate` TEXT )''',
+         '''CREATE TABLE IF NOT EXISTS "tblFutures" ( `Symbol` TEXT, `Date` TEXT, `Open` REAL, `High` REAL,
+            `Low` REAL, `Close` REAL, `VolumeLots` INTEGER, `OpenInterestLots` INTEGER, `ExpiryDate` TEXT,
+            PRIMARY KEY(`Symbol`,`Date`) )''',
+         '''CREATE TABLE IF NOT EXISTS "tblMultipliers" ( `Symbol` TEXT, `RolloverDate` TEXT, `PreviousExpiry` TEXT,
+            `NextExpiry` TEXT, `DumpClose` REAL, `FuturesClose` REAL, `MultiplierCalcType` TEXT,
+            `MultiplierCalcDate` TEXT, `DaysBetweenCalcRollover` INTEGER, `Multiplier` REAL,
+            `ResultantMultiplier` REAL, PRIMARY KEY(`Symbol`,`RolloverDate`) )''',
+         '''CREATE TABLE IF NOT EXISTS "tblContract" ( `Symbol` TEXT, `Date` TEXT, `Open` REAL, `High` REAL,
+            `Low` REAL, `Close` REAL, `VolumeLots` INTEGER, `OpenInterestLots` INTEGER, `ExpiryDate` TEXT,
+            `AdjustedOpen` REAL, `AdjustedHigh` REAL, `AdjustedLow` REAL, `AdjustedClose` REAL, `Multiplier` REAL,
+            PRIMARY KEY(`Symbol`,`Date`) )''',
+         '''CREATE INDEX IF NOT EXISTS `idxDumpStaging` ON `tblDumpStaging`
+            ( `Symbol` ASC, `Date` ASC, `ExpiryDate` ASC, `InstrumentName` ASC )''',
+         '''CREATE INDEX IF NOT EXISTS `idxFutures` ON `tblFutures` ( `Symbol` ASC, `Date` ASC, `ExpiryDate` ASC )''',
+         '''CREATE UNIQUE INDEX IF NOT EXISTS `idxContract` ON `tblContract` ( `Symbol` ASC, `Date` ASC )'''],
+        # 2: natural keys and covering indexes for the per symbol, per expiry and per date lookups
+        # duplicate records are moved to tblDumpDuplicates and tblExpiriesDuplicates for review before the keys are
+        # created, the first loaded record of each key is kept
+        ['''CREATE TABLE IF NOT EXISTS "tblDumpDuplicates" AS SELECT * FROM tblDump WHERE 0''',
+         '''INSERT INTO tblDumpDuplicates SELECT * FROM tblDump WHERE rowid NOT IN
+            (SELECT MIN(rowid) FROM tblDump GROUP BY Symbol, Date, ExpiryDate, InstrumentName, OptionType, StrikePrice)''',
+         '''DELETE FROM tblDump WHERE rowid NOT IN
+            (SELECT MIN(rowid) FROM tblDump GROUP BY Symbol, Date, ExpiryDate, InstrumentName, OptionType, StrikePrice)''',
+         '''CREATE UNIQUE INDEX IF NOT EXISTS `idxDumpKey` ON `tblDump`
+            ( `Symbol` ASC, `Date` ASC, `ExpiryDate` ASC, `InstrumentName` ASC, `OptionType` ASC, `StrikePrice` ASC )''',
+         '''DROP INDEX IF EXISTS `idxDump`''',
+         '''CREATE INDEX IF NOT EXISTS `idxDumpExpiry` ON `tblDump`
+            ( `Symbol` ASC, `ExpiryDate` ASC, `Date` ASC, `InstrumentName` ASC, `Close` )''',
+         '''CREATE INDEX IF NOT EXISTS `idxDumpDate` ON `tblDump` ( `InstrumentName` ASC, `Date` ASC )''',
+         '''CREATE TABLE IF NOT EXISTS "tblExpiriesDuplicates" AS SELECT * FROM tblExpiries WHERE 0''',
+         '''INSERT INTO tblExpiriesDuplicates SELECT * FROM tblExpiries WHERE rowid NOT IN
+            (SELECT MIN(rowid) FROM tblExpiries GROUP BY Symbol, ExpiryDate)''',
+         '''DELETE FROM tblExpiries WHERE rowid NOT IN (SELECT MIN(rowid) FROM tblExpiries GROUP BY Symbol, ExpiryDate)''',
+         '''CREATE UNIQUE INDEX IF NOT EXISTS `idxExpiries` ON `tblExpiries` ( `Symbol` ASC, `ExpiryDate` ASC )''',
+         '''CREATE INDEX IF NOT EXISTS `idxFuturesExpiry` ON `tblFutures` ( `Symbol` ASC, `ExpiryDate` ASC, `Date` ASC )''',
+         '''ANALYZE'''],
+        # 3: last date and expiry of each symbol in tblFutures, maintained by the continuous contract stages
+        ['''CREATE TABLE IF NOT EXISTS "tblFuturesWatermarks" ( `Symbol` TEXT, `LastDate` TEXT, `LastExpiry` TEXT,
+            PRIMARY KEY(`Symbol`) )''',
+         '''DELETE FROM tblFuturesWatermarks''',
+         '''INSERT INTO tblFuturesWatermarks SELECT Symbol, MAX(Date), ExpiryDate FROM tblFutures GROUP BY Symbol'''],
+        # 4: continuous contracts rolling on volume or open interest
+        ['''CREATE TABLE IF NOT EXISTS "tblFuturesVolOI" ( `Symbol` TEXT, `Date` TEXT, `Open` REAL, `High` REAL,
+            `Low` REAL, `Close` REAL, `VolumeLots` INTEGER, `OpenInterestLots` INTEGER, `ExpiryDate` TEXT,
+            PRIMARY KEY(`Symbol`,`Date`) )'''],
+        # 5: continuous contracts of roll rule sweeps, one series per variant
+        ['''CREATE TABLE IF NOT EXISTS "tblFuturesSweep" ( `Variant` TEXT, `Symbol` TEXT, `Date` TEXT, `Open` REAL,
+            `High` REAL, `Low` REAL, `Close` REAL, `VolumeLots` INTEGER, `OpenInterestLots` INTEGER, `ExpiryDate` TEXT,
+            PRIMARY KEY(`Variant`,`Symbol`,`Date`) )'''],
+        # 6: expiry regressions found by expiry_sanity_check
+        ['''CREATE TABLE IF NOT EXISTS "tblExpiryViolations" ( `Symbol` TEXT, `Date` TEXT, `ExpiryDate` TEXT,
+            `PrevDate` TEXT, `PrevExpiry` TEXT, PRIMARY KEY(`Symbol`,`Date`) )'''],
+        # 7: cumulative adjustment factor per symbol and rollover, adjusted prices computed on read by vwContract
+        ['''CREATE TABLE IF NOT EXISTS "tblAdjustmentFactors" ( `Symbol` TEXT, `FromDate` TEXT, `Multiplier` REAL,
+            PRIMARY KEY(`Symbol`,`FromDate`) )''',
+         '''DELETE FROM tblAdjustmentFactors''',
+         '''INSERT INTO tblAdjustmentFactors
+            SELECT Symbol,
+                   CASE WHEN ROW_NUMBER() OVER (PARTITION BY Symbol ORDER BY RolloverDate) = 1 THEN '1900-01-01'
+                        ELSE RolloverDate END,
+                   ResultantMultiplier
+              FROM tblMultipliers''',
+         '''CREATE VIEW IF NOT EXISTS vwContract AS
+            SELECT F.Symbol, F.Date, F.Open, F.High, F.Low, F.Close, F.VolumeLots, F.OpenInterestLots, F.ExpiryDate,
+                   ROUND(F.Open * IFNULL(A.Multiplier, 1), 2) AdjustedOpen,
+                   ROUND(F.High * IFNULL(A.Multiplier, 1), 2) AdjustedHigh,
+                   ROUND(F.Low * IFNULL(A.Multiplier, 1), 2) AdjustedLow,
+                   ROUND(F.Close * IFNULL(A.Multiplier, 1), 2) AdjustedClose,
+                   IFNULL(A.Multiplier, 1) Multiplier
+              FROM tblFutures F LEFT OUTER JOIN tblAdjustmentFactors A
+                ON A.Symbol = F.Symbol
+               AND A.FromDate = (SELECT MAX(M.FromDate) FROM tblAdjustmentFactors M
+                                  WHERE M.Symbol = F.Symbol AND M.FromDate <= F.Date)'''],
+        # 8: per step checkpoints of the pipeline runner
+        ['''CREATE TABLE IF NOT EXISTS "tblPipelineSteps" ( `Pipeline` TEXT, `Step` TEXT, `Status` TEXT,
+            `InputHash` TEXT, `Result` TEXT, `StartTime` TEXT, `Seconds` REAL, `Rows` INTEGER,
+            PRIMARY KEY(`Pipeline`,`Step`) )'''],
+        # 9: memory high-water marks of pipeline steps
+        ['''ALTER TABLE "tblPipelineSteps" ADD COLUMN `PeakRSS` INTEGER''',
+         '''ALTER TABLE "tblPipelineSteps" ADD COLUMN `PeakTraced` INTEGER'''],
+        # 10: memory high-water mark of the worker processes of pipeline steps
+        ['''ALTER TABLE "tblPipelineSteps" ADD COLUMN `PeakWorkerRSS` INTEGER'''],
+    ]
+
+    # Connection pragmas per workload
+    PRAGMAS = {'read': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -65536,
+                        'mmap_size': 268435456, 'temp_store': 'MEMORY'},
+               'bulk': {'journal_mode': 'WAL', 'synchronous': 'OFF', 'cache_size': -262144,
+                        'mmap_size': 268435456, 'temp_store': 'MEMORY'}}
 
     # variables
     trading_day_idx = dict()
@@ -39,107 +179,207 @@ class DataDB:
 
     def set_trading_day_idx(self):
         """
-        Populate trading_day_idx, trading_day_idx_rev dictionary
+        Populate trading calendar and trading_day_idx, trading_day_idx_rev dictionary
         """
 
-        qry = '''SELECT DISTINCT Date FROM tblDump 
-                  WHERE InstrumentName = "{}" ORDER BY Date'''.format(self.INSTRUMENT_NAME)
-
-        c = self.conn.cursor()
-        c.execute(qry)
-        rows = c.fetchall()
-        c.close()
-
-        dates = [row[0] for row in rows]
-        date_idx = [i + 1 for i in range(0, len(rows))]
+        dates = self.access.trading_days(self.INSTRUMENT_NAME)
+        date_idx = [i + 1 for i in range(0, len(dates))]
 
         self.trading_day_idx, self.trading_day_idx_rev = dict(zip(dates, date_idx)), dict(zip(date_idx, dates))
+        self.calendar = TradingCalendar(dates, self.holidays)
 
-    def __init__(self, db, type='FUTCOM'):
+    def __init__(self, db, type='FUTCOM', cache_path=None, manage_schema=True, holidays=[], lazy_adjustment=False,
+                 workers=1, read_only=False, batch_symbols=None):
+        """
+        :param db: sqlite DB file
+        :param type: instrument name
+        :param cache_path: folder for per symbol cache of tblDump records, None to read tblDump directly
+        :param manage_schema: create and migrate schema and apply read pragmas on open
+        :param holidays: exchange holidays in YYYY-MM-DD format, used to project trading days of expiries
+                         after the last available bar
+        :param lazy_adjustment: keep adjustment factors in tblAdjustmentFactors and read adjusted prices from the
+                                vwContract view instead of writing them to tblContract
+        :param workers: worker processes for the per symbol work of stages 6 - 11, 1 runs it in this process
+                        (scripts using more than 1 worker need an if __name__ == '__main__' guard on Windows)
+        :param read_only: open a read only connection without schema management, used by the worker processes
+        :param batch_symbols: most symbols per batch of the per symbol work of stages 6 - 11, records of a batch
+                              are written before the next batch is read, so memory of a full rebuild is bounded by
+                              the records of batch_symbols symbols. None for batches by workers only
+        """
 
         # variables
 
-        self.INSTRUMENT_NAME = type    
+        self.INSTRUMENT_NAME = type
+        self.holidays = holidays
+        self.lazy_adjustment = lazy_adjustment
+        self.contract_table = 'vwContract' if lazy_adjustment else 'tblContract'
+        self.db_path = db
+        self.workers = workers
+        self.batch_symbols = batch_symbols
+        self.worker_peak_rss = None  # highest peak RSS of the worker processes of map_symbol_batches
 
         print('Opening Bhavcopy database {}...'.format(db))
-        self.conn = sqlite3.connect(db)
+        if read_only:
+            self.conn = sqlite3.connect(pathlib.Path(db).resolve().as_uri() + '?mode=ro', uri=True,
+                                        cached_statements=256)
+        else:
+            self.conn = sqlite3.connect(db, cached_statements=256)
+        self.access = DataAccess(self.conn)
         self.engine = create_engine('sqlite:///{}'.format(db))
 
+        if manage_schema and not read_only:
+            self.create_schema()
+            self.tune('read')
+
         self.set_trading_day_idx()
 
+        self.cache = None if cache_path is None else SymbolCache(cache_path)
+        self.watermarks = dict() if cache_path is None else self.symbol_watermarks()
+
     def __del__(self):
 
         print('Closing DB connection..')
         self.conn.close()
 
-    def dump_record_count(self):
+    def create_schema(self):
+        """
+        Create missing tables and indexes, migrating the schema from PRAGMA user_version to the last
+        SCHEMA_MIGRATIONS entry
+        """
 
         c = self.conn.cursor()
-        c.execute('''SELECT COUNT(*) FROM tblDump WHERE InstrumentName = "{}"'''.format(self.INSTRUMENT_NAME))
-        rows = c.fetchall()
-        c.close()
+        c.execute('PRAGMA user_version')
+        version = c.fetchone()[0]
 
-        print("Total number of records in the data dump: {}".format(rows[0][0]))
+        for migration_version, statements in enumerate(self.SCHEMA_MIGRATIONS, start=1):
+            if migration_version <= version:
+                continue
+            print('Migrating schema to version {}'.format(migration_version))
+            for statement in statements:
+                c.execute(statement)
+                if statement.startswith('INSERT') and statement.split()[2].endswith('Duplicates') and c.rowcount > 0:
+                    print('{} duplicate records moved to {}'.format(c.rowcount, statement.split()[2]))
+            c.execute('PRAGMA user_version = {}'.format(migration_version))
+            self.conn.commit()
 
-    def unique_symbols(self, table='tblDump'):
+        c.close()
 
-        qry = '''SELECT DISTINCT Symbol FROM "{}" WHERE InstrumentName = "{}"'''.format(table, self.INSTRUMENT_NAME)
+    def tune(self, workload='read'):
+        """
+        Apply connection pragmas for workload
+        :param workload: 'read' for the contract building stages, 'bulk' for loading data
+        """
 
         c = self.conn.cursor()
-        c.execute(qry)
-        rows = c.fetchall()
+        for pragma, value in self.PRAGMAS[workload].items():
+            c.execute('PRAGMA {} = {}'.format(pragma, value))
         c.close()
 
-        return [symbol[0] for symbol in rows]
+    def dump_record_count(self):
+
+        print("Total number of records in the data dump: {}".format(
+            self.access.dump_record_count(self.INSTRUMENT_NAME)))
+
+    def unique_symbols(self, table='tblDump'):
+
+        return self.access.unique_symbols(self.INSTRUMENT_NAME, table)
+
+    def range_symbols(self, symbols=[], date_range=None):
+        """
+        Return symbols to process: symbols if passed, else the symbols with tblDump records in date_range, all
+        symbols without date_range
+        :param date_range: {'start': first date, 'end': last date} as returned by process_staging_data
+        """
+
+        if len(symbols) > 0:
+            return symbols
+        if date_range is None:
+            return self.unique_symbols()
+
+        return self.access.range_symbols(self.INSTRUMENT_NAME, date_range['start'], date_range['end'])
+
+    def symbol_batches(self, items):
+        """
+        Split items of one or more symbols into contiguous batches, BATCHES_PER_WORKER per worker process and
+        at most batch_symbols items per batch
+        :param items: [list of symbols] or other per symbol list
+        :return: [batch1, batch2,...], [items] with 1 worker and no batch_symbols
+        """
+
+        items = list(items)
+        count = min(len(items), self.workers * self.BATCHES_PER_WORKER) if self.workers > 1 else 1
+        if self.batch_symbols is not None:
+            count = max(count, -(-len(items) // self.batch_symbols))
+        if count <= 1:
+            return [items]
+
+        size, extra = divmod(len(items), count)
+        bounds = np.cumsum([0] + [size + 1 if i < extra else size for i in range(count)])
+
+        return [items[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def map_symbol_batches(self, method, batches):
+        """
+        Call a read only DataDB method once per batch of arguments, in worker processes with their own read only
+        connection when there is more than one batch. Changes of this connection have to be committed before,
+        this process remains the only writer. Only PENDING_PER_WORKER results per worker are held at a time.
+        The highest peak RSS of the worker processes is kept in worker_peak_rss
+        :param method: DataDB method name
+        :param batches: [(args of call1), (args of call2),...]
+        :return: generator of results in batches order
+        """
+
+        if self.workers <= 1 or len(batches) <= 1:
+            for args in batches:
+                yield getattr(self, method)(*args)
+            return
+
+        def next_result():
+            result, peak = pending.popleft().result()
+            if peak is not None:
+                self.worker_peak_rss = peak if self.worker_peak_rss is None else max(self.worker_peak_rss, peak)
+            return result
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=open_worker_db,
+                                 initargs=(self.db_path, self.INSTRUMENT_NAME, self.holidays)) as executor:
+            pending = deque()
+            for args in batches:
+                if len(pending) >= self.workers * self.PENDING_PER_WORKER:
+                    yield next_result()
+                pending.append(executor.submit(call_worker_db, method, args))
+            while len(pending) > 0:
+                yield next_result()
 
     def trading_day(self, date):
         """
-        Return trading day idx from trading_day_idx
+        Return trading day idx from trading calendar
         :param symbols: expiry date in YYYY-MM-DD format
-        :return: trading day idx from trading_day_idx
+        :return: trading day idx of date, of previous trading day if date is not a trading day,
+                 projected on weekdays if date is beyond last available bar
         """
 
-        trading_day_list = list(self.trading_day_idx.keys())
-        trading_day_list.sort()
+        return self.calendar.index(date)
 
-        last_trading_day = trading_day_list[len(trading_day_list) - 1]
-        if date > last_trading_day: # If passed expiry date is beyond last available bar
-            weekdays_till_date = dates.dates(last_trading_day, date, 
-                                             ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday'])
-            return self.trading_day_idx[last_trading_day] + len(weekdays_till_date) - 1
-        else:
-            if date in self.trading_day_idx: # If passed expiry date is a trading day
-                return self.trading_day_idx[date]
-            else: # If passed expiry date is not a trading day, use previous trading day
-                found = False
-                save_date = date
-                while not found:
-                    date = dates.relativedate(date, days=-1)
-                    if date in self.trading_day_idx:
-                        return self.trading_day_idx[date]
-                        found = True
-                    if dates.datediff(save_date, date) > 10:
-                        return None
-
-    def write_expiries(self):
+    def write_expiries(self, date_range=None):
         """
         Write all expiry dates in tblExpiries
+        :param date_range: {'start': first date, 'end': last date} as returned by process_staging_data, only add
+                           the expiries of tblDump records in date_range instead of rewriting the table
         """
 
-        truncate_query = '''DELETE FROM tblExpiries'''
-
-        insert_query = '''INSERT INTO tblExpiries
-                          SELECT DISTINCT Symbol, ExpiryDate FROM tblDump
-                           WHERE InstrumentName = "{}"'''.format(self.INSTRUMENT_NAME)
+        if date_range is not None:
+            count = self.access.write_range_expiries(self.INSTRUMENT_NAME, date_range['start'], date_range['end'])
+            self.conn.commit()
+            print('Complete adding {} expiries from {} to {} to tblExpiries'.format(
+                count, date_range['start'], date_range['end']))
+            return
 
-        c = self.conn.cursor()
-        c.execute(truncate_query)
+        self.access.execute('''DELETE FROM tblExpiries''')
         self.conn.commit()
         print('Complete truncate table tblExpiries')
-        c.execute(insert_query)
+        self.access.write_expiries(self.INSTRUMENT_NAME)
         self.conn.commit()
         print('Complete populate table tblExpiries')
-        c.close()
 
     def expiry_history(self, symbol):
         """
@@ -148,30 +388,53 @@ class DataDB:
         :return: [expiry_date1, expiry_date2,...]
         """
 
-        qry = '''SELECT * 
-                   FROM tblExpiries
-                  WHERE Symbol = "{}"
-                  ORDER BY Symbol ASC, ExpiryDate ASC'''.format(symbol)
+        return self.access.expiries([symbol]).get(symbol, [])
 
-        c = self.conn.cursor()
-        c.execute(qry)
-        rows = c.fetchall()
-        c.close()
+    def symbol_watermarks(self):
+        """
+        Return watermark of each symbol in tblDump, used to validate the symbol cache
+        :return: {symbol: (last date, record count)}
+        """
 
-        return [row[1] for row in rows]
+        return self.access.symbol_watermarks(self.INSTRUMENT_NAME)
 
-    def symbol_records(self, symbol, start='1900-01-01', end='2100-12-31'):
+    def symbol_records(self, symbol, start='1900-01-01', end='2100-12-31', use_cache=True):
+        """
+        Return tblDump records for symbol between start and end, from the symbol cache if enabled
+        A cache file not matching the tblDump watermark of the symbol is rebuilt first
+        """
 
-        qry = '''SELECT Symbol, Date, Open, High, Low, Close, VolumeLots, OpenInterestLots, ExpiryDate 
-                   FROM tblDump
-                  WHERE Symbol = "{}"
-                    AND InstrumentName = "{}"
-                    AND Date BETWEEN "{}" AND "{}"
-                  ORDER BY Symbol ASC, Date ASC, ExpiryDate ASC'''.format(symbol, self.INSTRUMENT_NAME, start, end)
+        watermark = self.watermarks.get(symbol)
 
-        df = pd.read_sql_query(qry, self.conn)
+        if self.cache is not None and use_cache and watermark is not None:
+            if not self.cache.is_valid(symbol, watermark):
+                print('{}: refreshing symbol cache'.format(symbol))
+                self.cache.write(symbol, self.symbol_records(symbol, use_cache=False), watermark)
+            return self.cache.read(symbol, start, end)
 
-        return df
+        return self.access.symbol_records(symbol, self.INSTRUMENT_NAME, start, end)
+
+    def update_symbol_cache(self, start, end):
+        """
+        Bring symbol cache up to date after staging records between start and end were added to tblDump
+        Only the staged date range is re-read for symbols whose cache was current, other symbols are
+        invalidated and rebuilt on next read
+        """
+
+        watermarks = self.symbol_watermarks()
+
+        staged_symbols = self.unique_symbols(table='tblDumpStaging')
+
+        for symbol in staged_symbols:
+            if self.cache.is_valid(symbol, self.watermarks.get(symbol)):
+                self.cache.update(symbol, self.symbol_records(symbol, start, end, use_cache=False), start, end,
+                                  watermarks.get(symbol))
+            else:
+                self.cache.invalidate(symbol)
+
+        self.watermarks = watermarks
+
+        print('symbol cache updated for {} symbols'.format(len(staged_symbols)))
 
     def insert_records(self, df, table_name):
         """
@@ -180,6 +443,216 @@ class DataDB:
 
         df.to_sql(table_name, self.engine, index=False, if_exists='append')
 
+    def symbols_records(self, symbols, start='1900-01-01', end='2100-12-31'):
+        """
+        Return tblDump records of all symbols between start and end, ordered by Date, ExpiryDate within each
+        symbol, in one query or from the symbol cache if enabled
+        """
+
+        if self.cache is not None:
+            frames = [self.symbol_records(symbol, start, end) for symbol in symbols]
+            return pd.concat(frames, axis=0, ignore_index=True) if len(frames) > 0 \
+                else self.access.symbols_records([], self.INSTRUMENT_NAME, start, end)
+
+        return self.access.symbols_records(symbols, self.INSTRUMENT_NAME, start, end)
+
+    def expiry_windows(self, symbols, delta=0, pending=False):
+        """
+        Return active trading day window of each expiry of symbols: an expiry is the front month from the
+        rollover day of the previous expiry till the day before its own rollover day, delta trading days
+        before expiry
+        :param pending: only expiries from the last expiry in tblFutures, the first of them active from the start
+        :return: DataFrame of Symbol, ExpiryDate, WindowStart (inclusive), WindowEnd (exclusive)
+        """
+
+        windows = self.access.pending_expiries_frame(symbols) if pending else self.access.expiries_frame(symbols)
+
+        windows['WindowEnd'] = self.calendar.indices(windows['ExpiryDate']) - delta
+        windows['WindowStart'] = windows.groupby('Symbol')['WindowEnd'].shift(1).fillna(0).astype(np.int64)
+
+        return windows
+
+    def continuous_contract_records(self, symbols, delta=0, start='1900-01-01', pending=False):
+        """
+        Select the front month record of each symbol and date in one pass: every record is matched with the
+        window of its expiry and kept if its trading day falls in the window
+        :param symbols: [list of symbols]
+        :param delta: delta days for rollover before expiry
+        :param start: first date to select
+        :param pending: only select expiries from the last expiry in tblFutures, see expiry_windows
+        :return: selected records ordered by symbol (in symbols order), expiry date, date, with duplicate
+                 (Symbol, Date) where windows of expiries overlap
+        """
+
+        records = self.symbols_records(symbols, start=start)
+        windows = self.expiry_windows(symbols, delta, pending)
+
+        return self.window_records(symbols, records, windows)
+
+    def window_records(self, symbols, records, windows):
+        """
+        Select records whose trading day falls in the window of their expiry
+        :param symbols: [list of symbols], sets the output order
+        :param records: tblDump records of symbols
+        :param windows: DataFrame of Symbol, ExpiryDate, WindowStart (inclusive), WindowEnd (exclusive)
+        :return: selected records ordered by symbol (in symbols order), expiry date, date
+        """
+
+        trading_days = self.calendar.indices(records['Date'])
+        records = records.merge(windows, how='left', on=['Symbol', 'ExpiryDate'])
+
+        selected = records.loc[(trading_days >= records['WindowStart']) & (trading_days < records['WindowEnd']),
+                               DataAccess.FUTURES_COLUMNS]
+
+        symbol_order = selected['Symbol'].map({symbol: i for i, symbol in enumerate(symbols)})
+
+        return selected.assign(SymbolOrder=symbol_order).sort_values(['SymbolOrder', 'ExpiryDate', 'Date'],
+                                                                     kind='mergesort').drop(['SymbolOrder'], axis=1)
+
+    def vol_oi_windows(self, symbols, records, field='VolumeLots', delta=0, hysteresis=0.0, confirm_days=1):
+        """
+        Return active trading day window of each expiry of symbols when rolling on liquidity: the next expiry
+        takes over the day after its field has stayed above (1 + hysteresis) times the field of the current
+        expiry for confirm_days trading days in a row, and at the latest on the rollover day delta trading days
+        before the current expiry. Crossover days of all symbols and expiries come from one pass over records,
+        a crossover only counts once the current expiry is the front month, so expiries are rolled in order per
+        symbol and windows never move back to an earlier expiry
+        :param records: tblDump records of symbols
+        :return: DataFrame of Symbol, ExpiryDate, WindowStart (inclusive), WindowEnd (exclusive)
+        """
+
+        windows = self.access.expiries_frame(symbols)
+        windows['ExpiryNo'] = windows.groupby('Symbol').cumcount()
+        windows['ForcedDay'] = self.calendar.indices(windows['ExpiryDate']) - delta
+
+        # pair each record with the record of the previous expiry on the same date
+        volumes = records[['Symbol', 'Date', 'ExpiryDate', field]].merge(
+            windows[['Symbol', 'ExpiryDate', 'ExpiryNo']], on=['Symbol', 'ExpiryDate'])
+        current = volumes[['Symbol', 'Date', 'ExpiryNo', field]].assign(
+            ExpiryNo=volumes['ExpiryNo'] + 1).rename(columns={field: 'CurrentField'})
+        pairs = volumes.merge(current, on=['Symbol', 'Date', 'ExpiryNo']).sort_values(
+            ['Symbol', 'ExpiryNo', 'Date'], kind='mergesort').reset_index(drop=True)
+
+        # length of the run of consecutive days the next expiry is ahead, a day behind starts a new run
+        ahead = pairs[field] > pairs['CurrentField'] * (1 + hysteresis)
+        run = (~ahead).cumsum()
+        run_length = ahead.astype(np.int64).groupby([pairs['Symbol'], pairs['ExpiryNo'], run]).cumsum()
+
+        confirmed = pairs.loc[ahead & (run_length >= confirm_days), ['Symbol', 'ExpiryNo', 'Date']]
+        confirmed = confirmed.assign(Crossover=self.calendar.indices(confirmed['Date']) + 1)
+        crossovers = {key: days.values for key, days in confirmed.groupby(['Symbol', 'ExpiryNo'])['Crossover']}
+
+        # the next expiry takes over at its first crossover confirmed on or after the window start of the current
+        # expiry, earlier far month crossovers are ignored
+        forced_days = windows.groupby('Symbol')['ForcedDay'].shift(1)
+        window_starts, window_start = [], 0
+        for symbol, expiry_no, forced_day in zip(windows['Symbol'], windows['ExpiryNo'], forced_days):
+            if expiry_no == 0:
+                window_start = 0
+            else:
+                days = crossovers.get((symbol, expiry_no), [])
+                later = np.searchsorted(days, window_start, side='right')
+                roll_day = np.fmin(days[later] if later < len(days) else np.nan, forced_day)
+                window_start = max(window_start, 0 if np.isnan(roll_day) else roll_day)
+            window_starts.append(window_start)
+
+        windows['WindowStart'] = np.array(window_starts, dtype=np.int64)
+        windows['WindowEnd'] = windows.groupby('Symbol')['WindowStart'].shift(-1).fillna(
+            windows['ForcedDay']).astype(np.int64)
+
+        return windows[['Symbol', 'ExpiryDate', 'WindowStart', 'WindowEnd']]
+
+    def create_vol_oi_contracts(self, symbols=[], field='VolumeLots', hysteresis=0.1, confirm_days=2, delta=0):
+        """
+        Create continuous contracts in VOL_OI_TABLE rolling to the next expiry once it is more liquid than the
+        current expiry, see vol_oi_windows
+        :param symbols:
+        [list of symbols], no need to pass anything if for all symbols
+        field: 'VolumeLots' or 'OpenInterestLots'
+        hysteresis: fraction by which the next expiry has to exceed the current one
+        confirm_days: consecutive trading days the next expiry has to stay ahead
+        delta: delta days for forced rollover before expiry
+        :return: number of records written
+        """
+
+        if field not in self.VOL_OI_FIELDS:
+            raise ValueError('field must be one of {}'.format(self.VOL_OI_FIELDS))
+
+        if len(symbols) == 0: # no symbol passed, default to all symbols
+            symbols = self.unique_symbols()
+
+        print("Creating {} rollover contracts for {} symbols".format(field, len(symbols)))
+
+        records = self.symbols_records(symbols)
+        windows = self.vol_oi_windows(symbols, records, field, delta, hysteresis, confirm_days)
+        df_insert = self.window_records(symbols, records, windows)
+
+        self.access.delete_symbols(self.VOL_OI_TABLE, symbols)
+        self.access.insert_frame(self.VOL_OI_TABLE, df_insert)
+        self.conn.commit()
+
+        return len(df_insert.index)
+
+    def sweep_continuous_contracts(self, deltas=[0], symbols=[], vol_oi_variants=[], file=None):
+        """
+        Build continuous contracts of many roll rule variants in one pass: records are read and sorted once,
+        every record is located in its expiry once, and each variant only costs a window mask over the same
+        arrays. Records of a variant with duplicate (Symbol, Date) are left out as in create_continuous_contracts
+        :param deltas: [delta1, delta2,...] date rollover variants, delta days for rollover before expiry
+        :param symbols: [list of symbols], no need to pass anything if for all symbols
+        :param vol_oi_variants: [{'field': 'VolumeLots', 'hysteresis': 0.1, 'confirm_days': 2, 'delta': 0},...]
+                                volume or open interest rollover variants, see vol_oi_windows
+        :param file: write all variants to this pickle file instead of SWEEP_TABLE
+        :return: DataFrame of Variant, Records
+        """
+
+        if len(symbols) == 0: # no symbol passed, default to all symbols
+            symbols = self.unique_symbols()
+
+        print("Sweeping {} variants for {} symbols".format(len(deltas) + len(vol_oi_variants), len(symbols)))
+
+        records = self.symbols_records(symbols)
+        expiries = self.access.expiries_frame(symbols)
+
+        symbol_order = records['Symbol'].map({symbol: i for i, symbol in enumerate(symbols)})
+        records = records.assign(SymbolOrder=symbol_order).sort_values(
+            ['SymbolOrder', 'ExpiryDate', 'Date'], kind='mergesort').drop(['SymbolOrder'], axis=1).reset_index(drop=True)
+
+        # position of the expiry of each record in expiries, windows of every variant follow the same order
+        positions = records[['Symbol', 'ExpiryDate']].merge(expiries.reset_index(), how='left',
+                                                            on=['Symbol', 'ExpiryDate'])['index']
+        found = positions.notna().to_numpy()
+        positions = positions.fillna(0).astype(np.int64).to_numpy()
+        trading_days = self.calendar.indices(records['Date'])
+        keys = pd.factorize(records['Symbol'])[0] * (len(self.calendar) + 1) + trading_days
+
+        variants = [('delta={}'.format(delta), self.expiry_windows(symbols, delta)) for delta in deltas]
+        for params in vol_oi_variants:
+            name = ','.join(['{}={}'.format(key, value) for key, value in sorted(params.items())])
+            variants.append((name, self.vol_oi_windows(symbols, records, **params)))
+
+        frames = []
+        for variant, windows in variants:
+            starts = windows['WindowStart'].to_numpy()[positions]
+            ends = windows['WindowEnd'].to_numpy()[positions]
+            selected = np.flatnonzero(found & (trading_days >= starts) & (trading_days < ends))
+            unique = ~pd.Series(keys[selected]).duplicated(keep=False).to_numpy()
+
+            frames.append(records.iloc[selected[unique]][DataAccess.FUTURES_COLUMNS])
+            print(variant, len(selected[unique]), 'records', (~unique).sum(), 'duplicates')
+
+        names = [variant for variant, windows in variants]
+        df = pd.concat(frames, axis=0, keys=names, names=['Variant']).reset_index(level=0).reset_index(drop=True)
+
+        if file is not None:
+            df.to_pickle(file)
+        else:
+            self.access.delete_sweep(names, symbols)
+            self.access.insert_frame(self.SWEEP_TABLE, df)
+            self.conn.commit()
+
+        return pd.DataFrame({'Variant': names, 'Records': [len(frame.index) for frame in frames]})
+
     def create_continuous_contracts(self, symbols=[], delta=0):
         """
         Create continuous contracts with rollover day on delta trading days from expiry
@@ -193,33 +666,19 @@ class DataDB:
         if len(symbols) == 0: # no symbol passed, default to all symbols
             symbols = self.unique_symbols()
 
-        records = pd.DataFrame()
-        for symbol in symbols:
-            print("Creating for {}".format(symbol))
-            expiries = self.expiry_history(symbol)
-
-            df = self.symbol_records(symbol)
-
-            df['TradingDay'] = [self.trading_day_idx[date] for date in df['Date']]
-
-            next_trading_day_idx = 0
-            expiry_idx = 0
+        print("Creating for {} symbols".format(len(symbols)))
 
-            for expiry in expiries:
-                #curr_expiry = expiries[expiry_idx]
-                curr_expiry_idx = self.trading_day(expiry)
-                sel_records = df.loc[(df['ExpiryDate'] == expiry) &
-                                     (df['TradingDay'] < curr_expiry_idx - delta ) &
-                                     (df['TradingDay'] >= next_trading_day_idx)]
-                records = pd.concat([records, sel_records], axis=0)
+        # records of each symbol batch are inserted as soon as they are selected, duplicates are per symbol
+        batches = [(batch, delta) for batch in self.symbol_batches(symbols)]
+        duplicate_frames = []
 
-                next_trading_day_idx = curr_expiry_idx - delta
-                expiry_idx = expiry_idx + 1
+        for df_insert in self.map_symbol_batches('continuous_contract_records', batches):
+            df_unique = df_insert.drop_duplicates(['Symbol', 'Date'], keep=False)
+            duplicate_frames.append(df_insert[df_insert.duplicated(['Symbol', 'Date'], keep=False)])
 
-        df_insert = records.drop(['TradingDay'], axis=1)
+            self.insert_records(df_unique, table_name='tblFutures')
 
-        df_unique = df_insert.drop_duplicates(['Symbol', 'Date'], keep=False)
-        df_duplicate = df_insert[df_insert.duplicated(['Symbol', 'Date'], keep=False)]
+        df_duplicate = pd.concat(duplicate_frames, axis=0) if len(duplicate_frames) > 0 else pd.DataFrame()
 
         try:
             os.remove(self.DUPLICATE_RECORDS_FILE)
@@ -228,110 +687,119 @@ class DataDB:
         if len(df_duplicate.index) > 0:
             df_duplicate.to_csv(self.DUPLICATE_RECORDS_FILE, sep=',', index=False)
 
-        self.insert_records(df_unique, table_name='tblFutures')
+        self.access.refresh_futures_watermarks(symbols)
+        self.conn.commit()
 
-    def prev_and_next_dates(self, c, symbol, expiry_date, symbols_latest_date, symbols_latest_exp, start, end):
+    @staticmethod
+    def sorted_prev_and_next_dates(futures_dates, futures_exps, expiry_date, latest_date, latest_exp, start, end):
         '''
-
-        :param c: DB connection
-        :param symbol: symbol
+        Prev and next tblFutures dates and expiries around a date range, found with bisect over the sorted
+        tblFutures dates of a symbol held in memory
+        :param futures_dates: sorted tblFutures dates of symbol
+        :param futures_exps: tblFutures expiry dates of symbol aligned with futures_dates
         :param expiry_date: current expiry date
-        :param symbols_latest_date: last date already selected for symbol
-        :param symbols_latest_exp: expiry_date for last date already selected for symbol
+        :param latest_date: last date already selected for symbol
+        :param latest_exp: expiry_date for last date already selected for symbol
         :param start: date range start
         :param end: date range end
         :return: {prev and next dates and expiries before and after date range}
         '''
 
-        prev_date_qry = '''SELECT Date, ExpiryDate FROM tblFutures 
-                                           WHERE Symbol = "{}" AND Date < "{}" ORDER BY Date DESC'''.format(symbol,
-                                                                                                            start)
-        next_date_qry = '''SELECT Date, ExpiryDate FROM tblFutures 
-                                           WHERE Symbol = "{}" AND Date > "{}" ORDER BY Date ASC'''.format(
-            symbol, end)
-
-        c.execute(prev_date_qry)
-        prev_date_record = c.fetchone()
+        prev_idx = bisect.bisect_left(futures_dates, start) - 1
 
-        if prev_date_record is None:
+        if prev_idx < 0:
             prev_date, prev_exp = '1900-01-01', expiry_date
         else:
-            prev_date, prev_exp = max(prev_date_record[0], symbols_latest_date), \
-                                  max(prev_date_record[1], symbols_latest_exp)
-        c.execute(next_date_qry)
-        next_date_record = c.fetchone()
+            prev_date, prev_exp = max(futures_dates[prev_idx], latest_date), max(futures_exps[prev_idx], latest_exp)
 
-        if next_date_record is None:
+        next_idx = bisect.bisect_right(futures_dates, end)
+
+        if next_idx == len(futures_dates):
             next_date, next_exp = '2100-12-31', expiry_date
         else:
-            next_date, next_exp = next_date_record[0], next_date_record[1]
+            next_date, next_exp = futures_dates[next_idx], futures_exps[next_idx]
 
         return {'prev_date': prev_date, 'prev_exp': prev_exp, 'next_date': next_date, 'next_exp': next_exp}
 
-    def manage_missed_records(self, symbols=[], delta=0):
+    def manage_missed_records(self, symbols=[], delta=0, date_range=None):
         '''
         Identify records missed while creating continuous contracts and insert them
+        Same selection as the original per date queries over sorted in memory arrays: missed records, tblFutures records
+        of the missed symbols and tblDump records of the missed expiries are read once per batch of symbols, date
+        ranges are found with bisect
         :param symbols: [list of symbols], no need to pass anything if for all symbols
+        :param date_range: {'start': first date, 'end': last date} as returned by process_staging_data, only check
+                           records missed in date_range, of symbols with records in it
         :return:
         '''
         print('start manage missed records')
 
-        if len(symbols) == 0:  # no symbol passed, default to all symbols
-            symbols = self.unique_symbols()
+        symbols = self.range_symbols(symbols, date_range)
+        start, end = ('1900-01-01', '2100-12-31') if date_range is None else (date_range['start'], date_range['end'])
 
-        # Identify symbol-date combinations which were available in tblDump but not included in tblFutures
+        utils.rmfile(self.SELECTED_RECORDS_FILE)
+        utils.rmfile(self.ELIGIBLE_RECORDS_FILE)
 
-        qry = '''SELECT tblDump.Symbol, tblDump.Date, tblDump.ExpiryDate, tblDump.VolumeLots
-                   FROM tblDump LEFT OUTER JOIN tblFutures
-                     ON tblDump.Symbol = tblFutures.Symbol
-                    AND tblDump.Date = tblFutures.Date
-                  WHERE tblFutures.Date is NULL
-                    AND tblDump.InstrumentName = "{}"
-                  ORDER BY tblDump.Symbol ASC, tblDump.ExpiryDate ASC, tblDump.Date ASC'''.format(self.INSTRUMENT_NAME)
+        # missed records of each batch of sorted symbols are read and checked on their own, in symbol order
+        batches = [(batch, start, end) for batch in self.symbol_batches(sorted(symbols))]
 
-        missed_records = pd.read_sql_query(qry, self.conn)
-        select_missed_records = missed_records if len(symbols) == 0 \
-            else missed_records[missed_records.Symbol.isin(symbols)]
+        # records of each batch are appended to the files as soon as they are selected
+        written = False
+        for selected_frames, eligible_frames in self.map_symbol_batches('missed_record_frames', batches):
+            if len(selected_frames) == 0:  # selected and eligible frames come in pairs
+                continue
+            for file, frames in [(self.SELECTED_RECORDS_FILE, selected_frames),
+                                 (self.ELIGIBLE_RECORDS_FILE, eligible_frames)]:
+                pd.concat(frames, axis=0).to_csv(file, sep=',', index=False, mode='a', header=not written)
+            written = True
 
-        try:
-            os.remove(self.SELECTED_RECORDS_FILE)
-            os.remove(self.ELIGIBLE_RECORDS_FILE)
-        except OSError:
-            pass
+        if not written:
+            pd.DataFrame().to_csv(self.SELECTED_RECORDS_FILE, sep=',', index=False)
+            pd.DataFrame().to_csv(self.ELIGIBLE_RECORDS_FILE, sep=',', index=False)
 
-        symbols_latest_date, symbols_latest_exp = dict(), dict()
+    def missed_record_frames(self, symbols, start='1900-01-01', end='2100-12-31'):
+        '''
+        Select the tblFutures records to replace and the eligible tblDump records of the records of symbols missed
+        between start and end, see manage_missed_records
+        :param symbols: [list of symbols]
+        :return: ([selected records frames], [eligible records frames])
+        '''
 
-        c = self.conn.cursor()
+        selected_frames, eligible_frames = [], []
+
+        # Identify symbol-date combinations which were available in tblDump but not included in tblFutures
+        select_missed_records = self.access.symbols_missed_records(symbols, self.INSTRUMENT_NAME, start, end)
+        if len(select_missed_records.index) == 0:
+            return selected_frames, eligible_frames
+
+        missed_symbols = select_missed_records['Symbol'].unique()
+        all_symbol_expiries = self.access.expiries(missed_symbols)
+
+        all_futures = self.access.symbols_futures(missed_symbols)
+        futures_groups = dict(list(all_futures.groupby('Symbol', sort=False)))
 
-        selected_records, eligible_records = pd.DataFrame(), pd.DataFrame()
+        missed_expiries = select_missed_records[['Symbol', 'ExpiryDate']].drop_duplicates()
+        all_candidates = self.access.expiries_records(zip(missed_expiries['Symbol'], missed_expiries['ExpiryDate']))
+        candidate_groups = dict(list(all_candidates.groupby(['Symbol', 'ExpiryDate'], sort=False)))
 
         # Loop through symbols
-        for symbol in select_missed_records['Symbol'].unique():
-            symbol_expiry_qry = '''SELECT ExpiryDate FROM tblExpiries WHERE Symbol = "{}" 
-                                    ORDER BY ExpiryDate ASC'''.format(symbol)
-            symbol_expiries = pd.read_sql_query(symbol_expiry_qry, self.conn)
+        for symbol, symbol_missed_records in select_missed_records.groupby('Symbol', sort=False):
+            symbol_expiries = all_symbol_expiries[symbol]
 
-            symbols_latest_date[symbol] = '1900-01-01'
-            symbols_latest_exp[symbol] = symbol_expiries['ExpiryDate'].tolist()[0]
+            latest_date, latest_exp = '1900-01-01', symbol_expiries[0]
 
-            symbol_missed_records = select_missed_records[select_missed_records.Symbol == symbol]
+            futures = futures_groups.get(symbol, all_futures.iloc[0:0]).reset_index(drop=True)
+            futures_dates, futures_exps = futures['Date'].tolist(), futures['ExpiryDate'].tolist()
 
             # Loop through expiry_dates for the symbol
-            for expiry_date in symbol_missed_records['ExpiryDate'].unique():
-                symbol_missed_records_for_expiry = \
-                    symbol_missed_records[symbol_missed_records.ExpiryDate == expiry_date]
-                if len(symbol_missed_records_for_expiry.index) == 0:
-                    print('{}: skipping expiry date {}, symbol latest date {}'.format(symbol, expiry_date,
-                                                                                      symbols_latest_date[symbol]))
-                    continue
-
+            for expiry_date, symbol_missed_records_for_expiry in symbol_missed_records.groupby('ExpiryDate',
+                                                                                               sort=False):
                 # Sort all dates selected
                 all_dates = symbol_missed_records_for_expiry['Date'].unique()
                 all_dates.sort()
 
-                prev_next_dates = self.prev_and_next_dates(c, symbol, expiry_date,
-                                                           symbols_latest_date[symbol], symbols_latest_exp[symbol],
-                                                           all_dates[0], all_dates[len(all_dates) - 1])
+                prev_next_dates = self.sorted_prev_and_next_dates(futures_dates, futures_exps, expiry_date,
+                                                                  latest_date, latest_exp, all_dates[0], all_dates[-1])
 
                 prev_date, prev_exp, next_date, next_exp = prev_next_dates['prev_date'], prev_next_dates['prev_exp'],\
                                                            prev_next_dates['next_date'], prev_next_dates['next_exp']
@@ -348,32 +816,23 @@ class DataDB:
                                                       dates.relativedate(next_date, days=-1)
 
                 # Select records for compare and deletion if needed
-                selected_records_qry = '''SELECT * FROM tblFutures
-                                                   WHERE Symbol = "{}" 
-                                                     AND Date BETWEEN "{}" AND "{}"'''.format(
-                    symbol, prev_date_plus_1, next_date_minus_1)
-
-                selected_records_temp = pd.read_sql_query(selected_records_qry, self.conn)
+                selected_records_temp = futures.iloc[bisect.bisect_left(futures_dates, prev_date_plus_1):
+                                                     bisect.bisect_right(futures_dates, next_date_minus_1)]
 
                 # Select eligible records
-                eligible_records_qry = '''SELECT Symbol, Date, Open, High, Low, Close, VolumeLots, OpenInterestLots, ExpiryDate 
-                                            FROM tblDump
-                                           WHERE Symbol = "{}" 
-                                             AND Date BETWEEN "{}" AND "{}"
-                                             AND ExpiryDate = "{}"'''.format(
-                    symbol, prev_date_plus_1, next_date_minus_1, expiry_date)
-
-                eligible_records_temp = pd.read_sql_query(eligible_records_qry, self.conn)
+                candidates = candidate_groups[(symbol, expiry_date)]
+                eligible_records_temp = candidates.iloc[
+                    candidates['Date'].searchsorted(prev_date_plus_1, side='left'):
+                    candidates['Date'].searchsorted(next_date_minus_1, side='right')]
 
                 # Loop through missing dates
                 for date in all_dates:
-                    prev_next_dates2 = self.prev_and_next_dates(c, symbol, expiry_date,
-                                                               symbols_latest_date[symbol], symbols_latest_exp[symbol],
-                                                               date, date)
+                    prev_next_dates2 = self.sorted_prev_and_next_dates(futures_dates, futures_exps, expiry_date,
+                                                                       latest_date, latest_exp, date, date)
 
                     next_exp = prev_next_dates2['next_exp']
 
-                    next_symbol_expiries = [d for d in symbol_expiries['ExpiryDate'].tolist() if d >= next_exp]
+                    next_symbol_expiries = symbol_expiries[bisect.bisect_left(symbol_expiries, next_exp):]
 
                     # Find expiry after the next to make sure records from too fare away are not identified as eligible
                     if len(next_symbol_expiries) >= 2:
@@ -384,20 +843,20 @@ class DataDB:
                         else:
                             next_next_expiry = next_symbol_expiries[len(next_symbol_expiries) - 1]
 
-                    eligible_records_temp2 = eligible_records_temp[(eligible_records_temp.Date >= date) &
-                                                                   (eligible_records_temp.ExpiryDate <= next_next_expiry) &
-                                                                   (eligible_records_temp.Date > symbols_latest_date[symbol])]
+                    # records on or after date and after the latest date already selected
+                    eligible_records_temp2 = eligible_records_temp.iloc[
+                        max(eligible_records_temp['Date'].searchsorted(date, side='left'),
+                            eligible_records_temp['Date'].searchsorted(latest_date, side='right')):] \
+                        if expiry_date <= next_next_expiry else eligible_records_temp.iloc[0:0]
 
                     if eligible_records_temp2.empty:
                         print(date, 'eligible_records empty, skipping')
                         continue
 
-                    start, end = eligible_records_temp2.iloc[0]['ExpiryDate'], \
-                                 eligible_records_temp2.iloc[len(eligible_records_temp2.index) - 1]['ExpiryDate']
-
-                    prev_next_dates3 = self.prev_and_next_dates(c, symbol, expiry_date,
-                                                               symbols_latest_date[symbol], symbols_latest_exp[symbol],
-                                                               start, end)
+                    # eligible records all belong to expiry_date
+                    prev_next_dates3 = self.sorted_prev_and_next_dates(futures_dates, futures_exps, expiry_date,
+                                                                       latest_date, latest_exp,
+                                                                       expiry_date, expiry_date)
 
                     prev_exp, next_exp = prev_next_dates3['prev_exp'], prev_next_dates3['next_exp']
 
@@ -405,34 +864,68 @@ class DataDB:
                         print(date, 'next expiry is out of place, skipping', expiry_date, prev_exp, next_exp)
                         continue
 
-                    selected_records_temp2 = selected_records_temp[(selected_records_temp.Date >= date) &
-                                                                   (selected_records_temp.Date > symbols_latest_date[symbol])]
+                    selected_records_temp2 = selected_records_temp.iloc[
+                        max(selected_records_temp['Date'].searchsorted(date, side='left'),
+                            selected_records_temp['Date'].searchsorted(latest_date, side='right')):]
 
                     if len(eligible_records_temp2.index) > len(selected_records_temp2.index):
-                        selected_records = pd.concat([selected_records, selected_records_temp2], axis=0)
-                        eligible_records = pd.concat([eligible_records, eligible_records_temp2], axis=0)
-                        symbols_latest_date[symbol] = \
-                            eligible_records_temp2.iloc[len(eligible_records_temp2.index) - 1]['Date']
-                        symbols_latest_exp[symbol] = \
-                            eligible_records_temp2.iloc[len(eligible_records_temp2.index) - 1]['ExpiryDate']
+                        selected_frames.append(selected_records_temp2)
+                        eligible_frames.append(eligible_records_temp2)
+                        latest_date = eligible_records_temp2.iloc[-1]['Date']
+                        latest_exp = eligible_records_temp2.iloc[-1]['ExpiryDate']
                         print('eligible selected records range', eligible_records_temp2.iloc[0]['Date'],
-                              eligible_records_temp2.iloc[len(eligible_records_temp2.index) - 1]['Date'],
-                              len(eligible_records_temp2.index))
+                              latest_date, len(eligible_records_temp2.index))
                         if len(selected_records_temp2.index) > 0:
                             print('replacing records range', selected_records_temp2.iloc[0]['Date'],
-                                  selected_records_temp2.iloc[len(selected_records_temp2.index) - 1]['Date'],
-                                  len(selected_records_temp2.index))
+                                  selected_records_temp2.iloc[-1]['Date'], len(selected_records_temp2.index))
                         else:
                             print('replacing records range', 'NA', len(selected_records_temp2.index))
 
                         break
 
-        selected_records.to_csv(self.SELECTED_RECORDS_FILE, sep=',', index=False)
-        eligible_records.to_csv(self.ELIGIBLE_RECORDS_FILE, sep=',', index=False)
+        return selected_frames, eligible_frames
 
-        c.close()
+    def insert_futures_records(self, df):
+        """
+        Insert records in tblFutures skipping (Symbol, Date) already present, in tblFutures or earlier in df:
+        records are staged in a temporary table, conflicts are captured with one query and the rest inserted with
+        one INSERT ... SELECT, commit is left to the caller
+        :param df: records with tblFutures columns
+        :return: DataFrame of skipped records, each after the record it clashed with (Flag 'Dup' and 'Ign')
+        """
+
+        self.access.stage_futures(df)
+
+        return self.insert_staged_futures_records(df)
+
+    def insert_staged_futures_records(self, df):
+        """
+        Insert the records staged in tmpFutures in tblFutures, see insert_futures_records
+        :param df: records staged, Seq of a staged record is its position in df
+        :return: DataFrame of skipped records, each after the record it clashed with (Flag 'Dup' and 'Ign')
+        """
+
+        conflicts = self.access.staged_futures_conflicts()
+        self.access.insert_staged_futures()
+
+        if len(conflicts.index) == 0:
+            return pd.DataFrame()
+
+        order = np.arange(len(conflicts.index)) * 2
+        duplicate_records = conflicts.drop(['Seq'], axis=1).assign(Flag="Dup", Order=order)
+        ignored_records = df.iloc[conflicts['Seq'].tolist()].assign(Flag="Ign", Order=order + 1)
+
+        return pd.concat([duplicate_records, ignored_records], axis=0).sort_values(
+            ['Order'], kind='mergesort').drop(['Order'], axis=1)
 
     def update_continuous_contract(self, symbols=[]):
+        """
+        Replace the selected records of manage_missed_records with the eligible records in one transaction: keys
+        to delete and records to insert are staged in temporary tables, filtered on symbols, and applied with one
+        DELETE and one INSERT ... SELECT
+        :param symbols: [list of symbols], no need to pass anything if for all symbols
+        :return:
+        """
 
         print('start update continuous contract')
 
@@ -443,43 +936,24 @@ class DataDB:
             print('Empty file, skipping update')
             return 0
 
-        c = self.conn.cursor()
-
-        # delete records
-        prev_symbol = ""
-        for idx, row in selected_records.iterrows():
-            if row['Symbol'] not in symbols and symbols != []:
-                continue
-            if row['Symbol'] != prev_symbol:
-                print('deleting', row['Symbol'])
-            delete_qry = '''DELETE FROM tblFutures 
-                             WHERE Symbol = "{}"
-                               AND Date = "{}"'''.format(row['Symbol'], row['Date'])
-            c.execute(delete_qry)
-            prev_symbol = row['Symbol']
-        self.conn.commit()
-
-        duplicate_ignored = pd.DataFrame()
-        for idx, row in eligible_records.iterrows():
-            if row['Symbol'] not in symbols and symbols != []:
-                continue
-
-            insert_row = (row['Symbol'], row['Date'], row['Open'], row['High'], row['Low'], row['Close'],
-                          row['VolumeLots'], row['OpenInterestLots'], row['ExpiryDate'])
-
-            check_qry = '''SELECT * FROM tblFutures WHERE Symbol = "{}" AND Date = "{}"'''.format(row['Symbol'],
-                                                                                              row['Date'])
+        try:
+            self.access.stage_futures_keys(zip(selected_records['Symbol'], selected_records['Date']))
+            self.access.stage_futures(eligible_records)
+            if symbols != []:
+                self.access.filter_staged_symbols(symbols)
 
-            duplicate_record = pd.read_sql_query(check_qry, self.conn)
+            # delete records
+            for symbol in self.access.staged_key_symbols():
+                print('deleting', symbol)
+            self.access.delete_staged_futures_keys()
 
-            if duplicate_record.empty:
-                c.execute('''INSERT INTO tblFutures VALUES (?,?,?,?,?,?,?,?,?)''', insert_row)
-            else:
-                duplicate_record['Flag'] = "Dup"
-                row['Flag'] = "Ign"
-                row_frame = row.to_frame().T
+            duplicate_ignored = self.insert_staged_futures_records(eligible_records)
+            self.access.refresh_futures_watermarks(self.access.staged_symbols())
 
-                duplicate_ignored = pd.concat([duplicate_ignored, duplicate_record, row_frame], axis=0)
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
 
         try:
             os.remove(self.DUPLICATE_IGNORED_FILE)
@@ -487,447 +961,648 @@ class DataDB:
             pass
         duplicate_ignored.to_csv(self.DUPLICATE_IGNORED_FILE, sep=',', index=False)
 
-        self.conn.commit()
-        c.close()
-
-    def expiry_sanity_check(self):
+    def expiry_sanity_check(self, symbols=[], start='1900-01-01', persist=False, fail=False, date_range=None):
+        """
+        Find tblFutures records whose expiry is before the expiry of the previous record of the symbol, with a
+        window function in sqlite over the records from the one before start instead of walking tblFutures in python
+        :param symbols: [list of symbols], no need to pass anything if for all symbols
+        :param start: only report violations from this date, the previous record may be before it
+        :param persist: replace tblExpiryViolations records of symbols from start with the violations found
+        :param fail: raise ValueError if any violation is found
+        :param date_range: {'start': first date, 'end': last date} as returned by process_staging_data, check from
+                           its start the symbols with records in it
+        :return: DataFrame of Symbol, Date, ExpiryDate, PrevDate, PrevExpiry
+        """
 
         print('start sanity check')
 
-        qry = '''SELECT * FROM tblFutures ORDER BY Symbol ASC, Date ASC'''
+        symbols = self.range_symbols(symbols, date_range)
+        if date_range is not None:
+            start = date_range['start']
 
-        records = pd.read_sql_query(qry, self.conn)
+        violations = self.access.expiry_regressions(symbols, start)
 
-        symbol = ""
-        for idx, row in records.iterrows():
-            if row['Symbol'] != symbol:
-                symbol = row['Symbol']
-                prev_exp, prev_date = '1900-01-01', '1900-01-01'
-            else:
-                if row['ExpiryDate'] < prev_exp:
-                    print(row['Symbol'], row['Date'], row['ExpiryDate'], prev_date, prev_exp)
-                prev_exp, prev_date = row['ExpiryDate'], row['Date']
+        for row in violations.itertuples(index=False):
+            print(row.Symbol, row.Date, row.ExpiryDate, row.PrevDate, row.PrevExpiry)
 
-    def load_table_from_csv(self, csv_path, table_name='tblDumpStaging'):
+        if persist:
+            self.access.replace_expiry_violations(symbols, start, violations)
+            self.conn.commit()
 
-        truncate_query = '''DELETE FROM {}'''.format(table_name)
+        if fail and len(violations.index) > 0:
+            raise ValueError('{} expiry violations in tblFutures from {}'.format(len(violations.index), start))
 
-        c = self.conn.cursor()
-        c.execute(truncate_query)
-        self.conn.commit()
+        return violations
 
-        csv_files = [f for f in os.listdir(csv_path + self.FORMATTED) if f.endswith('.csv')]
-        csv_files.sort()
+    def staging_frame(self, df):
+        """
+        Map formatted bhavcopy records to tblDumpStaging columns in one step
+        Records till LAYOUT_CHANGE_DATE use the old file layout, later records the new one
+        :param df: DataFrame read from a formatted bhavcopy file
+        :return: DataFrame with STAGING_COLUMNS
+        """
 
-        print('Initiating loading of {} files'.format(len(csv_files)))
+        old_layout = df['Date'] <= self.LAYOUT_CHANGE_DATE
 
-        read_count, write_count = 0, 0
+        frames = []
+        if old_layout.any():
+            old_records = df.loc[old_layout, list(self.OLD_LAYOUT_COLUMNS)].rename(columns=self.OLD_LAYOUT_COLUMNS)
+            old_records['InstrumentName'], old_records['OptionType'], old_records['StrikePrice'] = 'FUTCOM', '-', 0
+            frames.append(old_records)
+        if not old_layout.all():
+            new_records = df.loc[~old_layout, list(self.NEW_LAYOUT_COLUMNS)].rename(columns=self.NEW_LAYOUT_COLUMNS)
+            frames.append(new_records)
 
-        for file in csv_files:
-            df_file = pd.read_csv(csv_path + self.FORMATTED + file)
-            read_count = read_count + len(df_file.index)
+        if len(frames) == 0:
+            return pd.DataFrame(columns=self.STAGING_COLUMNS)
 
-            for idx, row in df_file.iterrows():
-                if row['Date'] <= '2017-05-12':
-                    insert_row = (row['Date'], 'FUTCOM', row['Symbol'], row['Expiry Date'],
-                                  '-', 0, row['Open'], row['High'], row['Low'],
-                                  row['Close'], row['Previous Close'], row['Volume'], row["Volume(In 000's)"],
-                                  row['Value'], row['Open Interest'])
-                else:
-                    insert_row = (row['Date'], row['Instrument Name'], row['Symbol'], row['Expiry Date'],
-                                  row['Option Type'], row['Strike Price'], row['Open'], row['High'], row['Low'],
-                                  row['Close'], row['Previous Close'], row['Volume(Lots)'], row["Volume(In 000's)"],
-                                  row['Value(Lacs)'], row['Open Interest(Lots)'])
-                c.execute('''INSERT INTO {} VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)'''.format(table_name),
-                          insert_row)
-
-            if read_count - write_count > 20000:
-                self.conn.commit()
-                write_count = read_count
-                print('inserted {} records till now'.format(write_count))
+        return pd.concat(frames, axis=0)[self.STAGING_COLUMNS]
 
-        self.conn.commit()
-        write_count = read_count
-        c.close()
+    def bulk_insert(self, c, df, table_name):
+        """
+        Insert all rows of df with a single executemany, commit is left to the caller
+        :param c: DB cursor
+        :param df: DataFrame with columns in table column order
+        :param table_name: table name
+        :return: number of rows inserted
+        """
 
-        print('{} files processed, {} records inserted'.format(len(csv_files), write_count))
+        insert_query = 'INSERT INTO {} VALUES ({})'.format(table_name, ','.join(['?'] * len(df.columns)))
+        c.executemany(insert_query, df.itertuples(index=False, name=None))
 
-    def process_staging_data(self):
+        return len(df.index)
 
-        c = self.conn.cursor()
+    def insert_staging_frames(self, c, frames, table_name, batch_files=100):
+        """
+        Map formatted bhavcopy DataFrames to staging columns and insert them batch_files frames at a time,
+        commit is left to the caller
+        :param c: DB cursor
+        :param frames: iterable of formatted bhavcopy DataFrames, one per file
+        :param table_name: staging table
+        :param batch_files: number of frames per executemany
+        :return: (number of frames, number of records inserted)
+        """
 
-        date_start_qry = '''SELECT Date FROM tblDumpStaging ORDER BY Date ASC'''
-        date_end_qry = '''SELECT Date FROM tblDumpStaging ORDER BY Date DESC'''
+        file_count, record_count = 0, 0
 
-        c.execute(date_start_qry)
-        date_start_record = c.fetchone()
-        c.execute(date_end_qry)
-        date_end_record = c.fetchone()
+        batch = []
+        for df in frames:
+            batch.append(self.staging_frame(df))
+            file_count += 1
+            if len(batch) == batch_files:
+                record_count = record_count + self.bulk_insert(c, pd.concat(batch, axis=0), table_name)
+                batch = []
+                print('inserted {} records till now'.format(record_count))
 
-        if date_start_record is None:
-            print('staging table empty')
-            return None
+        if len(batch) > 0:
+            record_count = record_count + self.bulk_insert(c, pd.concat(batch, axis=0), table_name)
 
-        start_date, end_date = date_start_record[0],date_end_record[0]
+        return file_count, record_count
 
-        print('Processing staging records from {} to {}'.format(start_date, end_date))
+    def load_table_from_frames(self, frames, table_name='tblDumpStaging', batch_files=100):
+        """
+        Load formatted bhavcopy DataFrames straight into staging table in a single transaction,
+        e.g. from csvhandler.stream_csv_files without writing formatted files
+        :param frames: iterable of formatted bhavcopy DataFrames, one per file
+        :param table_name: staging table
+        :param batch_files: number of frames per executemany
+        :return: number of records inserted
+        """
 
-        qry = '''SELECT * FROM tblDumpStaging'''
+        self.tune('bulk')
 
-        records = pd.read_sql_query(qry, self.conn)
+        c = self.conn.cursor()
+        try:
+            c.execute('''DELETE FROM {}'''.format(table_name))
 
-        for idx, row in records.iterrows():
-            insert_row = (row['Date'], row['InstrumentName'], row['Symbol'], row['ExpiryDate'],
-                          row['OptionType'], row['StrikePrice'], row['Open'], row['High'], row['Low'],
-                          row['Close'], row['PreviousClose'], row['VolumeLots'], row["VolumeThousands"],
-                          row['Value'], row['OpenInterestLots'])
+            start_time = time.time()
 
-            c.execute('''INSERT INTO tblDump VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)''', insert_row)
+            file_count, record_count = self.insert_staging_frames(c, frames, table_name, batch_files)
 
-        self.conn.commit()
-        c.close()
-        print('loaded {} records from staging to main dump'.format(len(records.index)))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            c.close()
+            self.tune('read')
 
-        self.write_expiries()
-        self.set_trading_day_idx()
+        elapsed = time.time() - start_time
+        print('{} files processed, {} records inserted in {:.2f} seconds ({:.0f} rows/sec)'.format(
+            file_count, record_count, elapsed, record_count / elapsed if elapsed > 0 else 0))
 
-        return {'start': start_date, 'end': end_date}
+        return record_count
 
-    def append_continuous_contracts(self, start_date, symbols=[], delta=0):
+    def load_table_from_csv(self, csv_path, table_name='tblDumpStaging', bulk=True, batch_files=100):
         """
-        Append continuous contracts with rollover day on delta trading days from expiry
-        delta = 0 means rollover happens on expiry day
-        :param symbols:
-        start_date: start date in tblDumpStaging (start for which append is needed
-        [list of symbols]: no need to pass anything if for all symbols
-        delta: delta days for rollover before expiry
+        Load formatted bhavcopy files into staging table
+        :param csv_path: path containing the formatted folder
+        :param table_name: staging table
+        :param bulk: True to map and insert batches of files with executemany in a single transaction,
+                     False to insert row by row
+        :param batch_files: number of files per executemany in bulk mode
         :return:
         """
 
-        if len(symbols) == 0: # no symbol passed, default to all symbols
-            symbols = self.unique_symbols(table='tblDumpStaging')
+        truncate_query = '''DELETE FROM {}'''.format(table_name)
+
+        self.tune('bulk')
 
         c = self.conn.cursor()
+        try:
+            c.execute(truncate_query)
+            self.conn.commit()
 
-        records = pd.DataFrame()
-        for symbol in symbols:
-            print("Appending for {}".format(symbol))
-            expiries = self.expiry_history(symbol)
+            csv_files = [f for f in os.listdir(csv_path + self.FORMATTED) if f.endswith('.csv')]
+            csv_files.sort()
 
-            df = self.symbol_records(symbol, start=start_date)
-            print('expiries', min(expiries), max(expiries), 'records', df['Date'].min(), df['Date'].max())
+            print('Initiating {} loading of {} files'.format('bulk' if bulk else 'row by row', len(csv_files)))
 
-            df['TradingDay'] = [self.trading_day_idx[date] for date in df['Date']]
+            start_time = time.time()
+            read_count, write_count = 0, 0
 
-            latest_expiry_qry = '''SELECT ExpiryDate FROM tblFutures 
-                                  WHERE Symbol = "{}" 
-                                  ORDER BY Date DESC'''.format(symbol)
+            if bulk:
+                frames = (pd.read_csv(csv_path + self.FORMATTED + file) for file in csv_files)
+                read_count = self.insert_staging_frames(c, frames, table_name, batch_files)[1]
+            else:
+                for file in csv_files:
+                    df_file = pd.read_csv(csv_path + self.FORMATTED + file)
+                    read_count = read_count + len(df_file.index)
+
+                    for idx, row in df_file.iterrows():
+                        if row['Date'] <= self.LAYOUT_CHANGE_DATE:
+                            insert_row = (row['Date'], 'FUTCOM', row['Symbol'], row['Expiry Date'],
+                                          '-', 0, row['Open'], row['High'], row['Low'],
+                                          row['Close'], row['Previous Close'], row['Volume'], row["Volume(In 000's)"],
+                                          row['Value'], row['Open Interest'])
+                        else:
+                            insert_row = (row['Date'], row['Instrument Name'], row['Symbol'], row['Expiry Date'],
+                                          row['Option Type'], row['Strike Price'], row['Open'], row['High'], row['Low'],
+                                          row['Close'], row['Previous Close'], row['Volume(Lots)'], row["Volume(In 000's)"],
+                                          row['Value(Lacs)'], row['Open Interest(Lots)'])
+                        c.execute('''INSERT INTO {} VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)'''.format(table_name),
+                                  insert_row)
+
+                    if read_count - write_count > 20000:
+                        self.conn.commit()
+                        write_count = read_count
+                        print('inserted {} records till now'.format(write_count))
+
+            self.conn.commit()
+            write_count = read_count
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            c.close()
+            self.tune('read')
+
+        elapsed = time.time() - start_time
+        print('{} files processed, {} records inserted in {:.2f} seconds ({:.0f} rows/sec)'.format(
+            len(csv_files), write_count, elapsed, write_count / elapsed if elapsed > 0 else 0))
+
+    def process_staging_data(self, on_conflict='ignore'):
+        """
+        Promote tblDumpStaging records to tblDump with set based statements in a single transaction
+        Records are matched on DUMP_KEY, so re-running a delta does not duplicate records
+        :param on_conflict: 'ignore' keeps records already in tblDump, 'replace' overwrites them with staged records
+        :return: {'start': first staged date, 'end': last staged date}
+        """
 
-            c.execute(latest_expiry_qry)
-            latest_expiry_record = c.fetchone()
+        if on_conflict not in self.ON_CONFLICT:
+            raise ValueError('on_conflict must be one of {}'.format(self.ON_CONFLICT))
 
-            if latest_expiry_record is None:
-                print('{}: symbol not found in tblFutures'.format(symbol))
-                latest_expiry = '1900-01-01'
-            else:
-                latest_expiry = latest_expiry_record[0]
-                print(symbol, ': latest expiry', latest_expiry)
+        c = self.conn.cursor()
 
-            next_trading_day_idx = 0
+        c.execute('''SELECT MIN(Date), MAX(Date), COUNT(*) FROM tblDumpStaging''')
+        start_date, end_date, staged_count = c.fetchone()
 
-            eligible_expiries = [expiry for expiry in expiries if expiry >= latest_expiry]
-            eligible_expiries.sort()
+        if start_date is None:
+            print('staging table empty')
+            return None
 
-            for expiry in eligible_expiries:
-                print('processing expiry', expiry)
-                curr_expiry_idx = self.trading_day(expiry)
-                sel_records = df.loc[(df['ExpiryDate'] == expiry) &
-                                     (df['TradingDay'] < curr_expiry_idx - delta) &
-                                     (df['TradingDay'] >= next_trading_day_idx)]
-                records = pd.concat([records, sel_records], axis=0)
+        print('Processing {} staging records from {} to {}'.format(staged_count, start_date, end_date))
 
-                next_trading_day_idx = curr_expiry_idx - delta
+        self.tune('bulk')
 
-        df_insert = records.drop(['TradingDay'], axis=1)
+        key_match = ' AND '.join(['tblDump.{0} IS S.{0}'.format(column) for column in self.DUMP_KEY])
 
-        df_unique = df_insert.drop_duplicates(['Symbol', 'Date'], keep=False)
-        df_duplicate = df_insert[df_insert.duplicated(['Symbol', 'Date'], keep=False)]
+        # One staged record per key, the last staged one wins on replace
+        unique_staged_qry = '''SELECT {}(rowid) FROM tblDumpStaging GROUP BY {}'''.format(
+            'MAX' if on_conflict == 'replace' else 'MIN', ', '.join(self.DUMP_KEY))
 
+        replaced_count = 0
         try:
-            os.remove(self.DUPLICATE_RECORDS_FILE)
-            os.remove(self.APPENDED_RECORDS_FILE)
-        except OSError:
-            pass
+            if on_conflict == 'replace':
+                c.execute('''DELETE FROM tblDump
+                              WHERE EXISTS (SELECT 1 FROM tblDumpStaging S WHERE {})'''.format(key_match))
+                replaced_count = c.rowcount
+
+            c.execute('''INSERT INTO tblDump
+                         SELECT * FROM tblDumpStaging S
+                          WHERE S.rowid IN ({})
+                            AND NOT EXISTS (SELECT 1 FROM tblDump WHERE {})'''.format(unique_staged_qry, key_match))
+            inserted_count = c.rowcount
+
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            c.close()
+            self.tune('read')
+        print('loaded {} records from staging to main dump, {} replaced, {} ignored'.format(
+            inserted_count, replaced_count, staged_count - inserted_count))
+
+        if self.cache is not None:
+            self.update_symbol_cache(start_date, end_date)
+
+        self.write_expiries({'start': start_date, 'end': end_date})
+        self.set_trading_day_idx()
 
-        if len(df_duplicate.index) > 0:
-            df_duplicate.to_csv(self.DUPLICATE_RECORDS_FILE, sep=',', index=False)
+        return {'start': start_date, 'end': end_date}
 
-        if len(df_unique.index) > 0:
-            df_unique.to_csv(self.APPENDED_RECORDS_FILE, sep=',', index=False)
+    def append_continuous_contracts(self, start_date, symbols=[], delta=0, write_reports=True):
+        """
+        Append continuous contracts with rollover day on delta trading days from expiry
+        delta = 0 means rollover happens on expiry day
+        Only records from start_date and expiries from the last expiry in tblFuturesWatermarks are read,
+        so the append costs time in proportion to the new data
+        :param symbols:
+        start_date: start date in tblDumpStaging (start for which append is needed
+        [list of symbols]: no need to pass anything if for all symbols
+        delta: delta days for rollover before expiry
+        write_reports: write APPENDED_RECORDS_FILE and DUPLICATE_RECORDS_FILE if not empty, and DUPLICATE_IGNORED_FILE
+        :return: number of records appended
+        """
 
-        duplicate_ignored = pd.DataFrame()
-        for idx, row in df_unique.iterrows():
-            if row['Symbol'] not in symbols and symbols != []:
-                continue
+        if len(symbols) == 0: # no symbol passed, default to all symbols
+            symbols = self.unique_symbols(table='tblDumpStaging')
 
-            insert_row = (row['Symbol'], row['Date'], row['Open'], row['High'], row['Low'], row['Close'],
-                          row['VolumeLots'], row['OpenInterestLots'], row['ExpiryDate'])
+        watermarks = self.access.futures_watermarks(symbols)
+        for symbol in symbols:
+            if symbol not in watermarks:
+                print('{}: symbol not found in tblFutures'.format(symbol))
+            else:
+                print(symbol, ': latest date', watermarks[symbol][0], 'latest expiry', watermarks[symbol][1])
 
-            check_qry = '''SELECT * FROM tblFutures WHERE Symbol = "{}" AND Date = "{}"'''.format(row['Symbol'],
-                                                                                                  row['Date'])
+        df_insert = self.continuous_contract_records(symbols, delta, start=start_date, pending=True)
 
-            duplicate_record = pd.read_sql_query(check_qry, self.conn)
+        df_unique = df_insert.drop_duplicates(['Symbol', 'Date'], keep=False)
+        df_duplicate = df_insert[df_insert.duplicated(['Symbol', 'Date'], keep=False)]
 
-            if duplicate_record.empty:
-                c.execute('''INSERT INTO tblFutures VALUES (?,?,?,?,?,?,?,?,?)''', insert_row)
-                pass
-            else:
-                duplicate_record['Flag'] = "Dup"
-                row['Flag'] = "Ign"
-                row_frame = row.to_frame().T
+        duplicate_ignored = self.insert_futures_records(df_unique)
+        self.access.refresh_futures_watermarks(symbols)
+        self.conn.commit()
 
-                duplicate_ignored = pd.concat([duplicate_ignored, duplicate_record, row_frame], axis=0)
+        print('appended {} records, {} duplicates, {} ignored'.format(
+            len(df_unique.index) - len(duplicate_ignored.index) // 2, len(df_duplicate.index),
+            len(duplicate_ignored.index) // 2))
 
-        try:
-            os.remove(self.DUPLICATE_IGNORED_FILE)
-        except OSError:
-            pass
-        duplicate_ignored.to_csv(self.DUPLICATE_IGNORED_FILE, sep=',', index=False)
+        if write_reports:
+            for file, df in [(self.DUPLICATE_RECORDS_FILE, df_duplicate), (self.APPENDED_RECORDS_FILE, df_unique)]:
+                utils.rmfile(file)
+                if len(df.index) > 0:
+                    df.to_csv(file, sep=',', index=False)
 
-        self.conn.commit()
-        c.close()
+            utils.rmfile(self.DUPLICATE_IGNORED_FILE)
+            duplicate_ignored.to_csv(self.DUPLICATE_IGNORED_FILE, sep=',', index=False)
 
-    def calculate_historical_multipliers(self, type='append', symbols=[]):
+        return len(df_unique.index) - len(duplicate_ignored.index) // 2
+
+    def calculate_historical_multipliers(self, type='append', symbols=[], date_range=None):
         """
         Calculate historical rollover multipliers
+        Rollovers of all symbols and the closes of both expiries on the last day before each rollover come from
+        one query, resultant multipliers are cumulative products per symbol
         :param symbols: [symbol1, symbol2,...]
         type: 'append' if multipliers to be appended, 'refresh, if multipliers to be refreshed
-        :return:
+        date_range: {'start': first date, 'end': last date} as returned by process_staging_data, only symbols
+                    with records in date_range, no need to pass symbols
+        :return: DataFrame of tblMultipliers records inserted, the whole of tblMultipliers is written to
+                 multipliers.csv
         """
         print('start calculate multipliers')
 
+        symbols = self.range_symbols(symbols, date_range)
+
         if type == 'refresh':
             print('refreshing tblMultipliers')
-            df = pd.DataFrame()
+            last_multipliers = dict()
         else:
             print('appending tblMultipliers')
-            qry = '''SELECT * FROM tblMultipliers'''
-            df = pd.read_sql_query(qry, self.conn)
+            last_multipliers = self.access.last_multipliers(symbols)
+
+        # (symbol, last rollover date, last expiry) to continue from, resultant multiplier starts from the last one
+        starts = [(symbol,) + last_multipliers.get(symbol, ('1900-01-01', '1900-01-01', 1))[:2][::-1]
+                  for symbol in symbols]
+        start_multipliers = {symbol: last_multipliers.get(symbol, (None, None, 1))[2] for symbol in symbols}
+
+        batches = [(batch,) for batch in self.symbol_batches(starts)]
+        df = pd.concat(list(self.map_symbol_batches('rollover_records', batches)), axis=0, ignore_index=True)
+        if len(batches) > 1:  # batches are ordered by Symbol, NextExpiry on their own
+            df = df.sort_values('Symbol', kind='mergesort').reset_index(drop=True)
+        df[['DumpClose', 'FuturesClose']] = df[['DumpClose', 'FuturesClose']].astype(float)  # NULL closes as NaN
+
+        found = df['MultiplierCalcDate'].notna()
+        zero_close = found & ((df['FuturesClose'] == 0) | (df['DumpClose'] == 0))
+
+        df['MultiplierCalcType'] = np.where(~found, "Not Found Default 1",
+                                            np.where(zero_close, "Zero Close Default 1",
+                                                     np.where(df['MultiplierCalcDate'] == df['RolloverDate'],
+                                                              "Same Day", "Before Rollover")))
+        df['MultiplierCalcDate'] = df['MultiplierCalcDate'].where(found, df['RolloverDate'])
+        df['DaysBetweenCalcRollover'] = self.calendar.indices(df['RolloverDate']) - \
+                                        self.calendar.indices(df['MultiplierCalcDate'])
+        df['Multiplier'] = (df['DumpClose'] / df['FuturesClose']).where(found & ~zero_close, 1.0)
+
+        # resultant multiplier = last resultant multiplier * product of the multipliers since, in rollover order
+        first = ~df['Symbol'].duplicated()
+        factors = df['Multiplier'].where(~first, df['Symbol'].map(start_multipliers).astype(float) * df['Multiplier'])
+        df['ResultantMultiplier'] = factors.groupby(df['Symbol']).cumprod()
+
+        df = df[['Symbol', 'RolloverDate', 'PreviousExpiry', 'NextExpiry', 'DumpClose', 'FuturesClose',
+                 'MultiplierCalcType', 'MultiplierCalcDate', 'DaysBetweenCalcRollover', 'Multiplier',
+                 'ResultantMultiplier']]
 
-        if len(symbols) == 0:  # no symbol passed, default to all symbols
-            symbols = self.unique_symbols()
+        if type == 'refresh':
+            self.access.delete_symbols('tblMultipliers', symbols)
+        self.access.insert_frame('tblMultipliers', df)
+        self.conn.commit()
 
-        #c = self.conn.cursor()
+        self.access.all_multipliers().to_csv('multipliers.csv', sep=',', index=False)
 
-        # Loop through symbols
-        for symbol in symbols:
-            print(symbol, 'calculating multipliers')
-
-            if type == 'refresh':
-                prev_expiry = prev_date = '1900-01-01'
-                resultant_multiplier = 1
-            else: # type == 'append'
-                prev_expiry_qry = '''SELECT NextExpiry PrevExpiry, RolloverDate PrevDate, ResultantMultiplier
-                                       FROM tblMultipliers WHERE Symbol = "{}"
-                                      ORDER BY RolloverDate DESC LIMIT 1'''.format(symbol)
-                prev_expiry_record = pd.read_sql_query(prev_expiry_qry, self.conn)
-                if len(prev_expiry_record.index) > 0:
-                    prev_expiry = prev_expiry_record.iloc[0]['PrevExpiry']
-                    prev_date = prev_expiry_record.iloc[0]['PrevDate']
-                    resultant_multiplier = prev_expiry_record.iloc[0]['ResultantMultiplier']
-                else:
-                    prev_expiry = prev_date = '1900-01-01'
-                    resultant_multiplier = 1
+        print('{} rollovers for {} symbols'.format(len(df.index), df['Symbol'].nunique()))
 
-            # print(symbol, prev_date, prev_expiry)
-            symbol_records_qry = '''SELECT * FROM tblFutures WHERE Symbol = "{}" AND Date > "{}"
-                                    ORDER BY ExpiryDate ASC'''.format(symbol, prev_date)
-            symbol_records = pd.read_sql_query(symbol_records_qry, self.conn)
+        return df
 
-            for idx, row in symbol_records.iterrows():
-                if prev_expiry == row['ExpiryDate']:
-                    continue
+    def rollover_records(self, starts):
+        """
+        Return rollovers of symbols after their start, see DataAccess.rollovers
+        :param starts: [(symbol, start date, expiry at start date),...]
+        """
 
-                if prev_expiry == '1900-01-01':
-                    prev_expiry = row['ExpiryDate']
-                    continue
+        return self.access.rollovers(starts, self.INSTRUMENT_NAME)
 
-                earlier_day_qry = '''SELECT F.Date, F.Close FuturesClose, D.Close DumpClose
-                           FROM tblDump F JOIN tblDump D
-                             ON F.Symbol = D.Symbol
-                            AND F.Date = D.Date
-                          WHERE F.Symbol = "{}"
-                            AND F.Date < "{}"
-                            AND F.InstrumentName = "{}"
-                            AND D.InstrumentName = "{}"
-                            AND F.ExpiryDate = "{}"
-                            AND D.ExpiryDate = "{}"
-                          ORDER BY F.Date DESC
-                          LIMIT 1'''.format(symbol, row['Date'], self.INSTRUMENT_NAME, self.INSTRUMENT_NAME,
-                                            row['ExpiryDate'], prev_expiry)
-
-                #multiplier_record = pd.read_sql_query(same_day_qry, self.conn)
-
-                #if len(multiplier_record.index) == 0:
-                multiplier_record = pd.read_sql_query(earlier_day_qry, self.conn)
-
-                if len(multiplier_record.index) > 0:
-                    multiplier_calc_date = multiplier_record.iloc[0]['Date']
-                    multiplier_calc_type = "Same Day" if multiplier_calc_date == row['Date'] else "Before Rollover"
-                    futures_close, dump_close = multiplier_record.iloc[0]['FuturesClose'], \
-                                              multiplier_record.iloc[0]['DumpClose']
-                    if futures_close == 0 or dump_close == 0:
-                        multiplier_calc_type = "Zero Close Default 1"
-                        multiplier = 1
-                        # resultant_multiplier remains same
-                    else:
-                        multiplier = dump_close / futures_close
-                        resultant_multiplier = resultant_multiplier * multiplier
-                else:
-                    multiplier_calc_date = row['Date']
-                    multiplier_calc_type = "Not Found Default 1"
-                    futures_close = dump_close = None
-                    multiplier = 1
-                    # resultant_multiplier remains same
+    def create_adjusted_contract(self, symbols=[], date_range=None, repair=False):
+        """
+        Create adjusted contract records in tblContract for tblFutures records after the last tblContract date of
+        each symbol
+        Each record takes the resultant multiplier of the last rollover on or before its date, joined with a sorted
+        as-of merge per symbol, records before the first rollover take the resultant multiplier of the first one
+        and symbols without rollovers 1. OHLC are adjusted and rounded as whole columns for all symbols of a batch at once
+        :param symbols: [list of symbols], no need to pass anything if for all symbols
+        :param date_range: {'start': first date, 'end': last date} as returned by process_staging_data, only symbols
+                           with records in it, in lazy adjustment mode only their factors are refreshed
+        :param repair: look up every tblFutures record not yet in tblContract instead, of all symbols if none are
+                       passed, to fill in records added to tblFutures before the last tblContract date, e.g. missed
+                       records of back filled dates
+        :return: number of records inserted, in lazy adjustment mode the number of tblFutures records of the
+                 symbols whose adjustment factors were refreshed, as vwContract adjusts all of them on read.
+                 vwContract rounds with SQLite ROUND, which rounds near ties away from zero, so its adjusted prices
+                 can differ in the last digit from the ones written here, e.g. 2.68 instead of 2.67 for 2.675
+        """
 
-                days_between = self.trading_day(row['Date']) - self.trading_day(multiplier_calc_date)
+        print('start create adjusted contract')
 
-                insert_row = [('Symbol', symbol), ('RolloverDate', row['Date']), ('PreviousExpiry', prev_expiry),
-                              ('NextExpiry', row['ExpiryDate']), ('DumpClose', dump_close),
-                              ('FuturesClose', futures_close), ('MultiplierCalcType', multiplier_calc_type),
-                              ('MultiplierCalcDate', multiplier_calc_date), ('DaysBetweenCalcRollover', days_between),
-                              ('Multiplier', multiplier), ('ResultantMultiplier', resultant_multiplier)]
+        if self.lazy_adjustment:
+            symbols = self.range_symbols(symbols, date_range)
+            self.refresh_adjustment_factors(symbols)
+            return self.access.futures_record_count(symbols)
 
-                df = pd.concat([df, pd.DataFrame([OrderedDict(insert_row)])], axis=0)
+        symbols = self.range_symbols(symbols, None if repair else date_range)
 
-                prev_expiry = row['ExpiryDate']
+        # batches of sorted symbols keep tblContract records in Symbol, Date order, each is committed on its own
+        batches = [(batch, repair) for batch in self.symbol_batches(sorted(symbols))]
+        records, adjusted_symbols = 0, 0
 
-        #print(df[df.duplicated(['Symbol', 'RolloverDate'], keep=False)])
-        df.to_csv('multipliers.csv', sep=',', index=False)
+        for df in self.map_symbol_batches('adjusted_contract_records', batches):
+            self.access.insert_frame('tblContract', df)
+            self.conn.commit()
+            records, adjusted_symbols = records + len(df.index), adjusted_symbols + df['Symbol'].nunique()
 
-        truncate_query = '''DELETE FROM tblMultipliers'''
+        print('{} adjusted contract records for {} symbols'.format(records, adjusted_symbols))
 
-        c = self.conn.cursor()
-        c.execute(truncate_query)
-        self.conn.commit()
+        return records
 
-        self.insert_records(df, table_name='tblMultipliers')
+    def adjusted_contract_records(self, symbols, repair=False):
+        """
+        Return adjusted contract records of symbols for tblFutures records after the last tblContract date of each
+        symbol, see create_adjusted_contract
+        :param symbols: [list of symbols]
+        :param repair: for all tblFutures records not yet in tblContract instead
+        :return: DataFrame with tblContract columns ordered by Symbol, Date
+        """
 
-    def create_adjusted_contract(self, symbols=[]):
+        # Find records which are available in tblFutures but not in tblContract
+        records = self.access.missing_contract_records(symbols) if repair else \
+            self.access.new_contract_records(symbols)
+        multipliers = self.access.multipliers(symbols)[['Symbol', 'RolloverDate', 'PreviousExpiry',
+                                                        'ResultantMultiplier']]
 
-        print('start create adjusted contract')
+        # merge_asof needs a numeric key sorted on both sides
+        records = records.assign(AsOf=dates.date_array(records['Date'])).sort_values('AsOf', kind='mergesort')
+        multipliers = multipliers.assign(AsOf=dates.date_array(multipliers['RolloverDate'])).sort_values(
+            'AsOf', kind='mergesort')
+
+        df = pd.merge_asof(records, multipliers, on='AsOf', by='Symbol', direction='backward')
+        df = df.sort_values(['Symbol', 'Date'], kind='mergesort').reset_index(drop=True)
+
+        first_multipliers = multipliers.groupby('Symbol')['ResultantMultiplier'].first()
+        df['Multiplier'] = df['ResultantMultiplier'].fillna(df['Symbol'].map(first_multipliers)).fillna(1).astype(float)
+
+        # the record before a rollover should be of the expiry rolled from
+        prev_records = df.groupby('Symbol')[['RolloverDate', 'ExpiryDate']].shift(1)
+        mismatch = df['RolloverDate'].notna() & prev_records['ExpiryDate'].notna() & \
+                   (df['RolloverDate'] != prev_records['RolloverDate']) & \
+                   (df['PreviousExpiry'] != prev_records['ExpiryDate'])
+        for row in df.loc[mismatch].assign(PrevExpiry=prev_records.loc[mismatch, 'ExpiryDate']).itertuples(index=False):
+            print(row.Symbol, row.Date, row.PrevExpiry, row.PreviousExpiry, 'expiry date mismatch')
+
+        df[['AdjustedOpen', 'AdjustedHigh', 'AdjustedLow', 'AdjustedClose']] = round_prices(
+            df[['Open', 'High', 'Low', 'Close']].to_numpy(dtype=float) * df[['Multiplier']].to_numpy())
+
+        df = df[DataAccess.FUTURES_COLUMNS + ['AdjustedOpen', 'AdjustedHigh', 'AdjustedLow', 'AdjustedClose',
+                                              'Multiplier']]
+
+        return df
+
+    def refresh_adjustment_factors(self, symbols=[]):
+        """
+        Recompute tblAdjustmentFactors from tblMultipliers, one record per rollover of each symbol, adjusted prices
+        of all bars then follow through vwContract without rewriting them
+        :param symbols: [list of symbols], no need to pass anything if for all symbols
+        :return: number of symbols refreshed
+        """
 
         if len(symbols) == 0:  # no symbol passed, default to all symbols
             symbols = self.unique_symbols()
 
-        df = pd.DataFrame()
-
-        for symbol in symbols:
-            print('creating adjusted contract for', symbol)
-
-            # Find records which are available in tblFutures but not in tblContract
-            qry = '''SELECT F.* 
-                       FROM tblFutures F LEFT OUTER JOIN tblContract C
-                         ON F.Symbol = C.Symbol
-                        AND F.Date = C.Date
-                      WHERE F.Symbol = "{}"
-                        AND C.Date is NULL
-                      ORDER BY F.Date ASC'''.format(symbol)
-
-            symbol_records = pd.read_sql_query(qry, self.conn)
-
-            multiplier_qry = '''SELECT * 
-                                  FROM tblMultipliers
-                                 WHERE Symbol = "{}"
-                                 ORDER BY RolloverDate ASC'''.format(symbol)
-            multiplier_records = pd.read_sql_query(multiplier_qry, self.conn)
-
-            prev_expiry = '1900-01-01'
-            m_idx = 0
-            multiplier = 1
-            adjusted_open, adjusted_high, adjusted_low, adjusted_close, multipliers = [], [], [], [], []
-            count = 1
-            for idx, row in symbol_records.iterrows():
-                #print('count', count)
-                #print(multiplier_records.iloc[m_idx])
-                #print(len(multiplier_records), m_idx)
-                #print(multiplier_records)
-                if len(multiplier_records.index) == 0:
-                    multiplier = 1
-                elif prev_expiry == '1900-01-01':
-                    selected_multiplier_record = multiplier_records[multiplier_records.RolloverDate >= row['Date']]
-                    if len(selected_multiplier_record.index) == 0:
-                        multiplier = multiplier_records.iloc[-1]['ResultantMultiplier'] # Last record
-                        m_idx = multiplier_records.axes[0][-1]  # Axis of last record
-                    else:
-                        multiplier = selected_multiplier_record.iloc[0]['ResultantMultiplier'] # First selected record
-                        m_idx = selected_multiplier_record.axes[0][0]  # Axis of first record
-                elif row['Date'] >= multiplier_records.iloc[m_idx]['RolloverDate']:
-                    multiplier = multiplier_records.iloc[m_idx]['ResultantMultiplier']
-                    if prev_expiry != multiplier_records.iloc[m_idx]['PreviousExpiry'] \
-                            and m_idx + 1 < len(multiplier_records):
-                        print(symbol, row['Date'], prev_expiry, multiplier_records.iloc[m_idx]['PreviousExpiry'],
-                              'expiry date mismatch')
-                    if m_idx + 1 < len(multiplier_records):
-                        m_idx = m_idx + 1
-                #if m_idx > 2:
-                #    continue
+        self.access.refresh_adjustment_factors(symbols)
+        self.conn.commit()
 
-                #print(adjusted_open)
-                adjusted_open.append(round(row['Open'] * multiplier, 2))
-                #print('open', len(adjusted_open), row['Open'], row['Open'] * multiplier, adjusted_open)
-                adjusted_high.append(round(row['High'] * multiplier, 2))
-                adjusted_low.append(round(row['Low'] * multiplier, 2))
-                adjusted_close.append(round(row['Close'] * multiplier, 2))
-                multipliers.append(multiplier)
+        print('refreshed adjustment factors for {} symbols'.format(len(symbols)))
 
-                prev_expiry = row['ExpiryDate']
-                count = count + 1
+        return len(symbols)
 
-            #print(len(symbol_records))
-            #print(len(adjusted_open))
+    def contract_records(self, symbols=[], start='1900-01-01', end='2100-12-31', back_adjust=False):
+        """
+        Return adjusted contract records, from vwContract in lazy adjustment mode, else from tblContract
+        :param symbols: [list of symbols], no need to pass anything if for all symbols
+        :param start: date range start
+        :param end: date range end
+        :param back_adjust: scale adjusted prices to the last rollover of each symbol, so that the latest bars are
+                            unadjusted and every new rollover moves the history before it
+        :return: DataFrame with tblContract columns ordered by Symbol, Date
+        """
 
-            symbol_records['AdjustedOpen'] = adjusted_open
-            symbol_records['AdjustedHigh'] = adjusted_high
-            symbol_records['AdjustedLow'] = adjusted_low
-            symbol_records['AdjustedClose'] = adjusted_close
-            symbol_records['Multiplier'] = multipliers
+        if len(symbols) == 0:  # no symbol passed, default to all symbols
+            symbols = self.unique_symbols()
 
-            #print(symbol_records)
-            df = pd.concat([df, symbol_records], axis=0)
+        df = self.access.contract_records(symbols, start, end, self.contract_table)
 
-        # print(df[df.duplicated(['Symbol', 'Date'], keep=False)])
-        df.to_csv('contract.csv', sep=',', index=False)
+        if back_adjust:
+            last_factors = self.access.last_factors(symbols) if self.lazy_adjustment else \
+                {symbol: row[2] for symbol, row in self.access.last_multipliers(symbols).items()}
+            df['Multiplier'] = df['Multiplier'] / df['Symbol'].map(last_factors).fillna(1)
+            df[['AdjustedOpen', 'AdjustedHigh', 'AdjustedLow', 'AdjustedClose']] = round_prices(
+                df[['Open', 'High', 'Low', 'Close']].to_numpy(dtype=float) * df[['Multiplier']].to_numpy())
 
-        self.insert_records(df, table_name='tblContract')
+        return df
 
-    def create_amibroker_import_files(self, path, start_date='1900-01-01'):
+    def create_amibroker_import_files(self, path, start_date='1900-01-01', per_symbol=False, compress=False,
+                                      chunksize=AMIBROKER_CHUNK_SIZE):
+        """
+        Write Amibroker import files of adjusted contract records from start_date: unadjusted records in
+        <last date>.csv, adjusted records of symbol-A in <last date>.A.csv
+        Records are streamed ordered by Symbol, Date in chunks, both files are formatted from each chunk while a
+        writer thread writes the previous ones
+        :param path: output folder
+        :param start_date: first date to export
+        :param per_symbol: write <last date>.<symbol>.csv and <last date>.<symbol>.A.csv for each symbol instead
+        :param compress: gzip the files, .gz is added to their names
+        :param chunksize: records per chunk
+        :return: number of records exported
+        """
 
-        qry = '''SELECT * FROM tblContract WHERE Date >= "{}"'''.format(start_date)
+        last_date = self.access.contract_last_date(start_date, self.contract_table)
+        if last_date is None:
+            print('no contract records from', start_date)
+            return 0
 
-        all_fields = pd.read_sql_query(qry, self.conn)
-        print(all_fields)
+        writes = queue.Queue(maxsize=self.AMIBROKER_QUEUE_SIZE)
+        errors = []
+
+        def writer():
+            """ Write (file, text) items in order, (file, None) closes file, None closes all files and ends """
+
+            handles = dict()
+            while True:
+                item = writes.get()
+                if item is None:
+                    break
+                file, text = item
+                try:
+                    if text is None:
+                        handles.pop(file).close()
+                    elif len(errors) == 0:
+                        if file not in handles:
+                            handles[file] = gzip.open(file, 'wt', newline='') if compress \
+                                else open(file, 'w', newline='')
+                        handles[file].write(text)
+                except Exception as e:
+                    errors.append(e)
+
+            for handle in handles.values():
+                handle.close()
+
+        writer_thread = threading.Thread(target=writer)
+        writer_thread.start()
+
+        suffix = '.gz' if compress else ''
+        started, count, prev_symbol = set(), 0, None
+        try:
+            for chunk in self.access.contract_chunks(start_date, self.contract_table, chunksize):
+                chunk['ExpiryDate'] = dates.yyyy_mm_dd_to_yyyymmdd_series(chunk['ExpiryDate'])  # Amibroker format
+                chunk['AdjustedSymbol'] = chunk['Symbol'] + '-A'
+
+                for symbol, records in (chunk.groupby('Symbol', sort=False) if per_symbol else [(None, chunk)]):
+                    if per_symbol and prev_symbol not in [None, symbol]:  # files of the previous symbol are complete
+                        for file in self.amibroker_files(path, last_date, prev_symbol, suffix):
+                            writes.put((file, None))
+                    prev_symbol = symbol
+
+                    unadjusted_file, adjusted_file = self.amibroker_files(path, last_date, symbol, suffix)
+                    for file, columns in [(unadjusted_file, self.AMIBROKER_COLUMNS),
+                                          (adjusted_file, self.AMIBROKER_ADJUSTED_COLUMNS)]:
+                        text = records[columns].rename(columns={'AdjustedSymbol': 'Symbol'}).to_csv(
+                            sep=',', index=False, header=file not in started)
+                        started.add(file)
+                        writes.put((file, text))
+
+                count = count + len(chunk.index)
+        finally:
+            writes.put(None)
+            writer_thread.join()
+
+        if len(errors) > 0:
+            raise errors[0]
+
+        print('exported {} contract records till {} to {}'.format(count, last_date, path))
+
+        return count
+
+    @staticmethod
+    def amibroker_files(path, last_date, symbol=None, suffix=''):
+        """
+        Return (unadjusted file, adjusted file) of an Amibroker export, of symbol if passed
+        """
 
-        last_date = all_fields.iloc[-1]['Date']
+        name = path + last_date if symbol is None else '{}{}.{}'.format(path, last_date, symbol)
 
-        all_fields['ExpiryDate'] = all_fields['ExpiryDate'].apply(dates.yyyy_mm_dd_to_yyyymmdd)  # Update Expiry Date Format
-        unadjusted = all_fields[['Symbol', 'Date', 'Open', 'High', 'Low', 'Close', 'VolumeLots', 'OpenInterestLots',
-                        'ExpiryDate']]
-        unadjusted.to_csv(path + last_date + '.csv', sep=',', index=False)
+        return name + '.csv' + suffix, name + '.A.csv' + suffix
 
-        all_fields['Symbol'] = all_fields['Symbol'].apply(lambda s: s + '-A')
-        adjusted = all_fields[['Symbol', 'Date', 'AdjustedOpen', 'AdjustedHigh', 'AdjustedLow', 'AdjustedClose']]
-        adjusted.to_csv(path + last_date + '.A.csv', sep=',', index=False)
 
+worker_db = None  # DataDB of a worker process of DataDB.map_symbol_batches
+ROUND_TIE_TOLERANCE = 1e-6  # distance of a scaled price from .5 below which round_prices uses the builtin round
 
 
+def open_worker_db(db, type, holidays):
+    """
+    Open a read only DataDB once per worker process
+    """
 
+    global worker_db
+    worker_db = DataDB(db, type, holidays=holidays, read_only=True)
 
 
+def call_worker_db(method, args):
+    """
+    Call DataDB method of the worker process
+    :return: (result, peak RSS of the worker process during the call), the peak since the worker process started
+             where it can not be reset, the processes only live for one map_symbol_batches call
+    """
 
+    utils.reset_peak_rss()
+    result = getattr(worker_db, method)(*args)
 
+    return result, utils.peak_rss()
 
 
+def round_prices(prices, digits=2):
+    """
+    Round an array of prices like the builtin round, which rounds the exact value of each float, unlike np.round
+    which rounds the scaled value, e.g. round(2.675, 2) is 2.67 while np.round(2.675, 2) is 2.68. Both only differ
+    near ties of the scaled value, so only those prices are rounded with the builtin round
+    :param prices: numpy array of prices
+    :param digits: decimal digits
+    :return: numpy array of rounded prices of the same shape
+    """
 
+    scaled = prices * 10.0 ** digits
+    rounded = np.round(prices, digits)
 
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < ROUND_TIE_TOLERANCE
+    rounded[near_tie] = [round(price, digits) for price in prices[near_tie].tolist()]
 
+    return rounded
@@ -9,28 +9,85 @@ Created on Feb 21, 2017
 from datetime import datetime, date
 from dateutil.relativedelta import relativedelta
 import calendar
+import numpy as np
+import pandas as pd
 
 #adhoc_dates = [] # Can be initiated with dates in YYYY-MM-DD format
 yesterday = (date.today() - relativedelta(days=1)).strftime('%Y-%m-%d')
 ALL_DAYS = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
 WEEKENDS = ['Sunday', 'Saturday']
 WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+MONTHS_MM = {'JAN': '01',
+             'FEB': '02',
+             'MAR': '03',
+             'APR': '04',
+             'MAY': '05',
+             'JUN': '06',
+             'JUL': '07',
+             'AUG': '08',
+             'SEP': '09',
+             'OCT': '10',
+             'NOV': '11',
+             'DEC': '12',
+             'JANUARY': '01',
+             'FEBRUARY': '02',
+             'MARCH': '03',
+             'APRIL': '04',
+             'JUNE': '06',
+             'JULY': '07',
+             'AUGUST': '08',
+             'SEPTEMBER': '09',
+             'OCTOBER': '10',
+             'NOVEMBER': '11',
+             'DECEMBER': '12'
+             }
+
 
 def dates(start='2008-06-01', end=yesterday, days=ALL_DAYS):
     """Return all dates between start and end"""
 
-    dates = []
+    return date_strings(date_range(start, end, days))
+
+# Below functions work on numpy datetime64[D] arrays, day arithmetic on arrays instead of parsing each date
+
+def date_range(start='2008-06-01', end=yesterday, days=ALL_DAYS):
+    """
+    Return dates between start and end (both inclusive) falling on days
+    :param start: start date in YYYY-MM-DD format
+    :param end: end date in YYYY-MM-DD format
+    :param days: day names to keep, e.g. WEEKDAYS
+    :return: numpy datetime64[D] array, empty if start is after end
+    """
+
+    range_start, range_end = np.datetime64(start, 'D'), np.datetime64(end, 'D')
+    if range_end < range_start:
+        return np.array([], dtype='datetime64[D]')
+
+    return filter_days(np.arange(range_start, range_end + 1), days)
+
+def weekdays(values):
+    """Return weekday of each datetime64[D] value, Monday is 0"""
+
+    return (values.astype('datetime64[D]').astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
+
+def filter_days(values, days=ALL_DAYS):
+    """Return datetime64[D] values falling on day names in days"""
+
+    keep = [weekday for weekday, day in enumerate(calendar.day_name) if day in days]
+    if len(keep) == len(ALL_DAYS):
+        return values
+
+    return values[np.isin(weekdays(values), keep)]
+
+def date_array(values):
+    """Return dates in YYYY-MM-DD format as numpy datetime64[D] array"""
 
-    curr_date = (datetime.strptime(start, '%Y-%m-%d') - relativedelta(days=1)).strftime('%Y-%m-%d')
-    while curr_date < end:
-        curr_date_strp = datetime.strptime(curr_date, '%Y-%m-%d') + relativedelta(days=1)
-        curr_date = curr_date_strp.strftime('%Y-%m-%d')
-        if calendar.day_name[curr_date_strp.weekday()] in days:
-            dates.append(curr_date)
+    return np.array(values, dtype='datetime64[D]')
 
-    #dates.append(curr_date)
+def date_strings(values):
+    """Return datetime64[D] values as list of dates in YYYY-MM-DD format"""
 
-    return dates
+    return np.datetime_as_string(values, unit='D').tolist()
 
 # Below functions take YYYY-MM-DD as input date format
 def ddmmyy(date):
@@ -111,40 +168,43 @@ def dd_MMM_yyyy_to_yyyy_mm_dd(date):
 def ddmmyyyy_to_yyyy_mm_dd(date):
     return '{}-{}-{}'.format(date[4:8], date[2:4], date[0:2])
 
+# Below functions take a pandas Series or array of dates and convert each distinct value only once,
+# a bhavcopy column repeats a handful of distinct dates
+
+def convert_distinct(values, convert):
+    """
+    Apply a scalar date conversion once per distinct value
+    :param values: pandas Series or array of date strings
+    :param convert: scalar conversion function, e.g. ddMMMyyyy_to_yyyy_mm_dd
+    :return: pandas Series of converted dates, with index of values if passed a Series
+    """
+
+    values = values if isinstance(values, pd.Series) else pd.Series(values)
+    distinct = values.unique()
+
+    return values.map(dict(zip(distinct, [convert(value) for value in distinct])))
+
+def ddMMMyyyy_to_yyyy_mm_dd_series(values):
+    return convert_distinct(values, ddMMMyyyy_to_yyyy_mm_dd)
+
+def dd_MMM_yyyy_to_yyyy_mm_dd_series(values):
+    return convert_distinct(values, dd_MMM_yyyy_to_yyyy_mm_dd)
+
+def mm_dd_yyyy_to_yyyy_mm_dd_series(values):
+    return convert_distinct(values, mm_dd_yyyy_to_yyyy_mm_dd)
+
+def yyyy_mm_dd_to_yyyymmdd_series(values):
+    return convert_distinct(values, yyyy_mm_dd_to_yyyymmdd)
+
 # Below functions take Month name as input: full name of first three chars
 
 def mm(month):
     """Return month in MM format"""
 
-    months = {'JAN': '01',
-              'FEB': '02',
-              'MAR': '03',
-              'APR': '04',
-              'MAY': '05',
-              'JUN': '06',
-              'JUL': '07',
-              'AUG': '08',
-              'SEP': '09',
-              'OCT': '10',
-              'NOV': '11',
-              'DEC': '12',
-              'JANUARY': '01',
-              'FEBRUARY': '02',
-              'MARCH': '03',
-              'APRIL': '04',
-              'JUNE': '06',
-              'JULY': '07',
-              'AUGUST': '08',
-              'SEPTEMBER': '09',
-              'OCTOBER': '10',
-              'NOVEMBER': '11',
-              'DECEMBER': '12'
-              }
-
     month = month.upper()
 
-    if  month in months:
-        return months[month]
+    if  month in MONTHS_MM:
+        return MONTHS_MM[month]
     else:
         return None
 
@@ -198,12 +258,9 @@ def months(month, format='x'):
 def missing_dates(check_dates, days=ALL_DAYS):
 
     check_dates.sort()
-    all_dates = dates(start=check_dates[0], days=days)  # All dates starting from first date
-
-    missing_dates = list(set(all_dates) - set(check_dates))
-    missing_dates.sort()
+    all_dates = date_range(start=check_dates[0], days=days)  # All dates starting from first date
 
-    return missing_dates
+    return date_strings(np.setdiff1d(all_dates, date_array(check_dates)))
 
 
 adhoc_dates = ['2018-04-07', '2018-04-08', '2018-04-14', '2018-04-15', '2018-04-21', '2018-04-22', '2018-04-28',
@@ -1,9 +1,7 @@
 
-import csvhandler as ch
-import datadbhandler as dbhandler
 import os
+import pipeline
 from pympler.tracker import SummaryTracker
-import dates
 
 PATH = 'D:/Trading/mcxdata/'
 
@@ -12,37 +10,16 @@ DBPATH = 'db/db.db'
 CSVPATH = 'data/'
 CSVDELTAPATH = 'delta/'
 AMIBROKERPATH = 'amibroker/'
+STREAM = True  # load the raw files straight into the staging table, no renamed or formatted files
 
 
-tracker = SummaryTracker()
+if __name__ == '__main__':
+    tracker = SummaryTracker()
 
-path = PATH
-os.chdir(path)
+    path = PATH
+    os.chdir(path)
 
-ch.download_bhavcopy(path + CSVDELTAPATH, '2018-06-08')
+    # steps 0 - 12, steps 1 - 3 are one stream load step with STREAM, a failed run resumes from the failed step
+    pipeline.run('daily', pipeline.daily_steps(path, CSVDELTAPATH, RAWBKPPATH, AMIBROKERPATH, stream=STREAM), DBPATH)
 
-ch.ren_csv_files(path, CSVDELTAPATH, RAWBKPPATH)    # 1 : CSVPATH or CSVDELTAPATH
-start_date = ch.format_csv_files(path, CSVDELTAPATH)  # 2 : CSVPATH or CSVDELTAPATH
-
-if start_date is None:
-    exit()
-
-db = dbhandler.DataDB(DBPATH)
-
-db.load_table_from_csv(path + CSVDELTAPATH)  # 3 : CSVPATH or CSVDELTAPATH
-db.process_staging_data()  # 4
-db.write_expiries()  # 5
-
-#db.create_continuous_contracts() # 6
-db.append_continuous_contracts(start_date)  # 6.a
-
-db.manage_missed_records()  # 7
-
-db.update_continuous_contract()  # 8
-db.expiry_sanity_check()  # 9
-db.calculate_historical_multipliers()  # 10
-db.create_adjusted_contract()  # 11
-
-db.create_amibroker_import_files(AMIBROKERPATH, start_date) #12
-
-tracker.print_diff()
\ No newline at end of file
+    tracker.print_diff()
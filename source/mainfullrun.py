@@ -1,9 +1,6 @@
 
-import csvhandler as ch
-import datadbhandler as dbhandler
 import os
-from pympler.tracker import SummaryTracker
-import dates
+import pipeline
 
 PATH = 'D:/Trading/mcxdata/'
 
@@ -11,32 +8,19 @@ RAWBKPPATH = 'raw data/'
 DBPATH = 'db/db.db'
 CSVPATH = 'data/'
 CSVDELTAPATH = 'delta/'
-
-
-tracker = SummaryTracker()
-
-path = PATH
-os.chdir(path)
-
-#ch.ren_csv_files(path, CSVDELTAPATH, RAWBKPPATH)    # 1 : CSVPATH or CSVDELTAPATH
-#ch.format_csv_files(path, CSVDELTAPATH)  # 2 : CSVPATH or CSVDELTAPATH
-
-db = dbhandler.DataDB(DBPATH)
-
-db.load_table_from_csv(path + CSVPATH)  # 3 : CSVPATH or CSVDELTAPATH
-db.process_staging_data()  # 4
-db.write_expiries()  # 5
-
-db.create_continuous_contracts() # 6
-#db.append_continuous_contracts(start_date='2018-06-04')  # 6.a
-
-db.manage_missed_records()  # 7
-
-db.update_continuous_contract()  # 8
-db.expiry_sanity_check()  # 9
-db.calculate_historical_multipliers()  # 10
-db.create_adjusted_contract()  # 11
-
-db.create_amibroker_import_files(AMIBROKERPATH, start_date) #12
-
-tracker.print_diff()
\ No newline at end of file
+AMIBROKERPATH = 'amibroker/'
+STREAM = True  # load the raw files straight into the staging table, no renamed or formatted files
+WORKERS = os.cpu_count()  # worker processes for the per symbol work of steps 6 - 11
+BATCH_SYMBOLS = 5  # symbols read and written at a time by steps 6 - 11, bounds memory of the rebuild
+
+
+if __name__ == '__main__':
+    path = PATH
+    os.chdir(path)
+
+    # steps 1 - 12, steps 1 - 3 are one stream load step with STREAM, a failed run resumes from the failed step,
+    # peak RSS and traced peak are reported per step
+    steps = pipeline.full_steps(path, CSVPATH, RAWBKPPATH, AMIBROKERPATH, stream=STREAM)
+    #steps.append(pipeline.Step('vol oi contracts', lambda db, r: db.create_vol_oi_contracts(field='VolumeLots'),
+    #                           inputs=['tblDump', 'tblExpiries'], outputs=['tblFuturesVolOI']))  # 6.b : rolling on volume
+    pipeline.run('full', steps, DBPATH, trace_memory=True, workers=WORKERS, batch_symbols=BATCH_SYMBOLS)
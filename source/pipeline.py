@@ -0,0 +1,406 @@
+"""
+Created on Oct 18, 2026
+@author: Souvik
+@Program Function: Declarative pipeline of csvhandler and DataDB steps with checkpoints in the Bhavcopy DB
+
+
+"""
+
+import os
+import time
+import json
+from datetime import datetime
+import hashlib
+import threading
+import tracemalloc
+import dates, utils
+import csvhandler as ch
+import datadbhandler as dbhandler
+
+DONE = 'done'
+FAILED = 'failed'
+RUNNING = 'running'
+DOWNLOAD_START = '2008-06-01'  # first download date of an empty DB
+RSS_SAMPLE_SECONDS = 0.05  # interval of the RSS samples of a step where the peak RSS can not be reset
+MISSED_RECORDS_FILES = [dbhandler.DataDB.SELECTED_RECORDS_FILE, dbhandler.DataDB.ELIGIBLE_RECORDS_FILE]
+
+
+class Step:
+    """ One pipeline step: func(db, results) runs the step, results holds the result of the earlier steps
+    by step name. inputs and outputs are table names, files or folders, a step is skipped when its last run
+    completed and its inputs and params are unchanged since """
+
+    def __init__(self, name, func, inputs=[], outputs=[], params=None, stop_on_none=False):
+        """
+        :param name: step name, key of the checkpoint in tblPipelineSteps
+        :param func: func(db, results), the result is passed to later steps and kept in the checkpoint when it
+                     is a str, number, list or dict
+        :param inputs: tables, files and folders read by the step
+        :param outputs: tables, files and folders written by the step, Rows of the checkpoint is their record
+                        or file count
+        :param params: params(db, results) returning the arguments of the step that are not inputs
+        :param stop_on_none: stop the pipeline after the step when its result is None
+        """
+
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = params
+        self.stop_on_none = stop_on_none
+
+
+class RSSSampler(threading.Thread):
+    """ Sample the resident set size of this process until stopped, for the peak RSS of a step where the peak
+    of the process can not be reset """
+
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        """
+        :param interval: seconds between samples
+        """
+
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = utils.current_rss()
+        self.stopped = threading.Event()
+
+    def sample(self):
+
+        rss = utils.current_rss()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def run(self):
+
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        """
+        Stop sampling
+        :return: highest sampled RSS in bytes, None if not available
+        """
+
+        self.stopped.set()
+        self.join()
+        self.sample()
+
+        return self.peak
+
+
+class Pipeline:
+    """ Run steps in order, skipping completed steps with unchanged inputs. A run after a failed one resumes
+    from the failed step, the completed steps before it are skipped even if their inputs or params changed since.
+    Time, output rows and memory high-water marks of each step run are kept in its checkpoint """
+
+    def __init__(self, name, db, steps, trace_memory=False):
+        """
+        :param name: pipeline name, checkpoints of pipelines are kept apart
+        :param db: DataDB
+        :param steps: [Step]
+        :param trace_memory: trace python allocations with tracemalloc for the peak of each step, slows steps down
+        """
+
+        self.name = name
+        self.db = db
+        self.steps = steps
+        self.trace_memory = trace_memory
+        self.sampler = None
+
+    def source_state(self, source):
+        """
+        Return state of a table as (record count, last rowid), of a file or folder as the sorted
+        [(name, size, mtime)] of its files, None if source does not exist
+        """
+
+        state = self.db.access.table_state(source)
+        if state is not None:
+            return state
+        if os.path.isfile(source):
+            return [(source, os.path.getsize(source), os.path.getmtime(source))]
+        if not os.path.isdir(source):
+            return None
+
+        return sorted((f, os.path.getsize(source + f), os.path.getmtime(source + f))
+                      for f in os.listdir(source) if os.path.isfile(source + f))
+
+    def input_hash(self, step, results, versions):
+        """
+        Return fingerprint of the inputs and params of step, an input written by an earlier step is identified
+        by the checkpoint of that step in versions, other inputs by their state
+        """
+
+        params = None if step.params is None else step.params(self.db, results)
+        state = [(source, versions[source] if source in versions else self.source_state(source))
+                 for source in step.inputs]
+
+        return hashlib.sha1(repr((state, params)).encode()).hexdigest()
+
+    def row_count(self, step):
+        """
+        Return record count of the output tables plus file count of the output files and folders of step
+        """
+
+        rows = 0
+        for source in step.outputs:
+            state = self.source_state(source)
+            if isinstance(state, tuple):
+                rows += state[0]
+            elif state is not None:
+                rows += len(state)
+
+        return rows
+
+    def reset_peaks(self):
+        """
+        Start the memory high-water marks of a step, the RSS is sampled where the peak RSS can not be reset and
+        can be a little lower than the real peak
+        """
+
+        self.db.worker_peak_rss = None
+        self.sampler = None if utils.reset_peak_rss() or utils.current_rss() is None else RSSSampler()
+        if self.sampler is not None:
+            self.sampler.start()
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+
+    def peaks(self):
+        """
+        Return (peak RSS, peak of traced python allocations, peak RSS of the worker processes) in bytes since
+        reset_peaks, None if not available
+        """
+
+        peak_rss = utils.peak_rss() if self.sampler is None else self.sampler.stop()
+        self.sampler = None
+
+        return peak_rss, tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None, \
+            self.db.worker_peak_rss
+
+    def run(self, force=[]):
+        """
+        Run the pipeline
+        :param force: names of steps to run even if their inputs are unchanged, later steps reading their
+                      outputs run as well
+        :return: {step: result}
+        """
+
+        results, versions = dict(), dict()
+
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        # first step a previous run did not complete, e.g. the download start date of the daily steps moves on
+        # once process staging is done, so the steps before it are kept until it completes
+        statuses = self.db.access.pipeline_statuses(self.name)
+        unfinished = [i for i, step in enumerate(self.steps) if statuses.get(step.name) in [FAILED, RUNNING]]
+        resume_from = unfinished[0] if len(unfinished) > 0 else 0
+
+        for i, step in enumerate(self.steps):
+            input_hash = self.input_hash(step, results, versions)
+            checkpoint = self.db.access.pipeline_step(self.name, step.name)
+            completed = step.name not in force and checkpoint is not None and checkpoint[0] == DONE
+
+            if completed and (i < resume_from or checkpoint[1] == input_hash):
+                results[step.name] = None if checkpoint[2] is None else json.loads(checkpoint[2])
+                start_time = checkpoint[3]
+                print('{}: skipping {}, {}'.format(self.name, step.name,
+                                                   'inputs unchanged' if checkpoint[1] == input_hash
+                                                   else 'resuming from {}'.format(self.steps[resume_from].name)))
+            else:
+                resume_from = 0  # steps after a step run again follow their inputs
+                start_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+                self.db.access.save_pipeline_step(self.name, step.name, RUNNING, input_hash, None, start_time,
+                                                  None, None)
+                print('{}: running {}'.format(self.name, step.name))
+                self.reset_peaks()
+                t0 = time.perf_counter()
+
+                try:
+                    result = step.func(self.db, results)
+                except BaseException:
+                    self.db.conn.rollback()
+                    self.db.access.save_pipeline_step(self.name, step.name, FAILED, input_hash, None, start_time,
+                                                      time.perf_counter() - t0, None, *self.peaks())
+                    print('{}: {} failed, next run resumes from this step'.format(self.name, step.name))
+                    raise
+
+                seconds, rows = time.perf_counter() - t0, self.row_count(step)
+                peak_rss, peak_traced, peak_worker_rss = self.peaks()
+                stored = json.dumps(result) if isinstance(result, (str, int, float, list, dict)) else None
+                results[step.name] = None if stored is None else result
+                # inputs the step changed itself, like moved files, do not rerun it next time
+                self.db.access.save_pipeline_step(self.name, step.name, DONE,
+                                                  self.input_hash(step, results, versions), stored, start_time,
+                                                  seconds, rows, peak_rss, peak_traced, peak_worker_rss)
+                print('{}: {} done in {:.3f}s, {} output rows, peak RSS {}, traced peak {}, worker peak RSS {}'.format(
+                    self.name, step.name, seconds, rows, megabytes(peak_rss), megabytes(peak_traced),
+                    megabytes(peak_worker_rss)))
+
+            versions.update((source, (step.name, start_time)) for source in step.outputs)
+
+            if step.stop_on_none and results[step.name] is None:
+                print('{}: nothing to process after {}, stopping'.format(self.name, step.name))
+                break
+
+        return results
+
+
+def megabytes(size):
+    """
+    Format size in bytes as MB, n/a for None
+    """
+
+    return 'n/a' if size is None else '{:.1f} MB'.format(size / 1048576)
+
+
+def rebuild(db, table_name, func, *args):
+    """
+    Truncate table_name and run func, used by steps that build their table from scratch
+    """
+
+    db.access.execute('DELETE FROM {}'.format(table_name))
+    db.conn.commit()
+
+    return func(*args)
+
+
+def stream_load(db, path, csv_path, raw_bkp_path):
+    """
+    Load the raw bhavcopy files in csv_path into the staging table without writing renamed or formatted files,
+    the raw files are removed once the load is committed, their backup is kept in raw_bkp_path
+    :return: number of records loaded
+    """
+
+    consumed = []
+    records = db.load_table_from_frames(ch.stream_csv_files(path, csv_path, raw_bkp_path, write_renamed=False,
+                                                            consumed=consumed))
+    for file in consumed:
+        utils.rmfile(file)
+
+    return records
+
+
+def load_steps(path, csv_path, raw_bkp_path, stream=False, stop_on_none=False):
+    """
+    Steps loading the bhavcopy files in csv_path into the staging table, rename, format and load or one stream
+    load step
+    :param stream: stream the raw files into the staging table, see stream_load
+    :param stop_on_none: stop the pipeline after the format step when there are no files, the stream load step
+                         leaves it to the process staging step
+    :return: [Step]
+    """
+
+    csv_folder = path + csv_path
+
+    if stream:
+        return [
+            Step('stream load', lambda db, r: stream_load(db, path, csv_path, raw_bkp_path),
+                 inputs=[csv_folder], outputs=['tblDumpStaging']),  # 1 - 3
+        ]
+
+    return [
+        Step('rename', lambda db, r: ch.ren_csv_files(path, csv_path, raw_bkp_path),
+             inputs=[csv_folder], outputs=[csv_folder + ch.RENAMED]),  # 1
+        Step('format', lambda db, r: ch.format_csv_files(path, csv_path),
+             inputs=[csv_folder + ch.RENAMED], outputs=[csv_folder + ch.FORMATTED], stop_on_none=stop_on_none),  # 2
+        Step('load', lambda db, r: db.load_table_from_csv(csv_folder),
+             inputs=[csv_folder + ch.FORMATTED], outputs=['tblDumpStaging']),  # 3
+    ]
+
+
+def full_steps(path, csv_path, raw_bkp_path, amibroker_path, stream=False):
+    """
+    Steps rebuilding the DB from all files in csv_path
+    :param path: base path
+    :param csv_path: folder with bhavcopy files under path
+    :param raw_bkp_path: backup folder of raw files under path
+    :param amibroker_path: folder of Amibroker import files under path
+    :param stream: stream the raw files into the staging table instead of the rename, format and load steps
+    :return: [Step]
+    """
+
+    return load_steps(path, csv_path, raw_bkp_path, stream) + [
+        Step('process staging', lambda db, r: db.process_staging_data(),
+             inputs=['tblDumpStaging'], outputs=['tblDump']),  # 4
+        Step('write expiries', lambda db, r: db.write_expiries(),
+             inputs=['tblDump'], outputs=['tblExpiries']),  # 5
+        Step('continuous contracts', lambda db, r: rebuild(db, 'tblFutures', db.create_continuous_contracts),
+             inputs=['tblDump', 'tblExpiries'], outputs=['tblFutures']),  # 6
+        Step('missed records', lambda db, r: db.manage_missed_records(),
+             inputs=['tblDump', 'tblFutures'], outputs=MISSED_RECORDS_FILES),  # 7
+        Step('update continuous contract', lambda db, r: db.update_continuous_contract(),
+             inputs=['tblFutures'] + MISSED_RECORDS_FILES, outputs=['tblFutures']),  # 8
+        Step('expiry sanity check', lambda db, r: db.expiry_sanity_check(persist=True),
+             inputs=['tblFutures'], outputs=['tblExpiryViolations']),  # 9
+        Step('historical multipliers', lambda db, r: db.calculate_historical_multipliers('refresh'),
+             inputs=['tblFutures'], outputs=['tblMultipliers']),  # 10
+        Step('adjusted contract', lambda db, r: rebuild(db, 'tblContract', db.create_adjusted_contract),
+             inputs=['tblFutures', 'tblMultipliers'], outputs=['tblContract']),  # 11
+        Step('amibroker', lambda db, r: db.create_amibroker_import_files(amibroker_path),
+             inputs=['tblContract', 'tblAdjustmentFactors'], outputs=[amibroker_path]),  # 12
+    ]
+
+
+def daily_steps(path, csv_delta_path, raw_bkp_path, amibroker_path, stream=False):
+    """
+    Steps downloading the bhavcopy files after the last date in the DB and appending them, steps after
+    process staging only read and write the symbols and dates of the staged records
+    :param path: base path
+    :param csv_delta_path: download folder under path
+    :param raw_bkp_path: backup folder of raw files under path
+    :param amibroker_path: folder of Amibroker import files under path
+    :param stream: stream the raw files into the staging table instead of the rename, format and load steps
+    :return: [Step]
+    """
+
+    csv_folder = path + csv_delta_path
+    staged = 'process staging'  # result of process_staging_data, the date range every later step is limited to
+
+    def download_start(db, r):
+        return dates.relativedate(db.calendar.trading_days[-1], days=1) if len(db.calendar) > 0 else DOWNLOAD_START
+
+    def download_dates(db, r):
+        # the end date moves every day, so a day without new files downloads again the next day
+        return download_start(db, r), dates.yesterday
+
+    def first_date(r):
+        # date of the first new file, the stream load step has no format step result
+        return r[staged]['start'] if stream else r['format']
+
+    return [
+        Step('download', lambda db, r: ch.download_bhavcopy(csv_folder, download_start(db, r)),
+             params=download_dates, outputs=[csv_folder]),  # 0
+    ] + load_steps(path, csv_delta_path, raw_bkp_path, stream, stop_on_none=True) + [
+        Step(staged, lambda db, r: db.process_staging_data(),
+             inputs=['tblDumpStaging'], outputs=['tblDump'], stop_on_none=True),  # 4
+        Step('write expiries', lambda db, r: db.write_expiries(r[staged]),
+             inputs=['tblDump'], outputs=['tblExpiries']),  # 5
+        Step('append continuous contracts', lambda db, r: db.append_continuous_contracts(first_date(r)),
+             inputs=['tblDump', 'tblExpiries'], outputs=['tblFutures']),  # 6.a
+        Step('missed records', lambda db, r: db.manage_missed_records(date_range=r[staged]),
+             inputs=['tblDump', 'tblFutures'], outputs=MISSED_RECORDS_FILES),  # 7
+        Step('update continuous contract', lambda db, r: db.update_continuous_contract(),
+             inputs=['tblFutures'] + MISSED_RECORDS_FILES, outputs=['tblFutures']),  # 8
+        Step('expiry sanity check',
+             lambda db, r: db.expiry_sanity_check(persist=True, fail=True, date_range=r[staged]),
+             inputs=['tblFutures'], outputs=['tblExpiryViolations']),  # 9
+        Step('historical multipliers', lambda db, r: db.calculate_historical_multipliers(date_range=r[staged]),
+             inputs=['tblFutures'], outputs=['tblMultipliers']),  # 10
+        Step('adjusted contract', lambda db, r: db.create_adjusted_contract(date_range=r[staged]),
+             inputs=['tblFutures', 'tblMultipliers'], outputs=['tblContract']),  # 11
+        Step('amibroker', lambda db, r: db.create_amibroker_import_files(amibroker_path, first_date(r)),
+             inputs=['tblContract', 'tblAdjustmentFactors'], outputs=[amibroker_path]),  # 12
+    ]
+
+
+def run(name, steps, db_path, force=[], trace_memory=False, **kwargs):
+    """
+    Open the DB and run steps as pipeline name, relative paths are resolved from the working directory
+    :param trace_memory: report the peak of traced python allocations of each step, see Pipeline
+    :param kwargs: DataDB arguments, batch_symbols bounds the memory of the per symbol steps
+    :return: {step: result}
+    """
+
+    db = dbhandler.DataDB(db_path, **kwargs)
+
+    return Pipeline(name, db, steps, trace_memory).run(force)
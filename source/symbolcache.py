@@ -0,0 +1,101 @@
+"""
+Created on Oct 18, 2026
+@author: Souvik
+@Program Function: On-disk per symbol cache of tblDump records
+
+
+"""
+
+import os
+import utils
+import pandas as pd
+import pickle as pkl
+
+
+class SymbolCache:
+    """ Per symbol columnar files of tblDump records sorted by Date, ExpiryDate"""
+
+    # constants
+
+    WATERMARK_FILE = 'watermarks.pkl'
+    SORT_COLUMNS = ['Date', 'ExpiryDate']
+
+    def __init__(self, path):
+
+        if path[-1:] != '/':
+            path = path + '/'
+
+        self.path = path
+        utils.mkdir(path)
+
+        try:
+            with open(path + self.WATERMARK_FILE, 'rb') as f:
+                self.watermarks = pkl.load(f)
+        except (OSError, EOFError):
+            self.watermarks = dict()
+
+    def symbol_file(self, symbol):
+
+        return '{}{}.pkl'.format(self.path, symbol)
+
+    def save_watermarks(self):
+
+        with open(self.path + self.WATERMARK_FILE, 'wb') as f:
+            pkl.dump(self.watermarks, f)
+
+    def is_valid(self, symbol, watermark):
+        """
+        Check cached records for symbol are current
+        :param symbol: symbol
+        :param watermark: (last date, record count) of symbol in tblDump
+        :return: True if cached records were written at watermark
+        """
+
+        return watermark is not None and self.watermarks.get(symbol) == watermark \
+               and os.path.exists(self.symbol_file(symbol))
+
+    def write(self, symbol, df, watermark):
+        """
+        Replace cached records for symbol
+        :param symbol: symbol
+        :param df: all tblDump records for symbol
+        :param watermark: (last date, record count) of symbol in tblDump
+        """
+
+        df = df.sort_values(self.SORT_COLUMNS, kind='mergesort').reset_index(drop=True)
+        df.to_pickle(self.symbol_file(symbol))
+
+        self.watermarks[symbol] = watermark
+        self.save_watermarks()
+
+    def update(self, symbol, df, start, end, watermark):
+        """
+        Replace cached records for symbol between start and end (both inclusive) with df
+        :param symbol: symbol
+        :param df: tblDump records for symbol between start and end
+        :param start: date range start in YYYY-MM-DD format
+        :param end: date range end in YYYY-MM-DD format
+        :param watermark: (last date, record count) of symbol in tblDump after the update
+        """
+
+        cached = pd.read_pickle(self.symbol_file(symbol))
+        cached = cached[(cached['Date'] < start) | (cached['Date'] > end)]
+
+        self.write(symbol, pd.concat([cached, df], axis=0), watermark)
+
+    def invalidate(self, symbol):
+
+        self.watermarks.pop(symbol, None)
+        self.save_watermarks()
+
+    def read(self, symbol, start='1900-01-01', end='2100-12-31'):
+        """
+        Return cached records for symbol between start and end (both inclusive)
+        """
+
+        df = pd.read_pickle(self.symbol_file(symbol))
+
+        start_idx = df['Date'].searchsorted(start, side='left')
+        end_idx = df['Date'].searchsorted(end, side='right')
+
+        return df.iloc[start_idx:end_idx].reset_index(drop=True)
@@ -0,0 +1,115 @@
+"""
+Created on Oct 18, 2026
+@author: Souvik
+@Program Function: Trading day calendar with binary search lookups
+
+
+"""
+
+import numpy as np
+
+
+class TradingCalendar:
+    """ Sorted trading days with 1 based trading day indices, dates after the last trading day are projected
+    on weekdays excluding holidays"""
+
+    # constants
+
+    MAX_GAP_DAYS = 11  # a non trading day maps to the previous trading day at most this many days before
+    NOT_FOUND = 0  # index returned by indices for dates without a trading day, indices start at 1
+    WEEKMASK = 'Mon Tue Wed Thu Fri'
+
+    def __init__(self, trading_days, holidays=[]):
+        """
+        :param trading_days: trading days in YYYY-MM-DD format, sorted ascending
+        :param holidays: exchange holidays in YYYY-MM-DD format, skipped when projecting dates after the last
+                         trading day
+        """
+
+        self.trading_days = list(trading_days)
+        self.days = np.array(self.trading_days, dtype='datetime64[D]')
+
+        future_holidays = [holiday for holiday in holidays
+                           if len(self.trading_days) == 0 or holiday > self.trading_days[-1]]
+        self.busdaycal = np.busdaycalendar(weekmask=self.WEEKMASK,
+                                           holidays=np.array(future_holidays, dtype='datetime64[D]'))
+
+    def __len__(self):
+
+        return len(self.trading_days)
+
+    def position(self, date):
+        """
+        Return 0 based position of the last trading day on or before date within MAX_GAP_DAYS, None if not found
+        """
+
+        pos = int(np.searchsorted(self.days, np.datetime64(date, 'D'), side='right')) - 1
+        if pos < 0 or (np.datetime64(date, 'D') - self.days[pos]).astype(int) > self.MAX_GAP_DAYS:
+            return None
+
+        return pos
+
+    def projected_index(self, date):
+        """
+        Return trading day index of a date after the last trading day, counting weekdays that are not holidays
+        """
+
+        weekdays = np.busday_count(self.days[-1], np.datetime64(date, 'D') + 1, busdaycal=self.busdaycal)
+
+        return len(self.days) + int(weekdays) - 1
+
+    def index(self, date):
+        """
+        Return trading day index of date
+        :param date: date in YYYY-MM-DD format
+        :return: index of date if a trading day, else of the previous trading day within MAX_GAP_DAYS,
+                 projected index if after the last trading day, None otherwise
+        """
+
+        if date > self.trading_days[-1]:
+            return self.projected_index(date)
+
+        pos = self.position(date)
+
+        return None if pos is None else pos + 1
+
+    def previous(self, date):
+        """
+        Return date itself if a trading day, else the previous trading day within MAX_GAP_DAYS, None if not found
+        """
+
+        pos = self.position(date)
+
+        return None if pos is None else self.trading_days[pos]
+
+    def date(self, idx):
+        """
+        Return trading day of index idx, None if idx is out of range
+        """
+
+        if idx < 1 or idx > len(self.trading_days):
+            return None
+
+        return self.trading_days[idx - 1]
+
+    def indices(self, dates):
+        """
+        Vectorized index over a whole date column
+        :param dates: pandas Series, array or list of dates in YYYY-MM-DD format
+        :return: numpy array of trading day indices, NOT_FOUND for dates index returns None for
+        """
+
+        values = np.array(dates, dtype='datetime64[D]')
+        result = np.full(len(values), self.NOT_FOUND, dtype=np.int64)
+        if len(values) == 0 or len(self.days) == 0:
+            return result
+
+        pos = np.searchsorted(self.days, values, side='right') - 1
+        found = (pos >= 0) & ((values - self.days[pos.clip(0)]).astype(np.int64) <= self.MAX_GAP_DAYS)
+        result[found] = pos[found] + 1
+
+        future = values > self.days[-1]
+        result[future] = len(self.days) + np.busday_count(self.days[-1], values[future] + 1,
+                                                          busdaycal=self.busdaycal) - 1
+
+        return result
@@ -6,7 +6,7 @@ Created on Mar 10, 2017
 
 """
 
-import os, shutil
+import os, sys, shutil
 
 
 def mkdir(path):
@@ -19,6 +19,11 @@ def rmdir(path):
     if os.path.exists(path):
         shutil.rmtree(path)
 
+def rmfile(path):
+
+    if os.path.exists(path):
+        os.remove(path)
+
 def copy_files(src_path, dest_path, files):
 
     if src_path[-1:] != '/':
@@ -38,3 +43,87 @@ def copy_files(src_path, dest_path, files):
     print('{} files copied'.format(count))
 
 
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of this process to its current size, Linux only
+    :return: True if reset, else peak_rss keeps returning the peak since the process started
+    """
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def proc_status(field):
+    """
+    Return a memory field of /proc/self/status like VmRSS or VmHWM in bytes, Linux only
+    """
+
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+def process_memory_counters():
+    """
+    Return PROCESS_MEMORY_COUNTERS of this process, Windows only, None if not available
+    """
+
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    kernel32 = ctypes.windll.kernel32
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    kernel32.K32GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters),
+                                                 wintypes.DWORD]
+    if not kernel32.K32GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+        return None
+
+    return counters
+
+
+def current_rss():
+    """
+    Return resident set size of this process in bytes, None if not available
+    """
+
+    if sys.platform.startswith('linux'):
+        return proc_status('VmRSS')
+
+    if os.name == 'nt':
+        counters = process_memory_counters()
+        return None if counters is None else counters.WorkingSetSize
+
+    return None
+
+
+def peak_rss():
+    """
+    Return peak resident set size of this process in bytes, None if not available
+    """
+
+    if sys.platform.startswith('linux'):
+        return proc_status('VmHWM')
+
+    if os.name == 'nt':
+        counters = process_memory_counters()
+        return None if counters is None else counters.PeakWorkingSetSize
+
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak if sys.platform == 'darwin' else peak * 1024  # bytes on macOS, kilobytes elsewhere
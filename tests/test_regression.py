@@ -0,0 +1,278 @@
+"""
+Created on Oct 18, 2026
+@author: Souvik
+@Program Function: Regression test of the contract building stages against the original implementation on a
+                   small synthetic Bhavcopy DB
+
+
+"""
+
+import os
+import re
+import sys
+import random
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import unittest
+from datetime import date, timedelta
+import pandas as pd
+
+SOURCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'source')
+sys.path.insert(0, SOURCE_PATH)
+
+import benchmark
+import csvhandler as ch
+import datadbhandler as dbhandler
+
+MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+PRE_HEADER = ['Date', 'Symbol', 'Expiry Date', 'Open', 'High', 'Low', 'Close', 'Previous Close', 'Volume',
+              "Volume(In 000's)", 'Value', 'Open Interest']
+POST_HEADER = ['Date', 'Instrument Name', 'Symbol', 'Expiry Date', 'Option Type', 'Strike Price', 'Open', 'High',
+               'Low', 'Close', 'Previous Close', 'Volume(Lots)', "Volume(In 000's)", 'Value(Lacs)',
+               'Open Interest(Lots)']
+SYMBOLS = {'ALUMINIUM': 20, 'CRUDEOIL': 19, 'GOLD': 5, 'COTTON': 30}  # symbol: expiry day of month
+START, END = date(2016, 10, 3), date(2017, 9, 29)
+POST_LAYOUT = date(2017, 5, 12)  # files after it have the Instrument Name column
+TEXT_DATES = date(2017, 3, 3)  # dates after it are written as DD MON YYYY
+CUTOFF = '2017-09-14'  # the daily run appends the files after it
+
+TABLES = [('tblDump', 'Symbol, Date, ExpiryDate'), ('tblExpiries', 'Symbol, ExpiryDate'),
+          ('tblFutures', 'Symbol, Date'), ('tblMultipliers', 'Symbol, RolloverDate'), ('tblContract', 'Symbol, Date')]
+FILES = [dbhandler.DataDB.SELECTED_RECORDS_FILE, dbhandler.DataDB.ELIGIBLE_RECORDS_FILE,
+         dbhandler.DataDB.DUPLICATE_RECORDS_FILE, dbhandler.DataDB.DUPLICATE_IGNORED_FILE]
+
+# Full rebuild with the original implementation, run in a separate process with its source first on sys.path
+BASELINE_SCRIPT = """
+import sys
+sys.path.insert(0, sys.argv[1])
+import csvhandler as ch
+from datadbhandler import DataDB
+ch.ren_csv_files('./', 'data/', 'raw data/')
+ch.format_csv_files('./', 'data/')
+db = DataDB('db/db.db')
+db.load_table_from_csv('./data/')
+db.process_staging_data()
+db.write_expiries()
+db.create_continuous_contracts()
+db.manage_missed_records()
+db.update_continuous_contract()
+db.expiry_sanity_check()
+db.calculate_historical_multipliers()
+db.create_adjusted_contract()
+"""
+
+
+def expiry(year, month, day):
+    """
+    Return the weekday on or before day of month
+    """
+
+    d = date(year, month, day)
+    while d.weekday() >= 5:
+        d -= timedelta(days=1)
+
+    return d
+
+
+def build_fixture(root, seed=1):
+    """
+    Write raw bhavcopy files of SYMBOLS from START to END in both file layouts and date formats, with missing days,
+    gaps in the near expiry, padded symbols and an empty file, and an empty schema DB
+    :param root: base path, with data, raw data and db folders
+    """
+
+    rnd = random.Random(seed)
+
+    for folder in ['data', 'raw data', 'db']:
+        os.makedirs(os.path.join(root, folder))
+
+    with open(os.path.join(SOURCE_PATH, 'sqlfile1.sql')) as f:
+        schema = f.read()
+    conn = sqlite3.connect(os.path.join(root, 'db/db.db'))
+    for stmt in re.findall(r'CREATE (?:TABLE|INDEX|UNIQUE INDEX)[^;]*?\)\s*\n', schema, re.S):
+        conn.execute(stmt)
+    conn.commit()
+    conn.close()
+
+    prices = {symbol: 100.0 + 50 * i for i, symbol in enumerate(SYMBOLS)}
+    d = START
+    while d <= END:
+        if d.weekday() < 5 and rnd.random() > 0.03:
+            rows = []
+            for symbol, expiry_day in SYMBOLS.items():
+                prices[symbol] *= 1 + rnd.uniform(-0.02, 0.02)
+                expiries = [expiry(d.year + (d.month + k - 1) // 12, (d.month + k - 1) % 12 + 1,
+                                   min(expiry_day, 28))
+                            for k in range(4)]
+                for j, e in enumerate([e for e in expiries if e >= d][:3]):
+                    if j == 0 and rnd.random() < 0.04:
+                        continue
+                    p = prices[symbol] * (1 + 0.01 * j)
+                    o, h, l, c = round(p, 2), round(p * 1.01, 2), round(p * 0.99, 2), round(p * 1.002, 2)
+                    vol = int(rnd.uniform(100, 1000) * (3 - j) ** 2)
+                    oi = int(vol * rnd.uniform(1, 3))
+                    ds = d.strftime('%m/%d/%Y') if d <= TEXT_DATES else \
+                        '{:02d} {} {}'.format(d.day, MONTHS[d.month - 1], d.year)
+                    es = '{:02d}{}{}'.format(e.day, MONTHS[e.month - 1], e.year)
+                    sym = symbol + ('  ' if rnd.random() < 0.5 else '')
+                    if d > POST_LAYOUT:
+                        rows.append([ds, 'FUTCOM', sym, es, '-', 0, o, h, l, c, o, vol, vol * 2,
+                                     round(vol * c / 100, 2), oi])
+                    else:
+                        rows.append([ds, sym, es, o, h, l, c, o, vol, vol * 2, round(vol * c / 100, 2), oi])
+
+            with open(os.path.join(root, 'data', 'BhavCopyDateWise_{}.csv'.format(d.strftime('%d%m%Y'))), 'w') as f:
+                f.write(','.join('"{}"'.format(x) for x in (POST_HEADER if d > POST_LAYOUT else PRE_HEADER)) + '\n')
+                for row in rows:
+                    f.write(','.join('"{}"'.format(x) if isinstance(x, str) else str(x) for x in row) + '\n')
+        d += timedelta(days=1)
+
+    with open(os.path.join(root, 'data', 'BhavCopyDateWise_01012017.csv'), 'w') as f:
+        f.write(','.join(PRE_HEADER) + '\n')
+
+
+def read_outputs(root):
+    """
+    Return {table: DataFrame} of the tables in TABLES and {file: text} of the files in FILES written under root
+    """
+
+    conn = sqlite3.connect(os.path.join(root, 'db/db.db'))
+    outputs = {table: pd.read_sql_query('SELECT * FROM {} ORDER BY {}'.format(table, key), conn)
+               for table, key in TABLES}
+    conn.close()
+
+    for file in FILES:
+        if os.path.exists(os.path.join(root, file)):
+            with open(os.path.join(root, file)) as f:
+                outputs[file] = f.read()
+
+    return outputs
+
+
+class RegressionTest(unittest.TestCase):
+    """ Full rebuild and daily append of the synthetic DB compared with the full rebuild of the original
+    implementation """
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.work_path = tempfile.mkdtemp()
+        cls.fixture_path = os.path.join(cls.work_path, 'fixture')
+        build_fixture(cls.fixture_path)
+
+        baseline_path = cls.copy_fixture('baseline')
+        try:
+            source_path = benchmark.checkout_source(tempfile.mkdtemp(dir=cls.work_path))
+        except (OSError, subprocess.CalledProcessError) as e:
+            shutil.rmtree(cls.work_path, ignore_errors=True)
+            raise unittest.SkipTest('original implementation not available from git: {}'.format(e))
+
+        subprocess.run([sys.executable, '-c', BASELINE_SCRIPT, source_path], cwd=baseline_path, check=True,
+                       stdout=subprocess.DEVNULL)
+        cls.baseline = read_outputs(baseline_path)
+
+    @classmethod
+    def tearDownClass(cls):
+
+        shutil.rmtree(cls.work_path, ignore_errors=True)
+
+    @classmethod
+    def copy_fixture(cls, name):
+
+        path = os.path.join(cls.work_path, name)
+        shutil.copytree(cls.fixture_path, path)
+
+        return path
+
+    def setUp(self):
+
+        self.cwd = os.getcwd()
+
+    def tearDown(self):
+
+        os.chdir(self.cwd)
+
+    def full_rebuild(self, path, **kwargs):
+        """
+        Run the full rebuild stages on the fixture copy in path, stages write their csv files in the working
+        directory
+        :param kwargs: DataDB arguments
+        """
+
+        os.chdir(path)
+
+        ch.ren_csv_files('./', 'data/', 'raw data/')
+        ch.format_csv_files('./', 'data/')
+        db = dbhandler.DataDB('db/db.db', **kwargs)
+        db.load_table_from_csv('./data/')
+        db.process_staging_data()
+        db.write_expiries()
+        db.create_continuous_contracts()
+        db.manage_missed_records()
+        db.update_continuous_contract()
+        db.expiry_sanity_check()
+        db.calculate_historical_multipliers()
+        db.create_adjusted_contract()
+        del db
+
+    def assertSameOutputs(self, outputs, names):
+
+        for name in names:
+            with self.subTest(output=name):
+                self.assertEqual(name in outputs, name in self.baseline)
+                if isinstance(outputs.get(name), pd.DataFrame):
+                    pd.testing.assert_frame_equal(outputs[name], self.baseline[name])
+                elif name in outputs:
+                    self.assertEqual(outputs[name], self.baseline[name])
+
+    def test_full_rebuild(self):
+
+        path = self.copy_fixture('serial')
+        self.full_rebuild(path)
+        outputs = read_outputs(path)
+
+        self.assertSameOutputs(outputs, [table for table, key in TABLES] + FILES)
+
+    def test_full_rebuild_workers(self):
+
+        path = self.copy_fixture('workers')
+        self.full_rebuild(path, workers=2, batch_symbols=1)
+        outputs = read_outputs(path)
+
+        self.assertSameOutputs(outputs, [table for table, key in TABLES] + FILES)
+
+    def test_daily_delta(self):
+        """
+        Full rebuild till CUTOFF and a daily append of the files after it limited to the staged date range, the
+        tables match the full rebuild of all files. They are compared with the original full rebuild, as the
+        original daily append gave the first missed record of a rollover the multiplier of the next one
+        """
+
+        path = self.copy_fixture('daily')
+        os.makedirs(os.path.join(path, 'delta'))
+        for file in os.listdir(os.path.join(path, 'data')):
+            if ch.raw_file_date(file) > CUTOFF:
+                shutil.move(os.path.join(path, 'data', file), os.path.join(path, 'delta', file))
+        self.full_rebuild(path)
+
+        ch.ren_csv_files('./', 'delta/', 'raw data/')
+        start_date = ch.format_csv_files('./', 'delta/')
+        db = dbhandler.DataDB('db/db.db')
+        db.load_table_from_csv('./delta/')
+        date_range = db.process_staging_data()
+        db.write_expiries(date_range)
+        db.append_continuous_contracts(start_date)
+        db.manage_missed_records(date_range=date_range)
+        db.update_continuous_contract()
+        db.expiry_sanity_check(date_range=date_range)
+        db.calculate_historical_multipliers(date_range=date_range)
+        db.create_adjusted_contract(date_range=date_range)
+        del db
+
+        self.assertSameOutputs(read_outputs(path), [table for table, key in TABLES])
+
+
+if __name__ == '__main__':
+    unittest.main()